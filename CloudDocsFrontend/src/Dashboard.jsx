@@ -168,20 +168,27 @@ export default function Dashboard({ token, setToken, setToast }) {
 
   const fetchFiles = async () => {
     try {
-      const res = await fetch(`${API}/files`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      const data = await res.json();
       let fetchedFiles = [];
+      let cursor = null;
 
-      if (Array.isArray(data)) {
-        fetchedFiles = data;
-      } else if (Array.isArray(data.files)) {
-        fetchedFiles = data.files;
-      } else {
-        console.warn("Unexpected /files response:", data);
-        setFiles([]);
-      }
+      // /files is paginated: follow nextCursor until the last page
+      do {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+        const res = await fetch(`${API}/files${query}`, {
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        const data = await res.json();
+        cursor = null;
+
+        if (Array.isArray(data)) {
+          fetchedFiles = fetchedFiles.concat(data);
+        } else if (Array.isArray(data.files)) {
+          fetchedFiles = fetchedFiles.concat(data.files);
+          cursor = data.nextCursor;
+        } else {
+          console.warn("Unexpected /files response:", data);
+        }
+      } while (cursor);
       
       setFiles(fetchedFiles);
 
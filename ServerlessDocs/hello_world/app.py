@@ -1,20 +1,40 @@
 # pranesh1-2-3/docsystem/DocSystem-ayush/ServerlessDocs/hello_world/app.py
 
-from fastapi import FastAPI, Header, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Depends, Request, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from mangum import Mangum
-import boto3, uuid, time, json, requests
-from jose import jwt, jwk
-from jose.utils import base64url_decode
+import boto3, uuid, time, json, threading, hashlib, base64, re, bisect, heapq
+import asyncio, contextlib, contextvars, functools, os, random, urllib.parse, weakref, zipfile, zlib
+from collections import OrderedDict, defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 from fastapi.middleware.cors import CORSMiddleware
 
 # --- NEW IMPORTS ---
 from pydantic import BaseModel
 from typing import List, Optional
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
 
-ses = boto3.client("ses", region_name="ap-south-1")
 app = FastAPI()
-lambda_handler = Mangum(app)
+http_handler = Mangum(app)
+
+
+def lambda_handler(event, context):
+    # S3 "Object Created" events confirm batch uploads, SQS records are
+    # queued exports or share emails; everything else is HTTP
+    sources = {r.get("eventSource") for r in event.get("Records", [])}
+    if event.get("source") == "aws.s3" or "aws:s3" in sources:
+        with track_metrics({"Route": "event:s3"}):
+            return handle_s3_event(event)
+    if "aws:sqs" in sources and is_export_event(event):
+        with track_metrics({"Route": "event:export"}):
+            return handle_export_messages(event)
+    if "aws:sqs" in sources:
+        with track_metrics({"Route": "event:sqs"}):
+            return handle_share_messages(event)
+    return http_handler(event, context)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,35 +44,524 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-s3 = boto3.client("s3")
-ddb = boto3.resource("dynamodb")
-bedrock_runtime = boto3.client("bedrock-runtime", region_name="ap-south-1")
-table = ddb.Table("CloudDocsFiles")
+# --- LAZY AWS CLIENTS ---
+# Nothing AWS is built at import time: each client is created on first use,
+# from one shared boto3 session, so a cold start only pays for the clients
+# the request actually touches.
+AWS_CLIENT_CONFIG = Config(
+    tcp_keepalive=True,
+    retries={"mode": "standard", "max_attempts": 3},
+)
+# Bedrock calls are slow but must never hang: bounded connect and read
+# timeouts, and adaptive retries (jittered backoff, plus client-side rate
+# limiting once Bedrock starts throttling). Every attempt together has to
+# fit inside API Gateway's 29s (the function's Timeout is 31):
+# 2 * (1 + 12) plus at most 1s of backoff (total_max_attempts counts the
+# first try; max_attempts would not). Longer completions should use
+# the streaming endpoint, where the read timeout applies between events.
+BEDROCK_CLIENT_CONFIG = Config(
+    connect_timeout=1,
+    read_timeout=12,
+    retries={"mode": "adaptive", "total_max_attempts": 2},
+)
+_aws_session = None
+_aws_session_lock = threading.Lock()
+
+
+def aws_session() -> boto3.session.Session:
+    global _aws_session
+    with _aws_session_lock:
+        if _aws_session is None:
+            _aws_session = boto3.session.Session()
+        return _aws_session
+
+
+class LazyAWS:
+    """
+    Stand-in for a boto3 client or resource that builds the real one on
+    first attribute access (thread-safe) and forwards everything to it.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+def _client_config(backend: str, config: Optional[Config] = None) -> Config:
+    # One pooled connection per call the backend may have in flight
+    merged = AWS_CLIENT_CONFIG.merge(config) if config else AWS_CLIENT_CONFIG
+    return merged.merge(Config(max_pool_connections=BACKEND_CONCURRENCY[backend]))
+
+
+def _build_client(service: str, backend: str, region_name: Optional[str] = None, config: Optional[Config] = None):
+    session = aws_session()
+    with _aws_session_lock:
+        # boto3 sessions are not safe for concurrent client creation
+        client = session.client(service, region_name=region_name, config=_client_config(backend, config))
+    return instrument_client(client)
+
+
+def _build_resource(service: str, backend: str):
+    session = aws_session()
+    with _aws_session_lock:
+        resource = session.resource(service, config=_client_config(backend))
+    instrument_client(resource.meta.client)
+    return resource
+
+
+ses = LazyAWS(lambda: _build_client("ses", "ses", region_name="ap-south-1"))
+s3 = LazyAWS(lambda: _build_client("s3", "s3"))
+ddb = LazyAWS(lambda: _build_resource("dynamodb", "dynamodb"))
+bedrock_runtime = LazyAWS(lambda: _build_client("bedrock-runtime", "bedrock", region_name="ap-south-1",
+                                                 config=BEDROCK_CLIENT_CONFIG))
+table = LazyAWS(lambda: ddb.Table("CloudDocsFiles"))
+sqs = LazyAWS(lambda: _build_client("sqs", "sqs"))
+# --- END LAZY AWS CLIENTS ---
+# userId (HASH) + createdAt (RANGE), see template.yaml
+FILES_BY_CREATED_INDEX = "userId-createdAt-index"
 BUCKET = "clouddocs-uploads-bucket"
 
 COGNITO_REGION = "ap-south-1"
 USER_POOL_ID = "ap-south-1_pdj11qvfs"
+# --- ASYNC AWS EXECUTION LAYER ---
+# boto3 is blocking, so every AWS call runs on a sized thread pool. A
+# per-backend semaphore keeps a slow backend (Bedrock) from taking every
+# worker away from fast metadata reads (DynamoDB) in the same container.
+AWS_MAX_WORKERS = 32
+BACKEND_CONCURRENCY = {
+    "dynamodb": 16,
+    "s3": 16,
+    "bedrock": 4,
+    "ses": 4,
+    "sqs": 4,
+}
+aws_executor = ThreadPoolExecutor(max_workers=AWS_MAX_WORKERS, thread_name_prefix="aws")
+# asyncio primitives belong to one event loop, so keep a set per loop
+_backend_semaphores = weakref.WeakKeyDictionary()
+
+
+def _backend_semaphore(backend: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphores = _backend_semaphores.setdefault(loop, {})
+    if backend not in semaphores:
+        semaphores[backend] = asyncio.Semaphore(BACKEND_CONCURRENCY[backend])
+    return semaphores[backend]
+
+
+async def run_aws(backend: str, fn, *args, **kwargs):
+    """
+    Run a blocking AWS call on the executor, bounded by the backend's
+    semaphore. The caller's contextvars are carried into the worker thread.
+    A cancelled caller (a lost hedge, a client that went away) can't stop
+    the thread, so the slot is held until the call itself returns.
+    """
+    semaphore = _backend_semaphore(backend)
+    await semaphore.acquire()
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    try:
+        future = loop.run_in_executor(aws_executor, functools.partial(ctx.run, fn, *args, **kwargs))
+    except BaseException:
+        semaphore.release()
+        raise
+    _release_when_done(future, semaphore)
+    return await asyncio.shield(future)
+
+
+def _release_when_done(future: asyncio.Future, semaphore: asyncio.Semaphore):
+    def finished(done):
+        semaphore.release()
+        if not done.cancelled():
+            done.exception()  # retrieved, so an abandoned call's error isn't logged as unhandled
+
+    future.add_done_callback(finished)
+
+
+async def iterate_aws(backend: str, iterable):
+    """
+    Async iteration over a blocking AWS iterator (an event stream). Each
+    item is read on the executor, and the stream holds one slot of the
+    backend's semaphore until it is exhausted or the consumer stops. If the
+    consumer stops while a read is blocked, the slot is held until that
+    read returns, as in run_aws.
+    """
+    iterator = iter(iterable)
+    done = object()
+    semaphore = _backend_semaphore(backend)
+    await semaphore.acquire()
+    loop = asyncio.get_running_loop()
+    read = None
+    try:
+        while True:
+            read = loop.run_in_executor(aws_executor, next, iterator, done)
+            item = await asyncio.shield(read)
+            if item is done:
+                return
+            yield item
+    finally:
+        if read is not None and not read.done():
+            _release_when_done(read, semaphore)
+        else:
+            semaphore.release()
+# --- END ASYNC AWS EXECUTION LAYER ---
+
+
+# --- METRICS ---
+# Every HTTP request and every S3/SQS invocation gets a RequestMetrics in a
+# contextvar (run_aws carries it into worker threads). botocore event hooks
+# on each client add the time, retries and throttles of every AWS call to
+# it, and at the end one CloudWatch Embedded Metric Format document is
+# written for the request plus one per AWS service it called.
+METRICS_NAMESPACE = "CloudDocs"
+THROTTLE_ERROR_CODES = {
+    "Throttling", "ThrottlingException", "ThrottledException", "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException", "TooManyRequestsException", "SlowDown",
+}
+current_metrics = contextvars.ContextVar("current_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.aws = defaultdict(lambda: {"calls": 0, "ms": 0.0, "retries": 0, "throttles": 0, "errors": 0})
+        self._lock = threading.Lock()
+
+    def record_call(self, service: str, ms: float, retries: int, error_code: Optional[str]):
+        with self._lock:
+            stats = self.aws[service]
+            stats["calls"] += 1
+            stats["ms"] += ms
+            stats["retries"] += retries
+            if error_code:
+                stats["errors"] += 1
+                if error_code in THROTTLE_ERROR_CODES:
+                    stats["throttles"] += 1
+
+    def record_throttle(self, service: str):
+        # A throttled attempt that botocore is about to retry
+        with self._lock:
+            self.aws[service]["throttles"] += 1
+
+    def totals(self) -> dict:
+        with self._lock:
+            return {
+                "calls": sum(s["calls"] for s in self.aws.values()),
+                "ms": sum(s["ms"] for s in self.aws.values()),
+                "retries": sum(s["retries"] for s in self.aws.values()),
+                "throttles": sum(s["throttles"] for s in self.aws.values()),
+            }
+
+
+def _service_from_event(event_name: str) -> str:
+    # "after-call.dynamodb.Query" -> "dynamodb"
+    return event_name.split(".")[1]
+
+
+def _before_aws_call(context, **kwargs):
+    context["metrics_start"] = time.perf_counter()
+
+
+def _after_aws_call(event_name, parsed, context, **kwargs):
+    metrics = current_metrics.get()
+    start = context.get("metrics_start")
+    if metrics is None or start is None:
+        return
+    metadata = parsed.get("ResponseMetadata", {}) if isinstance(parsed, dict) else {}
+    error = parsed.get("Error", {}).get("Code") if isinstance(parsed, dict) else None
+    metrics.record_call(_service_from_event(event_name), (time.perf_counter() - start) * 1000,
+                        metadata.get("RetryAttempts", 0), error)
+
+
+def _after_aws_call_error(event_name, exception, context, **kwargs):
+    # Connection errors and read timeouts never reach after-call
+    metrics = current_metrics.get()
+    start = context.get("metrics_start")
+    if metrics is None or start is None:
+        return
+    retries = max(context.get("retries", {}).get("attempt", 1) - 1, 0)
+    metrics.record_call(_service_from_event(event_name), (time.perf_counter() - start) * 1000,
+                        retries, type(exception).__name__)
+
+
+def _on_needs_retry(event_name, response=None, attempts=1, **kwargs):
+    metrics = current_metrics.get()
+    if metrics is None or not response:
+        return
+    parsed = response[1]
+    if parsed.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES:
+        metrics.record_throttle(_service_from_event(event_name))
+
+
+def instrument_client(client):
+    events = client.meta.events
+    # First, so the timer also starts for calls a Stubber short-circuits
+    events.register_first("before-call.*.*", _before_aws_call)
+    events.register("after-call", _after_aws_call)
+    events.register("after-call-error", _after_aws_call_error)
+    events.register("needs-retry", _on_needs_retry)
+    return client
+
+
+class StdoutMetricsSink:
+    """One JSON line per document on stdout, where Lambda picks up EMF."""
+
+    def emit(self, document: dict):
+        print(json.dumps(document, separators=(",", ":")), flush=True)
+
+
+class InMemoryMetricsSink:
+    def __init__(self):
+        self.documents = []
+
+    def emit(self, document: dict):
+        self.documents.append(document)
+
+
+metrics_sink = StdoutMetricsSink()
+
+
+def emf_document(dimensions: dict, metrics: dict, units: dict) -> dict:
+    return {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [sorted(dimensions)],
+                "Metrics": [{"Name": name, "Unit": units[name]} for name in metrics],
+            }],
+        },
+        **dimensions,
+        **metrics,
+    }
+
+
+def emit_request_metrics(dimensions: dict, metrics: RequestMetrics, total_ms: float,
+                         properties: Optional[dict] = None):
+    totals = metrics.totals()
+    document = emf_document(
+        dimensions,
+        {
+            "Latency": round(total_ms, 2),
+            "AwsCalls": totals["calls"],
+            "AwsMs": round(totals["ms"], 2),
+            "AwsRetries": totals["retries"],
+            "AwsThrottles": totals["throttles"],
+        },
+        {"Latency": "Milliseconds", "AwsCalls": "Count", "AwsMs": "Milliseconds",
+         "AwsRetries": "Count", "AwsThrottles": "Count"},
+    )
+    # Properties are searchable in Logs Insights but are not metrics
+    document.update(properties or {})
+    metrics_sink.emit(document)
+    for service, stats in sorted(metrics.aws.items()):
+        metrics_sink.emit(emf_document(
+            {"Route": dimensions["Route"], "Service": service},
+            {"Calls": stats["calls"], "CallMs": round(stats["ms"], 2), "Retries": stats["retries"],
+             "Throttles": stats["throttles"], "Errors": stats["errors"]},
+            {"Calls": "Count", "CallMs": "Milliseconds", "Retries": "Count",
+             "Throttles": "Count", "Errors": "Count"},
+        ))
+
+
+@contextlib.contextmanager
+def track_metrics(dimensions: dict):
+    """Collects AWS call metrics for a non-HTTP invocation and emits them."""
+    metrics = RequestMetrics()
+    token = current_metrics.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        current_metrics.reset(token)
+        emit_request_metrics(dimensions, metrics, (time.perf_counter() - start) * 1000)
+# --- END METRICS ---
+
 JWKS_URL = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json"
-JWKS = requests.get(JWKS_URL).json()
+JWKS_TTL_SECONDS = 3600
+JWKS_MIN_REFRESH_SECONDS = 30
+JWKS_FETCH_TIMEOUT = 5
+
+
+# --- JWKS KEY MANAGER ---
+def fetch_jwks(url: str) -> dict:
+    import requests
+
+    resp = requests.get(url, timeout=JWKS_FETCH_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+
+class JWKSKeyManager:
+    """
+    Lazily loads the Cognito JWKS and keeps the constructed public keys in a
+    dict keyed by `kid`. Keys are refreshed after `ttl` seconds, and an unknown
+    `kid` triggers a single refetch shared by all concurrent callers
+    (Cognito rotates keys by publishing the new one before using it).
+    """
+
+    def __init__(self, url: str, fetcher=fetch_jwks, ttl: float = JWKS_TTL_SECONDS,
+                 min_refresh_interval: float = JWKS_MIN_REFRESH_SECONDS, clock=time.monotonic):
+        self.url = url
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.clock = clock
+        self._keys = {}
+        self._fetched_at = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _is_stale(self) -> bool:
+        return self._fetched_at is None or self.clock() - self._fetched_at > self.ttl
+
+    def _refresh(self, seen_generation: int, force: bool = False):
+        with self._lock:
+            # Another caller refreshed while we were waiting for the lock
+            if self._generation != seen_generation:
+                return
+            if force and self._fetched_at is not None \
+                    and self.clock() - self._fetched_at < self.min_refresh_interval:
+                return
+            from jose import jwk
+
+            jwks = self.fetcher(self.url)
+            keys = {}
+            for key in jwks.get("keys", []):
+                if "kid" in key:
+                    keys[key["kid"]] = jwk.construct(key)
+            self._keys = keys
+            self._fetched_at = self.clock()
+            self._generation += 1
+
+    def get_key(self, kid: str):
+        generation = self._generation
+        if self._is_stale():
+            try:
+                self._refresh(generation)
+            except Exception:
+                # Keep serving the previous key set if the refresh fails,
+                # and don't retry on every request while Cognito is unreachable
+                if not self._keys:
+                    raise
+                with self._lock:
+                    self._fetched_at = self.clock() - self.ttl + self.min_refresh_interval
+            generation = self._generation
+
+        key = self._keys.get(kid)
+        if key is None:
+            self._refresh(generation, force=True)
+            key = self._keys.get(kid)
+        if key is None:
+            raise KeyError(f"Unknown key id: {kid}")
+        return key
+
+    def invalidate(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._generation += 1
+
+
+jwks_keys = JWKSKeyManager(JWKS_URL)
+# --- END JWKS KEY MANAGER ---
+
+
+# --- EXPIRING LRU CACHE ---
+class ExpiringLRUCache:
+    """
+    Bounded, thread-safe LRU where every entry carries its own absolute
+    expiry (epoch seconds). Expired entries are dropped on lookup.
+    """
+
+    def __init__(self, maxsize: int, clock=time.time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if self.clock() >= expires_at:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at: float):
+        if expires_at <= self.clock():
+            return
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+TOKEN_CACHE_SIZE = 1024
+# Verified claims, keyed by sha256 of the raw token and evicted at its `exp`
+token_cache = ExpiringLRUCache(TOKEN_CACHE_SIZE)
+
+
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+# --- END EXPIRING LRU CACHE ---
 
 
 # --- NEW PYDANTIC MODEL ---
 class TagsUpdate(BaseModel):
     tags: List[str]
+    version: Optional[int] = None  # the version last seen; stale edits get a 409
 # --- END NEW MODEL ---
 
 # --- !! NEW MODEL FOR FILENAME UPDATE !! ---
 class FilenameUpdate(BaseModel):
     new_filename: str
+    version: Optional[int] = None
 # --- !! END NEW MODEL !! ---
 
 
-def verify_token(token: str):
+def verify_token(token: str, cache: Optional[ExpiringLRUCache] = token_cache):
+    # The cache key covers the signature, so a forged token never hits an
+    # entry stored for the genuine one.
+    cache_key = _token_cache_key(token) if cache is not None else None
+    if cache is not None:
+        claims = cache.get(cache_key)
+        if claims is not None:
+            return claims
+
+    # jose is only needed on a cache miss, so it is not imported at cold start
+    from jose import jwt
+    from jose.utils import base64url_decode
+
     try:
         headers = jwt.get_unverified_header(token)
-        kid = headers["kid"]
-        key = next(k for k in JWKS["keys"] if k["kid"] == kid)
-        public_key = jwk.construct(key)
+        public_key = jwks_keys.get_key(headers["kid"])
 
         message, encoded_sig = token.rsplit(".", 1)
         decoded_sig = base64url_decode(encoded_sig.encode())
@@ -63,14 +572,251 @@ def verify_token(token: str):
         claims = jwt.get_unverified_claims(token)
         if time.time() > claims["exp"]:
             raise HTTPException(status_code=401, detail="Token expired")
-
-        return claims
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
 
+    if cache is not None:
+        cache.set(cache_key, claims, claims["exp"])
+    return claims
+
+
+# --- SHARED AUTH DEPENDENCY ---
+def parse_bearer_token(authorization: Optional[str]) -> str:
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing token")
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Malformed Authorization header")
+    return parts[1]
+
+
+def require_auth(request: Request, Authorization: str = Header(None)) -> dict:
+    """
+    Parses and verifies the bearer token once per request. The claims are
+    stored on `request.state.claims` and the time spent on `request.state.auth_ms`.
+    """
+    start = time.perf_counter()
+    try:
+        claims = verify_token(parse_bearer_token(Authorization))
+    finally:
+        request.state.auth_ms = (time.perf_counter() - start) * 1000
+    request.state.claims = claims
+    return claims
+
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    """
+    Server-Timing header and EMF metrics for every request. For streamed
+    responses the timings cover the time to the first byte.
+    """
+    start = time.perf_counter()
+    metrics = RequestMetrics()
+    token = current_metrics.set(metrics)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        current_metrics.reset(token)
+        total_ms = (time.perf_counter() - start) * 1000
+        auth_ms = getattr(request.state, "auth_ms", None)
+        route = request.scope.get("route")
+        emit_request_metrics(
+            {"Route": f"{request.method} {route.path if route else 'unmatched'}"},
+            metrics,
+            total_ms,
+            {"StatusCode": status, "AuthMs": round(auth_ms, 2) if auth_ms is not None else None},
+        )
+
+    timings = []
+    if auth_ms is not None:
+        timings.append(f"auth;dur={auth_ms:.2f}")
+    aws = metrics.totals()
+    if aws["calls"]:
+        timings.append(f"aws;dur={aws['ms']:.2f};desc=\"{aws['calls']} calls\"")
+    timings.append(f"total;dur={total_ms:.2f}")
+    response.headers["Server-Timing"] = ", ".join(timings)
+    return response
+# --- END SHARED AUTH DEPENDENCY ---
+
+
+# --- BEDROCK INVOCATION LAYER ---
+# Every Bedrock call goes through invoke_bedrock, which consults a circuit
+# breaker: after BEDROCK_BREAKER_FAILURES consecutive failures (throttling,
+# timeouts, 5xx) calls fail fast with BedrockUnavailable for a cooldown,
+# then one probe is let through. Suggestions additionally run under a
+# latency budget with a hedged second request, and fall back to local
+# rule-based answers instead of waiting on an unhealthy model.
+BEDROCK_BREAKER_FAILURES = 5
+BEDROCK_BREAKER_COOLDOWN = 30
+SUGGESTION_LATENCY_BUDGET = 4.0
+SUGGESTION_HEDGE_AFTER = 1.5
+# Caller mistakes, not an unhealthy Bedrock
+BEDROCK_CLIENT_ERROR_CODES = {"ValidationException", "AccessDeniedException", "ResourceNotFoundException"}
+
+
+class BedrockUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = time.monotonic
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.clock() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print("Bedrock circuit closed")
+            self.reset()
+
+    def end_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"Bedrock circuit opened after {self.failures} failures")
+                self.opened_at = self.clock()
+
+
+bedrock_breaker = CircuitBreaker(BEDROCK_BREAKER_FAILURES, BEDROCK_BREAKER_COOLDOWN)
+
+
+def _is_bedrock_failure(error: Exception) -> bool:
+    if isinstance(error, BedrockUnavailable):
+        return False
+    if isinstance(error, ClientError):
+        return error.response["Error"]["Code"] not in BEDROCK_CLIENT_ERROR_CODES
+    return True
+
+
+def _call_bedrock(fn, **kwargs):
+    if not bedrock_breaker.allow():
+        raise BedrockUnavailable("Bedrock circuit is open")
+    try:
+        response = fn(**kwargs)
+    except Exception as e:
+        if _is_bedrock_failure(e):
+            bedrock_breaker.record_failure()
+        raise
+    else:
+        bedrock_breaker.record_success()
+    finally:
+        # A probe rejected as a caller error says nothing about Bedrock's
+        # health; let the next call probe instead
+        bedrock_breaker.end_probe()
+    return response
+
+
+def invoke_bedrock(body: dict, model_id: str) -> dict:
+    """The parsed response body of one invoke_model call."""
+    response = _call_bedrock(
+        bedrock_runtime.invoke_model,
+        body=json.dumps(body),
+        modelId=model_id,
+        contentType="application/json",
+        accept="application/json",
+    )
+    return json.loads(response["body"].read())
+
+
+def invoke_bedrock_stream(body: dict, model_id: str) -> dict:
+    return _call_bedrock(bedrock_runtime.invoke_model_with_response_stream,
+                         body=json.dumps(body), modelId=model_id)
+
+
+def response_text(response_body: dict) -> str:
+    return response_body.get("content", [{}])[0].get("text", "")
+
+
+async def run_bedrock_hedged(fn, *args, budget: Optional[float] = None, hedge_after: Optional[float] = None):
+    """
+    fn(*args) on the bedrock backend. If it has not answered after
+    `hedge_after` seconds a second, identical call is started and the first
+    to finish wins; past `budget` seconds BedrockUnavailable is raised and
+    the stragglers are left to finish on their own, each keeping its
+    bedrock slot until it does (see run_aws). fn must be idempotent.
+
+    Both clocks start when the first call gets a bedrock slot, not when it
+    is queued: time spent behind this container's other Bedrock calls says
+    nothing about Bedrock's health and must not trip the breaker.
+    """
+    budget = SUGGESTION_LATENCY_BUDGET if budget is None else budget
+    hedge_after = SUGGESTION_HEDGE_AFTER if hedge_after is None else hedge_after
+    loop = asyncio.get_running_loop()
+    started = loop.create_future()
+
+    def mark_started():
+        if not started.done():
+            started.set_result(loop.time())
+
+    def timed(*call_args):
+        loop.call_soon_threadsafe(mark_started)
+        return fn(*call_args)
+
+    first = asyncio.ensure_future(run_aws("bedrock", timed, *args))
+    pending = {first}
+    hedged = False
+    try:
+        await asyncio.wait({first, started}, return_when=asyncio.FIRST_COMPLETED)
+        deadline = (started.result() if started.done() else loop.time()) + budget
+        while pending:
+            wait = deadline - loop.time()
+            if not hedged:
+                wait = min(wait, hedge_after)
+            done, pending = await asyncio.wait(pending, timeout=max(wait, 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            if done and not pending:
+                return done.pop().result()  # every attempt failed: raise its error
+            if loop.time() >= deadline:
+                break
+            # Hedging a throttled or failing model would only add load
+            if not done and not hedged and bedrock_breaker.state == "closed":
+                hedged = True
+                pending.add(asyncio.ensure_future(run_aws("bedrock", fn, *args)))
+    finally:
+        for task in pending:
+            task.cancel()
+    bedrock_breaker.record_failure()
+    raise BedrockUnavailable(f"No Bedrock answer within {budget}s")
+# --- END BEDROCK INVOCATION LAYER ---
+
 
 @app.get("/")
-def home():
+async def home():
     return {"message": "CloudDocs backend running with Cognito!"}
 
 class ClaudeRequest(BaseModel):
@@ -79,198 +825,2519 @@ class ClaudeRequest(BaseModel):
     max_tokens: int = 1000
     temperature: float = 1.0
     top_p: float = 0.999
+    stream: bool = False
+    # With a conversationId, `messages` holds only the new turns and the
+    # conversation's stored system prompt applies instead of `system`
+    conversationId: Optional[str] = None
+    system: Optional[str] = None
 # --- MODIFIED /upload ENDPOINT ---
 # (No change needed here, the frontend will send the user-defined name)
-    
-@app.post("/api/claude")
-def call_claude_bedrock(request: ClaudeRequest, Authorization: str = Header(None)):
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_claude_events(body: dict, model: str, http_request: Request, on_complete=None,
+                               on_usage=None):
     """
-    Proxy endpoint for Claude via AWS Bedrock
+    Server-sent events for one streamed completion. Every Anthropic event
+    Bedrock emits is forwarded as a `data:` line as soon as it arrives; a
+    final `metrics` event reports time to first token. The Bedrock stream is
+    closed as soon as the client goes away.
+
+    `await on_usage(usage, total_ms)` runs once the stream ends, however it
+    ends: a disconnect or a stream error still bills the tokens Bedrock has
+    used, so the usage seen so far is reported (output tokens estimated
+    from the text if message_delta never came). `await on_complete(text,
+    usage, total_ms)` runs only once the whole completion has streamed; if
+    it raises, an error event is sent instead of the metrics event.
     """
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
+    start = time.perf_counter()
+    first_token_ms = None
+    response = None
+    text, usage = [], {}
+    try:
+        response = await run_aws("bedrock", invoke_bedrock_stream, body, model)
+        async with contextlib.aclosing(iterate_aws("bedrock", response["body"])) as events:
+            async for event in events:
+                if await http_request.is_disconnected():
+                    print("Client disconnected, closing Bedrock stream")
+                    return
+                chunk = event.get("chunk")
+                if chunk is None:
+                    # Modelled stream errors (throttling, validation, ...)
+                    yield sse_event({"error": next(iter(event), "unknown")}, event="error")
+                    return
+                payload = json.loads(chunk["bytes"])
+                if payload.get("type") == "content_block_delta":
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                    text.append(payload.get("delta", {}).get("text", ""))
+                elif payload.get("type") == "message_start":
+                    usage.update(payload.get("message", {}).get("usage", {}))
+                elif payload.get("type") == "message_delta":
+                    usage.update(payload.get("usage", {}))
+                yield sse_event(payload)
+    except Exception as e:
+        print(f"Bedrock stream error: {str(e)}")
+        yield sse_event({"error": f"Failed to call Bedrock: {str(e)}"}, event="error")
+        return
+    finally:
+        if response is not None:
+            response["body"].close()
+        if on_usage is not None and (usage or text):
+            if "output_tokens" not in usage:
+                usage["output_tokens"] = estimate_tokens("".join(text))
+            # Shielded: a cancelled response (the client went away) still records
+            await asyncio.shield(on_usage(usage, (time.perf_counter() - start) * 1000))
 
-    # Verify user is authenticated
-    token = Authorization.split(" ")[1]
-    claims = verify_token(token)
-    user_id = claims["sub"]
-    
+    total_ms = (time.perf_counter() - start) * 1000
+    print(f"Bedrock stream: ttft={first_token_ms}ms total={total_ms:.2f}ms")
+    if on_complete is not None:
+        try:
+            await on_complete("".join(text), usage, total_ms)
+        except Exception as e:
+            yield sse_event({"error": getattr(e, "detail", str(e))}, event="error")
+            return
+    yield sse_event({
+        "timeToFirstTokenMs": round(first_token_ms, 2) if first_token_ms is not None else None,
+        "totalMs": round(total_ms, 2),
+    }, event="metrics")
+
+
+# --- CLAUDE CONVERSATIONS ---
+# A conversation is one {user}#chats item: the system prompt, a running
+# summary and the recent turns (as JSON), kept under
+# CONVERSATION_HISTORY_TOKENS. Turns that fall out of the budget are folded
+# into the summary. System prompt, summary and stored turns only change
+# between turns, so on models that support it they are marked as Bedrock
+# prompt-cache breakpoints.
+#
+# Per-user usage lives in {user}#usage items: a per-minute request counter
+# (the rate limit) and a per-day token, cache and latency tally (the daily
+# quota). Both are checked with one conditional write each, so the limits
+# hold across containers.
+CONVERSATION_TTL = 30 * 24 * 3600
+CONVERSATION_HISTORY_TOKENS = 8000
+CONVERSATION_SUMMARY_TOKENS = 400
+# Bedrock model ids (substrings) that accept cache_control
+PROMPT_CACHING_MODELS = ("claude-3-5-haiku", "claude-3-7-sonnet", "claude-sonnet-4", "claude-opus-4",
+                         "claude-haiku-4")
+CLAUDE_REQUESTS_PER_MINUTE = 20
+CLAUDE_DAILY_TOKENS = 500_000
+CLAUDE_USAGE_TTL = 90 * 24 * 3600
+
+CONVERSATION_SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an assistant.
+Keep facts, decisions, names and open questions; drop pleasantries. Use at most 200 words.
+
+Current summary:
+{summary}
+
+Turns to fold in:
+{turns}
+
+Respond with ONLY the updated summary."""
+
+
+class ConversationCreate(BaseModel):
+    system: Optional[str] = None
+
+
+def _conversation_key(user_id: str, conversation_id: str) -> dict:
+    return {"userId": f"{user_id}#chats", "fileId": conversation_id}
+
+
+def _usage_key(user_id: str, period: str) -> dict:
+    return {"userId": f"{user_id}#usage", "fileId": period}
+
+
+def supports_prompt_caching(model: str) -> bool:
+    return any(name in model for name in PROMPT_CACHING_MODELS)
+
+
+def as_blocks(content) -> List[dict]:
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return [dict(block) for block in content]
+
+
+def turn_text(turn: dict) -> str:
+    return "".join(block.get("text", "") for block in as_blocks(turn["content"]) if block.get("type") == "text")
+
+
+def fit_history(turns: List[dict], budget: int) -> tuple:
+    """
+    (kept, dropped): the oldest turns are dropped until the rest fit the
+    token budget, and `kept` always starts with a user turn.
+    """
+    costs = [estimate_tokens(turn_text(turn)) for turn in turns]
+    start, total = 0, sum(costs)
+    while start < len(turns) and (total > budget or turns[start]["role"] != "user"):
+        total -= costs[start]
+        start += 1
+    return turns[start:], turns[:start]
+
+
+def summarize_turns(summary: str, turns: List[dict]) -> tuple:
+    """
+    (summary, usage): the running summary with `turns` folded in, and the
+    Bedrock usage it cost. The summary is unchanged if Bedrock has no answer.
+    """
+    listing = "\n".join(f"{turn['role']}: {turn_text(turn)}" for turn in turns)
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": CONVERSATION_SUMMARY_TOKENS,
+        "temperature": 0,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": CONVERSATION_SUMMARY_PROMPT.format(
+                    summary=summary or "(none)", turns=listing)}]
+            }
+        ]
+    }
     try:
-        # Prepare the request body for Bedrock
-        body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": request.max_tokens,
-            "messages": request.messages,
-            "temperature": request.temperature,
-            "top_p": request.top_p
-        }
-        
-        # Call Bedrock
-        response = bedrock_runtime.invoke_model(
-            modelId=request.model,
-            body=json.dumps(body)
-        )
-        
-        # Parse response
-        response_body = json.loads(response['body'].read())
-        
-        return response_body
-        
+        response_body = invoke_bedrock(body, SUGGESTION_MODEL_ID)
     except Exception as e:
-        print(f"Bedrock error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to call Bedrock: {str(e)}")
-# ===== END BEDROCK ENDPOINT =====
-@app.post("/upload")
-def create_upload(filename: str, tags: str = '[]', Authorization: str = Header(None)):
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
+        print(f"Conversation summary failed: {e}. Truncating without it.")
+        return summary, {}
+    return response_text(response_body).strip() or summary, response_body.get("usage", {})
 
-    token = Authorization.split(" ")[1]
-    claims = verify_token(token)
-    user_id = claims["sub"]
 
-    # --- !! NEW: Sanitize filename !! ---
-    # Ensure filename is not empty and strip whitespace
-    clean_filename = filename.strip()
-    if not clean_filename:
-        raise HTTPException(status_code=400, detail="Filename cannot be empty")
-    # --- !! END NEW !! ---
+def build_claude_body(request: ClaudeRequest, conversation: Optional[dict]) -> dict:
+    history = json.loads(conversation["turns"]) if conversation else []
+    summary = conversation.get("summary") if conversation else None
+    system = conversation.get("system") if conversation else request.system
+    system_text = "\n\n".join(part for part in (
+        system, f"Summary of the earlier conversation:\n{summary}" if summary else None) if part)
 
-    file_id = str(uuid.uuid4())
-    key = f"{user_id}/{file_id}/{clean_filename}" # Use the clean filename
+    messages = [{"role": turn["role"], "content": as_blocks(turn["content"])} for turn in history]
+    if history and supports_prompt_caching(request.model):
+        messages[-1]["content"][-1]["cache_control"] = {"type": "ephemeral"}
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": request.max_tokens,
+        "messages": messages + list(request.messages),
+        "temperature": request.temperature,
+        "top_p": request.top_p
+    }
+    if system_text and supports_prompt_caching(request.model):
+        body["system"] = [{"type": "text", "text": system_text, "cache_control": {"type": "ephemeral"}}]
+    elif system_text:
+        body["system"] = system_text
+    return body
 
-    url = s3.generate_presigned_url(
-        "put_object",
-        Params={"Bucket": BUCKET, "Key": key},
-        ExpiresIn=600
+
+async def load_conversation(user_id: str, conversation_id: str) -> dict:
+    item = (await run_aws("dynamodb", table.get_item, Key=_conversation_key(user_id, conversation_id))).get("Item")
+    if not item:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return item
+
+
+async def save_conversation_turns(user_id: str, conversation: dict, new_turns: List[dict]) -> bool:
+    """
+    Appends the turns, folding whatever overflows the budget into the
+    summary. Conditional on the version that was read, so two turns racing
+    on one conversation can't overwrite each other; False if this one lost.
+    """
+    kept, dropped = fit_history(json.loads(conversation["turns"]) + new_turns, CONVERSATION_HISTORY_TOKENS)
+    summary = conversation.get("summary", "")
+    if dropped:
+        start = time.perf_counter()
+        summary, usage = await run_aws("bedrock", summarize_turns, summary, dropped)
+        if usage:
+            # Summaries count against the same daily quota as the turns
+            await run_aws("dynamodb", record_claude_usage, user_id, conversation["fileId"], SUGGESTION_MODEL_ID,
+                          usage, (time.perf_counter() - start) * 1000)
+    version = int(conversation.get("version", 0))
+    try:
+        await run_aws(
+            "dynamodb",
+            table.update_item,
+            Key=_conversation_key(user_id, conversation["fileId"]),
+            UpdateExpression="SET turns = :turns, summary = :summary, version = :next, "
+                             "updatedAt = :now, expiresAt = :expires ADD turnCount :count",
+            ConditionExpression="version = :version",
+            ExpressionAttributeValues={
+                ":turns": json.dumps(kept),
+                ":summary": summary,
+                ":next": version + 1,
+                ":version": version,
+                ":now": created_at_now(),
+                ":expires": int(time.time()) + CONVERSATION_TTL,
+                ":count": len(new_turns),
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+    return True
+
+
+async def check_claude_limits(user_id: str):
+    """429 if the user is over the per-minute request limit or the daily token quota."""
+    now = int(time.time())
+    minute = time.strftime("%Y-%m-%dT%H:%M", time.gmtime(now))
+
+    async def within(period: str, condition: str, values: dict, detail: str, retry_after: int):
+        try:
+            await run_aws(
+                "dynamodb",
+                table.update_item,
+                Key=_usage_key(user_id, period),
+                UpdateExpression="ADD requests :one SET expiresAt = if_not_exists(expiresAt, :expires)",
+                ConditionExpression=condition,
+                ExpressionAttributeValues={":one": 1, **values},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    await asyncio.gather(
+        within(f"minute#{minute}", "attribute_not_exists(requests) OR requests < :limit",
+               {":limit": CLAUDE_REQUESTS_PER_MINUTE, ":expires": now + 120},
+               "Too many Claude requests, slow down", 60 - now % 60),
+        within(f"day#{minute[:10]}", "attribute_not_exists(tokens) OR tokens < :limit",
+               {":limit": CLAUDE_DAILY_TOKENS, ":expires": now + CLAUDE_USAGE_TTL},
+               "Daily Claude token quota used up", 86400 - now % 86400),
     )
-    
+
+
+def record_claude_usage(user_id: str, conversation_id: Optional[str], model: str, usage: dict, model_ms: float):
+    """Adds one completion to the user's daily tally and emits it as EMF."""
+    counts = {
+        "InputTokens": int(usage.get("input_tokens", 0)),
+        "OutputTokens": int(usage.get("output_tokens", 0)),
+        "CacheReadTokens": int(usage.get("cache_read_input_tokens", 0)),
+        "CacheWriteTokens": int(usage.get("cache_creation_input_tokens", 0)),
+    }
     try:
-        tag_list = json.loads(tags)
-        if not isinstance(tag_list, list):
-            tag_list = []
-    except json.JSONDecodeError:
-        tag_list = []
+        table.update_item(
+            Key=_usage_key(user_id, f"day#{time.strftime('%Y-%m-%d', time.gmtime())}"),
+            UpdateExpression="ADD tokens :tokens, inputTokens :in, outputTokens :out, cacheReadTokens :read, "
+                             "cacheWriteTokens :write, completions :one, modelMs :ms",
+            ExpressionAttributeValues={
+                ":tokens": counts["InputTokens"] + counts["OutputTokens"],
+                ":in": counts["InputTokens"],
+                ":out": counts["OutputTokens"],
+                ":read": counts["CacheReadTokens"],
+                ":write": counts["CacheWriteTokens"],
+                ":one": 1,
+                ":ms": int(model_ms),
+            },
+        )
+    except Exception as e:
+        print(f"Claude usage write failed: {e}")
+    # UserId is a property, not a dimension: per-user breakdowns come from
+    # Logs Insights without a metric per user
+    document = emf_document({"Model": model}, {**counts, "ModelLatency": round(model_ms, 2)},
+                            {**{name: "Count" for name in counts}, "ModelLatency": "Milliseconds"})
+    document.update({"UserId": user_id, "ConversationId": conversation_id})
+    metrics_sink.emit(document)
 
-    table.put_item(Item={
-        "userId": user_id,
-        "fileId": file_id,
-        "filename": clean_filename, # Store the clean filename
-        "createdAt": str(int(time.time())),
-        "tags": tag_list  # Store the tags
+
+@app.post("/api/claude/conversations")
+async def create_conversation(request: ConversationCreate, claims: dict = Depends(require_auth)):
+    conversation_id = str(uuid.uuid4())
+    await run_aws("dynamodb", table.put_item, Item={
+        **_conversation_key(claims["sub"], conversation_id),
+        "system": request.system or "",
+        "summary": "",
+        "turns": "[]",
+        "turnCount": 0,
+        "version": 0,
+        "createdAt": created_at_now(),
+        "updatedAt": created_at_now(),
+        "expiresAt": int(time.time()) + CONVERSATION_TTL,
     })
+    return {"conversationId": conversation_id}
+
+
+@app.get("/api/claude/conversations/{conversationId}")
+async def get_conversation(conversationId: str, claims: dict = Depends(require_auth)):
+    item = await load_conversation(claims["sub"], conversationId)
+    return {
+        "conversationId": conversationId,
+        "system": item.get("system") or None,
+        "summary": item.get("summary") or None,
+        "messages": json.loads(item["turns"]),
+        "turnCount": int(item.get("turnCount", 0)),
+        "updatedAt": item.get("updatedAt"),
+    }
+
+
+@app.delete("/api/claude/conversations/{conversationId}")
+async def delete_conversation(conversationId: str, claims: dict = Depends(require_auth)):
+    await run_aws("dynamodb", table.delete_item, Key=_conversation_key(claims["sub"], conversationId))
+    return {"deleted": conversationId}
+
+
+@app.get("/api/claude/usage")
+async def get_claude_usage(claims: dict = Depends(require_auth)):
+    """Today's (UTC) Claude usage for the caller, with the limits that apply."""
+    day = time.strftime("%Y-%m-%d", time.gmtime())
+    item = (await run_aws("dynamodb", table.get_item, Key=_usage_key(claims["sub"], f"day#{day}"))).get("Item") or {}
+    fields = ("requests", "completions", "tokens", "inputTokens", "outputTokens", "cacheReadTokens",
+              "cacheWriteTokens", "modelMs")
+    return {
+        "day": day,
+        **{field: int(item.get(field, 0)) for field in fields},
+        "dailyTokenLimit": CLAUDE_DAILY_TOKENS,
+        "requestsPerMinute": CLAUDE_REQUESTS_PER_MINUTE,
+    }
+# --- END CLAUDE CONVERSATIONS ---
+
+
+@app.post("/api/claude")
+async def call_claude_bedrock(request: ClaudeRequest, http_request: Request, claims: dict = Depends(require_auth)):
+    """
+    Proxy endpoint for Claude via AWS Bedrock. With `"stream": true` the
+    completion is returned as text/event-stream instead of one JSON body.
+    With a `conversationId` only the new turns are sent; the history is
+    added server-side and the reply is appended to it.
+    """
+    user_id = claims["sub"]
+    conversation = None
+    if request.conversationId:
+        if not request.messages or request.messages[0].get("role") != "user":
+            raise HTTPException(status_code=400, detail="New turns must start with a user message")
+        conversation = await load_conversation(user_id, request.conversationId)
+    await check_claude_limits(user_id)
+
+    # Prepare the request body for Bedrock
+    body = build_claude_body(request, conversation)
+
+    async def record_usage(usage: dict, model_ms: float):
+        await run_aws("dynamodb", record_claude_usage, user_id, request.conversationId, request.model,
+                      usage, model_ms)
+
+    async def save_turns(reply_blocks: List[dict]):
+        if conversation is not None:
+            new_turns = list(request.messages) + [{"role": "assistant", "content": reply_blocks}]
+            if not await save_conversation_turns(user_id, conversation, new_turns):
+                raise HTTPException(status_code=409,
+                                    detail="Conversation changed while this turn was running; resend it")
+
+    if request.stream:
+        return StreamingResponse(
+            stream_claude_events(body, request.model, http_request,
+                                 on_complete=lambda text, usage, ms: save_turns([{"type": "text", "text": text}]),
+                                 on_usage=record_usage),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    try:
+        # Call Bedrock (reading the body is blocking I/O too, so it happens
+        # on the executor as well)
+        start = time.perf_counter()
+        response_body = await run_aws("bedrock", invoke_bedrock, body, request.model)
+        model_ms = (time.perf_counter() - start) * 1000
+
+    except BedrockUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(BEDROCK_BREAKER_COOLDOWN)})
+    except Exception as e:
+        print(f"Bedrock error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to call Bedrock: {str(e)}")
+
+    reply = [block for block in response_body.get("content", []) if block.get("type") == "text"]
+    await record_usage(response_body.get("usage", {}), model_ms)
+    await save_turns(reply)
+    if conversation is not None:
+        response_body["conversationId"] = request.conversationId
+    return response_body
+# ===== END BEDROCK ENDPOINT =====
+def created_at_now() -> str:
+    # Epoch seconds as a fixed-width string, so the createdAt index sorts
+    # lexicographically in time order.
+    return f"{int(time.time()):010d}"
+
+
+# --- OBJECT KEYS ---
+# Objects live under an immutable {userId}/{fileId} key recorded in the
+# row's objectKey; the display filename is only in DynamoDB and is applied
+# at download time. Rows from before this scheme have no objectKey and
+# their object is still at {userId}/{fileId}/{filename} until
+# scripts/migrate_object_keys.py moves it.
+def object_key(user_id: str, file_id: str) -> str:
+    return f"{user_id}/{file_id}"
+
+
+def stored_object_key(item: dict) -> str:
+    return item.get("objectKey") or f"{item['userId']}/{item['fileId']}/{item['filename']}"
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    # RFC 6266: a plain ASCII fallback plus the exact UTF-8 name
+    fallback = "".join(c if 32 <= ord(c) < 127 and c not in '"\\' else "_" for c in filename)
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+
+
+def presign_get(item: dict, expires_in: int) -> str:
+    return s3.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": BUCKET,
+            "Key": stored_object_key(item),
+            "ResponseContentDisposition": content_disposition(item["filename"]),
+        },
+        ExpiresIn=expires_in
+    )
+# --- END OBJECT KEYS ---
+
+
+@app.post("/upload")
+async def create_upload(filename: str, tags: str = '[]', claims: dict = Depends(require_auth)):
+    user_id = claims["sub"]
+
+    # --- !! NEW: Sanitize filename !! ---
+    # Ensure filename is not empty and strip whitespace
+    clean_filename = filename.strip()
+    if not clean_filename:
+        raise HTTPException(status_code=400, detail="Filename cannot be empty")
+    # --- !! END NEW !! ---
+
+    file_id = str(uuid.uuid4())
+    key = object_key(user_id, file_id)
+
+    url = presign_put(key)
+    
+    try:
+        tag_list = json.loads(tags)
+        if not isinstance(tag_list, list):
+            tag_list = []
+    except json.JSONDecodeError:
+        tag_list = []
+
+    item = {
+        "userId": user_id,
+        "fileId": file_id,
+        "filename": clean_filename, # Store the clean filename
+        "objectKey": key,
+        "createdAt": created_at_now(),
+        "tags": normalize_tags(tag_list)  # Store the tags
+    }
+    await run_aws("dynamodb", table.put_item, Item=item)
+    await run_aws("dynamodb", sync_file_indexes, user_id, file_id, [], item)
+
+    return {"uploadUrl": url, "fileId": file_id}
+# --- END MODIFIED /upload ---
+
+
+def presign_put(key: str) -> str:
+    # Presigning is local signing, no network round trip
+    return s3.generate_presigned_url(
+        "put_object",
+        Params={"Bucket": BUCKET, "Key": key},
+        ExpiresIn=UPLOAD_URL_EXPIRY
+    )
+
+
+# --- BATCH UPLOAD: /upload/batch ---
+# Batch uploads are written as pending rows: no createdAt (so they stay out
+# of the createdAt index, the tag index and search) and an expiresAt for
+# the table's TTL. The S3 "Object Created" event for the key confirms the
+# row; a row whose upload never happens is expired by DynamoDB. Pending
+# rows can be renamed, retagged and deleted, but none of that touches the
+# indexes: confirmation indexes the row as it is then.
+UPLOAD_URL_EXPIRY = 600
+UPLOAD_BATCH_MAX_FILES = 500
+PENDING_UPLOAD_TTL = UPLOAD_URL_EXPIRY + 3600
+UPLOAD_PENDING = "pending"
+
+
+def is_pending_upload(item: dict) -> bool:
+    return item.get("uploadStatus") == UPLOAD_PENDING
+
+
+class UploadFile(BaseModel):
+    filename: str
+    tags: List[str] = []
+
+
+class BatchUploadRequest(BaseModel):
+    files: List[UploadFile]
+
+
+@app.post("/upload/batch")
+async def create_upload_batch(request: BatchUploadRequest, claims: dict = Depends(require_auth)):
+    """
+    Presigned PUT URLs and pending metadata rows for many files in one call.
+    Results are in request order.
+    """
+    user_id = claims["sub"]
+    if len(request.files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {UPLOAD_BATCH_MAX_FILES} files per batch")
+
+    expires_at = int(time.time()) + PENDING_UPLOAD_TTL
+    uploads, items = [], []
+    for upload in request.files:
+        clean_filename = upload.filename.strip()
+        if not clean_filename:
+            raise HTTPException(status_code=400, detail="Filename cannot be empty")
+        file_id = str(uuid.uuid4())
+        items.append({
+            "userId": user_id,
+            "fileId": file_id,
+            "filename": clean_filename,
+            "objectKey": object_key(user_id, file_id),
+            "tags": normalize_tags(upload.tags),
+            "uploadStatus": UPLOAD_PENDING,
+            "expiresAt": expires_at,
+        })
+        uploads.append({
+            "fileId": file_id,
+            "filename": clean_filename,
+            "uploadUrl": presign_put(object_key(user_id, file_id)),
+        })
+
+    def write_items():
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+    await run_aws("dynamodb", write_items)
+    return {"uploads": uploads}
+
+
+def s3_created_keys(event: dict) -> List[str]:
+    """Object keys from an S3 notification or an EventBridge "Object Created" event."""
+    if event.get("source") == "aws.s3":
+        detail = event.get("detail", {})
+        if detail.get("bucket", {}).get("name") != BUCKET:
+            return []
+        return [detail["object"]["key"]]
+    keys = []
+    for record in event.get("Records", []):
+        if record.get("eventSource") != "aws:s3" or not record.get("eventName", "").startswith("ObjectCreated"):
+            continue
+        if record["s3"]["bucket"]["name"] != BUCKET:
+            continue
+        # Notification keys are URL-encoded with spaces as "+"
+        keys.append(urllib.parse.unquote_plus(record["s3"]["object"]["key"]))
+    return keys
+
+
+def parse_object_key(key: str) -> Optional[tuple]:
+    # {userId}/{fileId}, or {userId}/{fileId}/{filename} for legacy keys
+    parts = key.split("/", 2)
+    if len(parts) < 2 or parts[0] == EXPORT_PREFIX:
+        return None
+    return parts[0], parts[1]
+
+
+def confirm_upload(key: str) -> bool:
+    """
+    Turns the pending row for `key` into a listed file. Returns False if
+    there was no pending row (already confirmed, or not a batch upload).
+    """
+    parsed = parse_object_key(key)
+    if parsed is None:
+        return False
+    user_id, file_id = parsed
+    try:
+        resp = table.update_item(
+            Key={"userId": user_id, "fileId": file_id},
+            UpdateExpression="SET createdAt = :c REMOVE uploadStatus, expiresAt, uploadId, partSize",
+            ConditionExpression="uploadStatus = :pending",
+            ExpressionAttributeValues={":c": created_at_now(), ":pending": UPLOAD_PENDING},
+            ReturnValues="ALL_NEW",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+    sync_file_indexes(user_id, file_id, [], resp["Attributes"])
+    return True
+
+
+def handle_s3_event(event: dict) -> dict:
+    confirmed = ingested = 0
+    for key in s3_created_keys(event):
+        confirmed += confirm_upload(key)
+        # Anything else (throttling, timeouts, an open Bedrock circuit)
+        # propagates so the event is retried; confirm_upload and the
+        # contentETag check make the redelivery idempotent
+        try:
+            ingested += ingest_object(key)
+        except ContentIngestionError as e:
+            print(f"Content ingestion failed for {key}: {e}")
+    return {"confirmed": confirmed, "ingested": ingested}
+# --- END BATCH UPLOAD ---
+
+
+# --- CONTENT INGESTION ---
+# Runs on the S3 "Object Created" event, off the upload path: the first
+# CONTENT_SAMPLE_BYTES of the object are read, text is pulled out of plain
+# text, DOCX and PDF without third-party parsers, and Bedrock suggests tags
+# and a one-line summary from it. The content tags are merged into the
+# file's tags and the object's ETag is recorded in contentETag, so a
+# redelivered event for the same object is a no-op.
+CONTENT_SAMPLE_BYTES = 256 * 1024
+CONTENT_CHUNK_CHARS = 3000
+CONTENT_MAX_CHUNKS = 3
+CONTENT_MIN_CHARS = 40
+CONTENT_WRITE_ATTEMPTS = 3
+TEXT_EXTENSIONS = {"txt", "md", "csv", "tsv", "json", "xml", "html", "htm", "log", "yaml", "yml", "rtf"}
+_XML_TAG_RE = re.compile(r"<[^>]+>")
+_PDF_STREAM_RE = re.compile(rb"stream\r?\n(.*?)\r?\nendstream", re.S)
+_PDF_TEXT_RE = re.compile(rb"\((?:[^()\\]|\\.)*\)\s*Tj|\[(?:[^\]])*\]\s*TJ", re.S)
+_PDF_STRING_RE = re.compile(rb"\(((?:[^()\\]|\\.)*)\)", re.S)
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"", b"f": b"", b"(": b"(", b")": b")", b"\\": b"\\"}
+
+
+class ContentIngestionError(Exception):
+    """A failure that a retry would repeat: unreadable content or a rejected request."""
+
+
+CONTENT_TAGS_PROMPT = """You are an intelligent file organization assistant.
+Below are excerpts from the start of a file named "{filename}".
+
+{excerpts}
+
+Suggest 2-3 short, relevant, lowercase tags for the file based on what it
+contains, and a one-sentence summary of it.
+Respond with ONLY a JSON object in this form:
+{{"tags": ["tag1", "tag2"], "summary": "..."}}"""
+
+
+def docx_text(data: bytes) -> str:
+    """
+    Text of word/document.xml from the start of a DOCX. The ZIP central
+    directory is at the end, so local file headers are walked instead and
+    a truncated member is inflated as far as it goes.
+    """
+    offset = 0
+    while True:
+        offset = data.find(b"PK\x03\x04", offset)
+        if offset == -1 or offset + 30 > len(data):
+            return ""
+        method = int.from_bytes(data[offset + 8:offset + 10], "little")
+        compressed = int.from_bytes(data[offset + 18:offset + 22], "little")
+        name_length = int.from_bytes(data[offset + 26:offset + 28], "little")
+        extra_length = int.from_bytes(data[offset + 28:offset + 30], "little")
+        name = data[offset + 30:offset + 30 + name_length]
+        start = offset + 30 + name_length + extra_length
+        if name == b"word/document.xml":
+            body = data[start:start + compressed] if compressed else data[start:]
+            try:
+                xml = zlib.decompressobj(-15).decompress(body) if method == 8 else body
+            except zlib.error:
+                return ""
+            xml = xml.decode("utf-8", errors="ignore").replace("</w:p>", "\n")
+            return _XML_TAG_RE.sub("", xml)
+        offset = start + compressed if compressed else start
+
+
+def _pdf_string(raw: bytes) -> bytes:
+    return re.sub(rb"\\([nrtbf()\\]|[0-7]{1,3})",
+                  lambda m: _PDF_ESCAPES.get(m.group(1)) or bytes([int(m.group(1), 8) & 0xFF]), raw)
+
+
+def pdf_text(data: bytes) -> str:
+    """
+    Best-effort text from the start of a PDF: literal strings shown with
+    Tj/TJ in the content streams (Flate-compressed or not) that fit in the
+    sample. Scanned PDFs without a text layer give nothing.
+    """
+    pieces = []
+    for match in _PDF_STREAM_RE.finditer(data):
+        stream = match.group(1)
+        try:
+            stream = zlib.decompress(stream)
+        except zlib.error:
+            pass
+        for operator in _PDF_TEXT_RE.finditer(stream):
+            pieces.extend(_pdf_string(s) for s in _PDF_STRING_RE.findall(operator.group(0)))
+            pieces.append(b" ")
+    return b"".join(pieces).decode("latin-1")
+
+
+def extract_text(filename: str, content_type: str, data: bytes) -> str:
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension == "docx":
+        text = docx_text(data)
+    elif extension == "pdf" or data.startswith(b"%PDF"):
+        text = pdf_text(data)
+    elif extension in TEXT_EXTENSIONS or content_type.startswith("text/"):
+        text = data.decode("utf-8", errors="ignore")
+        if extension in ("html", "htm", "xml"):
+            text = _XML_TAG_RE.sub(" ", text)
+    else:
+        return ""
+    return " ".join(text.split())
+
+
+def chunk_text(text: str) -> List[str]:
+    return [text[i:i + CONTENT_CHUNK_CHARS]
+            for i in range(0, min(len(text), CONTENT_CHUNK_CHARS * CONTENT_MAX_CHUNKS), CONTENT_CHUNK_CHARS)]
+
+
+def get_content_tags(filename: str, chunks: List[str]) -> Optional[dict]:
+    """{"tags", "summary"} from Bedrock, or None without a usable answer."""
+    excerpts = "\n\n".join(f"Excerpt {i + 1}:\n{chunk}" for i, chunk in enumerate(chunks))
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 200,
+        "temperature": 0.1,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": CONTENT_TAGS_PROMPT.format(filename=filename, excerpts=excerpts)}]
+            }
+        ]
+    }
+    # Errors propagate so the S3 event is retried rather than left untagged
+    text = response_text(invoke_bedrock(body, SUGGESTION_MODEL_ID))
+    start, end = text.find("{"), text.rfind("}")
+    try:
+        answer = json.loads(text[start:end + 1]) if start != -1 and end > start else {}
+    except json.JSONDecodeError:
+        return None
+    tags = clean_suggested_tags(answer.get("tags")) if isinstance(answer.get("tags"), list) else []
+    summary = answer.get("summary") if isinstance(answer.get("summary"), str) else ""
+    if not tags:
+        return None
+    return {"tags": tags, "summary": summary.strip()}
+
+
+def ingest_object(key: str) -> bool:
+    """
+    Tags one uploaded object from its content. Returns True if the file's
+    record was updated, False if there was nothing to do.
+    """
+    parsed = parse_object_key(key)
+    if parsed is None:
+        return False
+    user_id, file_id = parsed
+    record_key = {"userId": user_id, "fileId": file_id}
+    # Consistent: confirm_upload has only just cleared uploadStatus, and a
+    # stale pending row would skip the file without a retry
+    item = table.get_item(Key=record_key, ConsistentRead=True).get("Item")
+    if not item or item.get("uploadStatus") == UPLOAD_PENDING or stored_object_key(item) != key:
+        return False
+
+    try:
+        obj = s3.get_object(Bucket=BUCKET, Key=key, Range=f"bytes=0-{CONTENT_SAMPLE_BYTES - 1}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404", "InvalidRange"):
+            return False
+        raise
+    etag = obj["ETag"]
+    if item.get("contentETag") == etag:
+        return False  # redelivered event
+    try:
+        text = extract_text(item["filename"], obj.get("ContentType", ""), obj["Body"].read())
+    except Exception as e:
+        raise ContentIngestionError(f"text extraction failed: {e}") from e
+    if len(text) < CONTENT_MIN_CHARS:
+        return False
+    try:
+        answer = get_content_tags(item["filename"], chunk_text(text))
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in BEDROCK_CLIENT_ERROR_CODES:
+            raise
+        raise ContentIngestionError(f"Bedrock rejected the request: {e}") from e
+    if answer is None:
+        return False
+
+    for _ in range(CONTENT_WRITE_ATTEMPTS):
+        old_tags = item.get("tags", [])
+        new_tags = normalize_tags(list(old_tags) + answer["tags"])
+        values = {":t": new_tags, ":s": answer["summary"], ":e": etag}
+        # Don't clobber a tag edit made while Bedrock was answering
+        if "tags" in item:
+            tags_unchanged = "tags = :old"
+            values[":old"] = old_tags
+        else:
+            tags_unchanged = "attribute_not_exists(tags)"
+        try:
+            table.update_item(
+                Key=record_key,
+                UpdateExpression="SET tags = :t, summary = :s, contentETag = :e",
+                ConditionExpression=f"attribute_exists(fileId) AND {tags_unchanged} "
+                                    "AND (attribute_not_exists(contentETag) OR contentETag <> :e)",
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            item = table.get_item(Key=record_key, ConsistentRead=True).get("Item")
+            if not item or item.get("contentETag") == etag:
+                return False
+            continue
+        sync_file_indexes(user_id, file_id, old_tags, {**item, "tags": new_tags})
+        return True
+    return False
+# --- END CONTENT INGESTION ---
+
+
+# --- MULTIPART UPLOAD: /upload/multipart ---
+# Large files are uploaded as S3 multipart uploads. The pending row (see
+# BATCH UPLOAD) also holds the uploadId, so every later call is addressed by
+# fileId alone and can only reach the caller's own upload. Parts already in
+# S3 can be listed, which lets a client resume after a dropped connection.
+# Give the bucket an AbortIncompleteMultipartUpload lifecycle rule so parts
+# of abandoned uploads are cleaned up alongside the expired rows.
+MIB = 1024 * 1024
+MULTIPART_MIN_PART_SIZE = 8 * MIB       # S3 minimum is 5 MiB
+MULTIPART_MAX_PARTS = 10000
+MULTIPART_MAX_FILE_SIZE = 5 * 1024 ** 4  # S3 object limit, 5 TiB
+MULTIPART_URLS_PER_REQUEST = 100
+MULTIPART_URL_EXPIRY = 3600
+MULTIPART_PENDING_TTL = 7 * 24 * 3600
+
+
+class MultipartInitiate(BaseModel):
+    filename: str
+    size: int
+    tags: List[str] = []
+
+
+class MultipartPartsRequest(BaseModel):
+    partNumbers: List[int]
+
+
+class CompletedPart(BaseModel):
+    partNumber: int
+    etag: str
+
+
+class MultipartComplete(BaseModel):
+    # Omit to complete with every part S3 has received
+    parts: Optional[List[CompletedPart]] = None
+
+
+def multipart_part_size(size: int) -> int:
+    """
+    The smallest whole-MiB part size, at least MULTIPART_MIN_PART_SIZE, that
+    fits `size` bytes into MULTIPART_MAX_PARTS parts.
+    """
+    needed = -(-size // MULTIPART_MAX_PARTS)
+    return max(MULTIPART_MIN_PART_SIZE, -(-needed // MIB) * MIB)
+
+
+async def get_pending_multipart(user_id: str, file_id: str) -> dict:
+    item = (await run_aws("dynamodb", table.get_item, Key={"userId": user_id, "fileId": file_id})).get("Item")
+    if not item:
+        raise HTTPException(status_code=404, detail="Multipart upload not found")
+    if item.get("uploadStatus") != UPLOAD_PENDING:
+        raise HTTPException(status_code=409, detail="Upload already completed")
+    if "uploadId" not in item:
+        raise HTTPException(status_code=404, detail="Multipart upload not found")
+    return item
+
+
+def list_uploaded_parts(key: str, upload_id: str) -> List[dict]:
+    parts = []
+    params = {"Bucket": BUCKET, "Key": key, "UploadId": upload_id}
+    while True:
+        resp = s3.list_parts(**params)
+        for part in resp.get("Parts", []):
+            parts.append({"partNumber": part["PartNumber"], "etag": part["ETag"], "size": part["Size"]})
+        if not resp.get("IsTruncated"):
+            return parts
+        params["PartNumberMarker"] = resp["NextPartNumberMarker"]
+
+
+@app.post("/upload/multipart")
+async def initiate_multipart_upload(request: MultipartInitiate, claims: dict = Depends(require_auth)):
+    """
+    Starts a multipart upload. The part size scales with the declared size
+    so the file fits in S3's 10,000-part limit.
+    """
+    user_id = claims["sub"]
+    clean_filename = request.filename.strip()
+    if not clean_filename:
+        raise HTTPException(status_code=400, detail="Filename cannot be empty")
+    if not 0 < request.size <= MULTIPART_MAX_FILE_SIZE:
+        raise HTTPException(status_code=400, detail="Invalid file size")
+
+    file_id = str(uuid.uuid4())
+    key = object_key(user_id, file_id)
+    upload = await run_aws("s3", s3.create_multipart_upload, Bucket=BUCKET, Key=key)
+    part_size = multipart_part_size(request.size)
+
+    await run_aws("dynamodb", table.put_item, Item={
+        "userId": user_id,
+        "fileId": file_id,
+        "filename": clean_filename,
+        "objectKey": key,
+        "tags": normalize_tags(request.tags),
+        "uploadStatus": UPLOAD_PENDING,
+        "uploadId": upload["UploadId"],
+        "size": request.size,
+        "partSize": part_size,
+        "expiresAt": int(time.time()) + MULTIPART_PENDING_TTL,
+    })
+    return {
+        "fileId": file_id,
+        "uploadId": upload["UploadId"],
+        "partSize": part_size,
+        "partCount": -(-request.size // part_size),
+    }
+
+
+@app.post("/upload/multipart/{fileId}/parts")
+async def presign_multipart_parts(fileId: str, request: MultipartPartsRequest, claims: dict = Depends(require_auth)):
+    """
+    Presigned upload_part URLs for a batch of part numbers, signed locally.
+    """
+    user_id = claims["sub"]
+    if len(request.partNumbers) > MULTIPART_URLS_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"At most {MULTIPART_URLS_PER_REQUEST} parts per request")
+    if any(not 1 <= n <= MULTIPART_MAX_PARTS for n in request.partNumbers):
+        raise HTTPException(status_code=400, detail="Part numbers must be between 1 and 10000")
+
+    item = await get_pending_multipart(user_id, fileId)
+    key = stored_object_key(item)
+    urls = [
+        {
+            "partNumber": part_number,
+            "uploadUrl": s3.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": BUCKET, "Key": key, "UploadId": item["uploadId"], "PartNumber": part_number},
+                ExpiresIn=MULTIPART_URL_EXPIRY,
+            ),
+        }
+        for part_number in request.partNumbers
+    ]
+    return {"parts": urls}
+
+
+@app.get("/upload/multipart/{fileId}/parts")
+async def list_multipart_parts(fileId: str, claims: dict = Depends(require_auth)):
+    """
+    The parts S3 already has, so an interrupted upload can resume.
+    """
+    user_id = claims["sub"]
+    item = await get_pending_multipart(user_id, fileId)
+    key = stored_object_key(item)
+    parts = await run_aws("s3", list_uploaded_parts, key, item["uploadId"])
+    return {"fileId": fileId, "uploadId": item["uploadId"], "partSize": item["partSize"], "parts": parts}
+
+
+@app.post("/upload/multipart/{fileId}/complete")
+async def complete_multipart_upload(fileId: str, request: MultipartComplete, claims: dict = Depends(require_auth)):
+    user_id = claims["sub"]
+    item = await get_pending_multipart(user_id, fileId)
+    key = stored_object_key(item)
+
+    if request.parts is None:
+        parts = await run_aws("s3", list_uploaded_parts, key, item["uploadId"])
+    else:
+        parts = [{"partNumber": p.partNumber, "etag": p.etag} for p in request.parts]
+    if not parts:
+        raise HTTPException(status_code=400, detail="No parts have been uploaded")
+
+    try:
+        await run_aws(
+            "s3",
+            s3.complete_multipart_upload,
+            Bucket=BUCKET,
+            Key=key,
+            UploadId=item["uploadId"],
+            MultipartUpload={"Parts": [
+                {"PartNumber": p["partNumber"], "ETag": p["etag"]}
+                for p in sorted(parts, key=lambda p: p["partNumber"])
+            ]},
+        )
+    except ClientError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to complete upload: {e.response['Error']['Code']}")
+
+    # Don't wait for the S3 event; confirming twice is a no-op
+    await run_aws("dynamodb", confirm_upload, key)
+    return {"fileId": fileId, "filename": item["filename"]}
+
+
+@app.delete("/upload/multipart/{fileId}")
+async def abort_multipart_upload(fileId: str, claims: dict = Depends(require_auth)):
+    user_id = claims["sub"]
+    item = await get_pending_multipart(user_id, fileId)
+    key = stored_object_key(item)
+    try:
+        await run_aws("s3", s3.abort_multipart_upload, Bucket=BUCKET, Key=key, UploadId=item["uploadId"])
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchUpload":
+            raise
+    await run_aws("dynamodb", table.delete_item, Key={"userId": user_id, "fileId": fileId})
+    return {"message": "Upload aborted", "fileId": fileId}
+# --- END MULTIPART UPLOAD ---
+
+
+# --- TAG INDEX ---
+# Adjacency-list items kept in CloudDocsFiles next to the file records:
+#   userId="{user}#tag#{tag}", fileId=<fileId> -> copy of the listing fields
+#   userId="{user}#tags",      fileId=<tag>    -> fileCount
+# Membership items carry createdAt, so they are also in the createdAt index
+# under their own partition and a tag view pages newest first like /files.
+MAX_TAG_FILTERS = 10
+
+
+def normalize_tags(tags) -> List[str]:
+    normalized = []
+    for tag in tags or []:
+        if not isinstance(tag, str):
+            continue
+        tag = tag.strip().lower()
+        if tag and tag not in normalized:
+            normalized.append(tag)
+    return normalized
+
+
+def tag_partition(user_id: str, tag: str) -> str:
+    return f"{user_id}#tag#{tag}"
+
+
+def tag_counts_partition(user_id: str) -> str:
+    return f"{user_id}#tags"
+
+
+def _adjust_tag_count(user_id: str, tag: str, delta: int):
+    key = {"userId": tag_counts_partition(user_id), "fileId": tag}
+    resp = table.update_item(
+        Key=key,
+        UpdateExpression="ADD fileCount :d",
+        ExpressionAttributeValues={":d": delta},
+        ReturnValues="UPDATED_NEW",
+    )
+    if resp["Attributes"]["fileCount"] <= 0:
+        _drop_empty_tag_count(user_id, tag)
+
+
+def _drop_empty_tag_count(user_id: str, tag: str):
+    try:
+        table.delete_item(
+            Key={"userId": tag_counts_partition(user_id), "fileId": tag},
+            ConditionExpression="fileCount <= :zero",
+            ExpressionAttributeValues={":zero": 0},
+        )
+    except ClientError as e:
+        # A concurrent upload re-used the tag in the meantime
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+def sync_tag_index(user_id: str, file_id: str, old_tags, new_item: Optional[dict]):
+    """
+    Brings the tag index in line with a file record. `new_item` is the record
+    after the change, or None if the file was deleted. Membership items are
+    rewritten for every current tag so they pick up renames.
+    """
+    old = set(normalize_tags(old_tags))
+    new = normalize_tags(new_item.get("tags")) if new_item else []
+
+    with table.batch_writer() as batch:
+        for tag in new:
+            batch.put_item(Item={**format_file(new_item), "userId": tag_partition(user_id, tag)})
+        for tag in old - set(new):
+            batch.delete_item(Key={"userId": tag_partition(user_id, tag), "fileId": file_id})
+
+    for tag in set(new) - old:
+        _adjust_tag_count(user_id, tag, 1)
+    for tag in old - set(new):
+        _adjust_tag_count(user_id, tag, -1)
+
+
+async def get_tag_counts(user_id: str, tags: Optional[List[str]] = None) -> dict:
+    """
+    {tag: fileCount} for the given tags (one BatchGetItem), or for every tag
+    the user has (one query over the counts partition).
+    """
+    partition = tag_counts_partition(user_id)
+    counts = {}
+    if tags is not None:
+        keys = [{"userId": partition, "fileId": tag} for tag in tags]
+        request = {table.name: {"Keys": keys}}
+        while request:
+            resp = await run_aws("dynamodb", ddb.batch_get_item, RequestItems=request)
+            for item in resp["Responses"].get(table.name, []):
+                counts[item["fileId"]] = int(item.get("fileCount", 0))
+            request = resp.get("UnprocessedKeys")
+        return counts
+
+    params = {"KeyConditionExpression": Key('userId').eq(partition)}
+    while True:
+        resp = await run_aws("dynamodb", table.query, **params)
+        for item in resp.get("Items", []):
+            counts[item["fileId"]] = int(item.get("fileCount", 0))
+        if "LastEvaluatedKey" not in resp:
+            return counts
+        params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+async def list_files_with_all_tags(user_id: str, tags: List[str], limit: int, cursor: Optional[str]) -> dict:
+    partitions = [tag_partition(user_id, tag) for tag in tags]
+    start_key = decode_cursor(cursor, partitions)
+    if start_key:
+        # Stay on the partition the first page was read from
+        partition = start_key["userId"]
+    else:
+        counts = await get_tag_counts(user_id, tags)
+        if len(counts) < len(tags):
+            return {"files": [], "nextCursor": None}
+        # Walk the rarest tag and filter on the others
+        partition = tag_partition(user_id, min(tags, key=lambda t: counts[t]))
+
+    others = [tag for tag, p in zip(tags, partitions) if p != partition]
+    filter_expression = None
+    for tag in others:
+        condition = Attr('tags').contains(tag)
+        filter_expression = condition if filter_expression is None else filter_expression & condition
+
+    resp = await query_files_page(partition, limit, start_key, filter_expression)
+    return {
+        "files": [format_file(item) for item in resp.get("Items", [])],
+        "nextCursor": encode_cursor(resp.get("LastEvaluatedKey")),
+    }
+
+
+async def list_files_with_any_tag(user_id: str, tags: List[str], limit: int, cursor: Optional[str]) -> dict:
+    # Keyset cursor: everything at or before `before`, minus the ids already
+    # returned at exactly that createdAt.
+    position = decode_cursor(cursor, [user_id]) or {}
+    before = position.get("before")
+    seen = set(position.get("seen", []))
+
+    async def read_tag(tag):
+        key_condition = Key('userId').eq(tag_partition(user_id, tag))
+        if before:
+            key_condition = key_condition & Key('createdAt').lte(before)
+        return await run_aws(
+            "dynamodb",
+            table.query,
+            IndexName=FILES_BY_CREATED_INDEX,
+            KeyConditionExpression=key_condition,
+            ScanIndexForward=False,
+            Limit=limit + len(seen),
+            **FILE_LIST_PROJECTION,
+        )
+
+    pages = await asyncio.gather(*(read_tag(tag) for tag in tags))
+    merged = {}
+    for page in pages:
+        for item in page.get("Items", []):
+            if item["fileId"] not in seen:
+                merged[item["fileId"]] = format_file(item)
+    files = sorted(merged.values(), key=lambda f: (f["createdAt"], f["fileId"]), reverse=True)
+
+    more = len(files) > limit or any("LastEvaluatedKey" in page for page in pages)
+    files = files[:limit]
+    next_cursor = None
+    if more and files:
+        last = files[-1]["createdAt"]
+        at_last = {f["fileId"] for f in files if f["createdAt"] == last}
+        if last == before:
+            at_last |= seen
+        next_cursor = encode_cursor({"userId": user_id, "before": last, "seen": sorted(at_last)})
+    return {"files": files, "nextCursor": next_cursor}
+
+
+@app.get("/tags")
+async def list_tags(claims: dict = Depends(require_auth)):
+    """
+    Every tag the user has with the number of files carrying it.
+    """
+    counts = await get_tag_counts(claims["sub"])
+    tags = [{"tag": tag, "count": count} for tag, count in counts.items()]
+    tags.sort(key=lambda t: (-t["count"], t["tag"]))
+    return {"tags": tags}
+# --- END TAG INDEX ---
+
+
+# --- FILENAME SEARCH INDEX ---
+# Each warm container keeps an in-memory SearchIndex per recently active
+# user. A version counter ({user}#meta / search) is bumped on every write,
+# and the write's changes are logged under that version in {user}#search.
+# A container whose cached index is behind replays the log. A cold
+# container loads the last snapshot of the index (zlib-compressed JSON,
+# chunked across items in {user}#search) and replays the log after it. The
+# user's file partition is only read when there is no usable snapshot or
+# the log has a gap; the rebuilt index is then saved as the new snapshot.
+SEARCH_RESULTS_LIMIT = 20
+SEARCH_MAX_PREFIX_TERMS = 200
+SEARCH_INDEX_CACHE_SIZE = 32
+SEARCH_INDEX_TTL = 900
+SEARCH_SNAPSHOT_CHUNK_BYTES = 350_000  # DynamoDB items are capped at 400 KB
+SEARCH_SNAPSHOT_MAX_REPLAY = 100  # log entries replayed before a new snapshot is saved
+SEARCH_LOG_TTL = 7 * 86400
+_TOKEN_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    "ProjectProposal_Ayush2025.docx" -> ["project", "proposal", "ayush", "2025", "docx"]
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text or ""):
+        token = token.lower()
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def trigrams(term: str) -> set:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Edit distance counting an adjacent transposition as one edit, giving up
+    (returning max_distance + 1) once every cell in a row exceeds max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    before_previous, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before_previous[j - 2] + 1)
+            current.append(cost)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+class SearchIndex:
+    """
+    Inverted index over filename tokens and tags. Prefix matches come from a
+    sorted vocabulary and typo-tolerant matches from a trigram index over
+    the vocabulary, so query cost grows with distinct terms, not files.
+    """
+
+    def __init__(self, version: int = 0):
+        self.version = version
+        self.docs = {}
+        self.postings = defaultdict(set)
+        self.vocabulary = []
+        self.term_trigrams = defaultdict(set)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def terms_for(doc: dict) -> set:
+        return set(tokenize(doc.get("filename", ""))) | set(normalize_tags(doc.get("tags")))
+
+    def add(self, doc: dict):
+        with self._lock:
+            self.remove(doc["fileId"])
+            doc = format_file(doc)
+            self.docs[doc["fileId"]] = doc
+            for term in self.terms_for(doc):
+                if term not in self.postings:
+                    bisect.insort(self.vocabulary, term)
+                    for gram in trigrams(term):
+                        self.term_trigrams[gram].add(term)
+                self.postings[term].add(doc["fileId"])
+
+    def remove(self, file_id: str):
+        with self._lock:
+            doc = self.docs.pop(file_id, None)
+            if doc is None:
+                return
+            for term in self.terms_for(doc):
+                files = self.postings.get(term)
+                if files is None:
+                    continue
+                files.discard(file_id)
+                if not files:
+                    del self.postings[term]
+                    del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+                    for gram in trigrams(term):
+                        self.term_trigrams[gram].discard(term)
+
+    def apply(self, changes: dict):
+        """{fileId: new item, or None if deleted}"""
+        with self._lock:
+            for file_id, new_item in changes.items():
+                if new_item is None:
+                    self.remove(file_id)
+                else:
+                    self.add(new_item)
+
+    def to_snapshot(self) -> bytes:
+        """
+        The files column by column plus each term's postings as positions in
+        them, so loading parses flat lists and tokenizes nothing.
+        """
+        with self._lock:
+            docs = list(self.docs.values())
+            position = {doc["fileId"]: i for i, doc in enumerate(docs)}
+            snapshot = {field: [doc[field] for doc in docs] for field in ("fileId", "filename", "createdAt", "tags")}
+            snapshot["terms"] = {term: sorted(position[f] for f in files) for term, files in self.postings.items()}
+        return zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode())
+
+    @classmethod
+    def from_snapshot(cls, data: bytes, version: int) -> "SearchIndex":
+        snapshot = json.loads(zlib.decompress(data))
+        index = cls(version)
+        file_ids = snapshot["fileId"]
+        index.docs = {
+            file_id: {"fileId": file_id, "filename": filename, "createdAt": created_at, "tags": tags}
+            for file_id, filename, created_at, tags
+            in zip(file_ids, snapshot["filename"], snapshot["createdAt"], snapshot["tags"])
+        }
+        for term, positions in snapshot["terms"].items():
+            index.postings[term] = set(map(file_ids.__getitem__, positions))
+            for gram in trigrams(term):
+                index.term_trigrams[gram].add(term)
+        index.vocabulary = sorted(index.postings)
+        return index
+
+    def _matches(self, query_term: str) -> dict:
+        """{term: score} for one query token: exact, prefix and fuzzy matches."""
+        matches = {}
+        if query_term in self.postings:
+            matches[query_term] = 1.0
+
+        start = bisect.bisect_left(self.vocabulary, query_term)
+        for term in self.vocabulary[start:start + SEARCH_MAX_PREFIX_TERMS]:
+            if not term.startswith(query_term):
+                break
+            if term != query_term:
+                matches[term] = 0.7 + 0.2 * len(query_term) / len(term)
+
+        if len(query_term) >= 3:
+            max_distance = 1 if len(query_term) < 8 else 2
+            query_grams = trigrams(query_term)
+            overlap = defaultdict(int)
+            for gram in query_grams:
+                for term in self.term_trigrams.get(gram, ()):
+                    overlap[term] += 1
+            for term, shared in overlap.items():
+                if term in matches or 2 * shared / (len(query_grams) + len(trigrams(term))) < 0.4:
+                    continue
+                distance = edit_distance(query_term, term, max_distance)
+                if distance <= max_distance:
+                    matches[term] = 0.6 * (1 - distance / max(len(query_term), len(term)))
+        return matches
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS_LIMIT) -> List[dict]:
+        query_terms = tokenize(query)
+        scores = defaultdict(float)
+        with self._lock:
+            for query_term in query_terms:
+                best = {}
+                for term, score in self._matches(query_term).items():
+                    for file_id in self.postings[term]:
+                        if score > best.get(file_id, 0):
+                            best[file_id] = score
+                for file_id, score in best.items():
+                    scores[file_id] += score
+            ranked = heapq.nlargest(
+                limit,
+                scores.items(),
+                key=lambda entry: (entry[1], self.docs[entry[0]]["createdAt"]),
+            )
+            return [{**self.docs[file_id], "score": round(score / len(query_terms), 4)}
+                    for file_id, score in ranked]
+
+
+search_indexes = ExpiringLRUCache(SEARCH_INDEX_CACHE_SIZE)
+
+
+def _search_version_key(user_id: str) -> dict:
+    return {"userId": f"{user_id}#meta", "fileId": "search"}
+
+
+def _search_partition(user_id: str) -> str:
+    return f"{user_id}#search"
+
+
+def _search_log_key(version: int) -> str:
+    return f"log#{version:012d}"
+
+
+def _query_all(**params) -> List[dict]:
+    items = []
+    while True:
+        resp = table.query(**params)
+        items.extend(resp.get("Items", []))
+        if "LastEvaluatedKey" not in resp:
+            return items
+        params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def build_search_index(user_id: str, version: int) -> SearchIndex:
+    """
+    The index rebuilt from one projected read of the user's files. The
+    result is saved as the snapshot for `version`, so it reads the base
+    table consistently: the createdAt GSI could still be missing a file
+    written just before, and the snapshot would then miss it until the
+    file next changed.
+    """
+    index = SearchIndex(version)
+    for item in _query_all(
+        KeyConditionExpression=Key('userId').eq(user_id),
+        # Pending uploads aren't listed until confirmed
+        FilterExpression="attribute_not_exists(#us)",
+        ProjectionExpression=FILE_LIST_PROJECTION["ProjectionExpression"],
+        ExpressionAttributeNames={**FILE_LIST_PROJECTION["ExpressionAttributeNames"], "#us": "uploadStatus"},
+        ConsistentRead=True,
+    ):
+        index.add(item)
+    return index
+
+
+def save_search_snapshot(user_id: str, index: SearchIndex):
+    version = index.version
+    data = index.to_snapshot()
+    chunks = [data[i:i + SEARCH_SNAPSHOT_CHUNK_BYTES] for i in range(0, len(data), SEARCH_SNAPSHOT_CHUNK_BYTES)]
+    # Chunks of two snapshots written at once must not be mixed up on load
+    snapshot_id = uuid.uuid4().hex
+    with table.batch_writer() as batch:
+        for n, chunk in enumerate(chunks):
+            batch.put_item(Item={
+                "userId": _search_partition(user_id),
+                "fileId": f"snapshot#{n:05d}",
+                "snapshotId": snapshot_id,
+                "version": version,
+                "chunks": len(chunks),
+                "data": chunk,
+            })
+
+
+def read_search_snapshot(user_id: str) -> Optional[SearchIndex]:
+    """The last saved index, or None if there is none or it is torn."""
+    chunks = _query_all(
+        KeyConditionExpression=Key('userId').eq(_search_partition(user_id)) & Key('fileId').begins_with("snapshot#"),
+        ConsistentRead=True,
+    )
+    if not chunks:
+        return None
+    # Items past `chunks` are left over from a longer snapshot
+    chunks = chunks[:int(chunks[0]["chunks"])]
+    if (len(chunks) < int(chunks[0]["chunks"])
+            or any(c["snapshotId"] != chunks[0]["snapshotId"] for c in chunks)):
+        return None
+    try:
+        return SearchIndex.from_snapshot(b"".join(c["data"].value for c in chunks), int(chunks[0]["version"]))
+    except (zlib.error, ValueError, KeyError, IndexError) as e:
+        print(f"Unreadable search snapshot for {user_id}: {e}")
+        return None
+
+
+def catch_up_search_index(user_id: str, index: SearchIndex, version: int) -> bool:
+    """
+    Replays the logged writes after index.version up to `version`. False if
+    any entry is missing (expired, or its write has not landed yet).
+    """
+    start = index.version
+    if start >= version:
+        return True
+    entries = _query_all(
+        KeyConditionExpression=Key('userId').eq(_search_partition(user_id))
+        & Key('fileId').between(_search_log_key(start + 1), _search_log_key(version)),
+        ConsistentRead=True,
+    )
+    if len(entries) != version - start:
+        return False
+    with index._lock:
+        for entry in entries:
+            entry_version = int(entry["fileId"].split("#", 1)[1])
+            if entry_version > index.version:
+                index.apply(json.loads(entry["changes"]))
+                index.version = entry_version
+    return True
+
+
+def load_search_index(user_id: str) -> SearchIndex:
+    meta = table.get_item(Key=_search_version_key(user_id), ConsistentRead=True).get("Item") or {}
+    version = int(meta.get("version", 0))
+    index = search_indexes.get(user_id)
+    if index is not None and index.version == version:
+        return index
+
+    if index is None or not catch_up_search_index(user_id, index, version):
+        index = read_search_snapshot(user_id)
+        snapshot_version = index.version if index is not None else 0
+        if index is not None and catch_up_search_index(user_id, index, version):
+            if version - snapshot_version > SEARCH_SNAPSHOT_MAX_REPLAY:
+                save_search_snapshot(user_id, index)
+        else:
+            index = build_search_index(user_id, version)
+            save_search_snapshot(user_id, index)
+    search_indexes.set(user_id, index, time.time() + SEARCH_INDEX_TTL)
+    return index
+
+
+def update_search_index(user_id: str, file_id: str, new_item: Optional[dict]):
+    apply_search_changes(user_id, {file_id: new_item})
+
+
+def apply_search_changes(user_id: str, changes: dict):
+    """
+    {fileId: new item, or None if deleted} as one version bump and one log
+    entry, so a bulk write keeps other indexes incremental too.
+    """
+    changes = {file_id: format_file(item) if item is not None else None for file_id, item in changes.items()}
+    resp = table.update_item(
+        Key=_search_version_key(user_id),
+        UpdateExpression="ADD version :one",
+        ExpressionAttributeValues={":one": 1},
+        ReturnValues="UPDATED_NEW",
+    )
+    version = int(resp["Attributes"]["version"])
+    table.put_item(Item={
+        "userId": _search_partition(user_id),
+        "fileId": _search_log_key(version),
+        "changes": json.dumps(changes, separators=(",", ":"), default=str),
+        "expiresAt": int(time.time()) + SEARCH_LOG_TTL,
+    })
+    index = search_indexes.get(user_id)
+    if index is None:
+        return
+    with index._lock:
+        if index.version != version - 1:
+            # Another container wrote in between; catch up on the next search
+            search_indexes.pop(user_id)
+            return
+        index.apply(changes)
+        index.version = version
+
+
+def sync_file_indexes(user_id: str, file_id: str, old_tags, new_item: Optional[dict]):
+    sync_tag_index(user_id, file_id, old_tags, new_item)
+    update_search_index(user_id, file_id, new_item)
+
+
+def remove_from_file_indexes(user_id: str, items: List[dict]):
+    """
+    Index cleanup for many deleted files: membership items go in one batch,
+    each tag count is adjusted once, and the search version is bumped once.
+    Pending uploads were never indexed and are skipped.
+    """
+    items = [item for item in items if not is_pending_upload(item)]
+    if not items:
+        return
+    removed_per_tag = Counter()
+    with table.batch_writer() as batch:
+        for item in items:
+            for tag in normalize_tags(item.get("tags")):
+                batch.delete_item(Key={"userId": tag_partition(user_id, tag), "fileId": item["fileId"]})
+                removed_per_tag[tag] += 1
+    for tag, removed in removed_per_tag.items():
+        _adjust_tag_count(user_id, tag, -removed)
+    apply_search_changes(user_id, {item["fileId"]: None for item in items})
+
+
+def search_files(user_id: str, query: str, limit: int) -> List[dict]:
+    return load_search_index(user_id).search(query, limit)
+
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_RESULTS_LIMIT, ge=1, le=100),
+    claims: dict = Depends(require_auth),
+):
+    """
+    Ranked, typo-tolerant search over filenames and tags.
+    """
+    if not tokenize(q):
+        return {"results": []}
+    return {"results": await run_aws("dynamodb", search_files, claims["sub"], q, limit)}
+# --- END FILENAME SEARCH INDEX ---
+
+
+# --- PAGINATED /files ENDPOINT ---
+FILES_PAGE_SIZE = 100
+FILES_MAX_PAGE_SIZE = 1000
+# Only the attributes the listing returns are read from DynamoDB
+FILE_LIST_PROJECTION = {
+    "ProjectionExpression": "#fid, #fn, #ca, #tg",
+    "ExpressionAttributeNames": {
+        "#fid": "fileId",
+        "#fn": "filename",
+        "#ca": "createdAt",
+        "#tg": "tags",
+    },
+}
+
+
+def encode_cursor(last_evaluated_key: Optional[dict]) -> Optional[str]:
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(",", ":"), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], partitions: List[str]) -> Optional[dict]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        start_key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # The cursor is opaque to the client, but it must not point into
+    # another user's partition.
+    if not isinstance(start_key, dict) or start_key.get("userId") not in partitions:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return start_key
+
+
+def format_file(item: dict) -> dict:
+    return {
+        "fileId": item["fileId"],
+        "filename": item.get("filename", "unknown"),
+        "createdAt": item.get("createdAt", "0"),
+        "tags": item.get("tags", []),
+    }
+
+
+async def query_files_page(partition: str, limit: int, start_key: Optional[dict] = None,
+                           filter_expression=None) -> dict:
+    # The createdAt index returns the partition newest first, so a page is a
+    # single bounded read no matter how many files the user has.
+    params = {
+        "IndexName": FILES_BY_CREATED_INDEX,
+        "KeyConditionExpression": Key('userId').eq(partition),
+        "ScanIndexForward": False,
+        "Limit": limit,
+        **FILE_LIST_PROJECTION,
+    }
+    if start_key:
+        params["ExclusiveStartKey"] = start_key
+    if filter_expression is not None:
+        params["FilterExpression"] = filter_expression
+    return await run_aws("dynamodb", table.query, **params)
+
+
+@app.get("/files")
+async def list_files(
+    limit: int = Query(FILES_PAGE_SIZE, ge=1, le=FILES_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    tag: Optional[List[str]] = Query(None),
+    match: str = Query("all", pattern="^(all|any)$"),
+    claims: dict = Depends(require_auth),
+):
+    """
+    One page of the user's files, newest first. Pass `nextCursor` back as `cursor` to
+    fetch the following page; it is null on the last page.
+
+    `?tag=a&tag=b` restricts the listing to files carrying all of the tags
+    (`match=all`, the default) or any of them (`match=any`), read from the
+    tag index rather than the whole partition.
+    """
+    user_id = claims["sub"]
+
+    tags = normalize_tags(tag)
+    if len(tags) > MAX_TAG_FILTERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TAG_FILTERS} tags can be filtered on")
+    if tags:
+        if match == "all":
+            return await list_files_with_all_tags(user_id, tags, limit, cursor)
+        return await list_files_with_any_tag(user_id, tags, limit, cursor)
+
+    start_key = decode_cursor(cursor, [user_id])
+
+    try:
+        resp = await query_files_page(user_id, limit, start_key)
+    except Exception as e:
+        print(f"Error querying DynamoDB: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch files from database")
+
+    files = [format_file(item) for item in resp.get("Items", [])]
+    return {"files": files, "nextCursor": encode_cursor(resp.get("LastEvaluatedKey"))}
+
+
+@app.get("/files/stream")
+async def stream_files(claims: dict = Depends(require_auth)):
+    """
+    Bulk export of every file record as NDJSON, one page in memory at a time.
+    """
+    user_id = claims["sub"]
+
+    async def rows():
+        start_key = None
+        while True:
+            resp = await query_files_page(user_id, FILES_MAX_PAGE_SIZE, start_key)
+            for item in resp.get("Items", []):
+                yield json.dumps(format_file(item), default=str) + "\n"
+            start_key = resp.get("LastEvaluatedKey")
+            if not start_key:
+                break
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+# --- END PAGINATED /files ENDPOINT ---
+
+
+@app.delete("/delete")
+async def delete_file(fileId: str, claims: dict = Depends(require_auth)):
+    # (No changes needed)
+    user_id = claims["sub"]
+
+    # Fetch file info from DynamoDB
+    resp = await run_aws("dynamodb", table.get_item, Key={"userId": user_id, "fileId": fileId})
+    item = resp.get("Item")
+    if not item:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    key = stored_object_key(item)
+
+    # Delete from S3
+    await run_aws("s3", s3.delete_object, Bucket=BUCKET, Key=key)
+
+    # Delete from DynamoDB
+    await run_aws("dynamodb", table.delete_item, Key={"userId": user_id, "fileId": fileId})
+    if not is_pending_upload(item):
+        await run_aws("dynamodb", sync_file_indexes, user_id, fileId, item.get("tags", []), None)
+    invalidate_presigned_urls(user_id, [fileId])
+
+    return {"message": "File deleted successfully"}
+
+
+# --- BULK DELETE: /files/delete-batch ---
+DELETE_BATCH_MAX_FILES = 1000
+DDB_BATCH_GET_SIZE = 100
+DDB_BATCH_WRITE_SIZE = 25
+S3_DELETE_OBJECTS_SIZE = 1000
+BATCH_MAX_ATTEMPTS = 5
+BATCH_RETRY_BASE_DELAY = 0.05
+
+
+class FileIdsRequest(BaseModel):
+    fileIds: List[str]
+
+
+def chunked(values: list, size: int) -> List[list]:
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def batch_get_files(user_id: str, file_ids: List[str]) -> dict:
+    """
+    {fileId: item} for up to 100 of the user's files, retrying unprocessed
+    keys with exponential backoff. Missing files are simply absent.
+    """
+    request = {table.name: {"Keys": [{"userId": user_id, "fileId": f} for f in file_ids]}}
+    found = {}
+    for attempt in range(BATCH_MAX_ATTEMPTS):
+        resp = ddb.batch_get_item(RequestItems=request)
+        for item in resp["Responses"].get(table.name, []):
+            found[item["fileId"]] = item
+        request = resp.get("UnprocessedKeys")
+        if not request:
+            return found
+        time.sleep(BATCH_RETRY_BASE_DELAY * 2 ** attempt)
+    raise RuntimeError("DynamoDB left keys unprocessed after retries")
+
+
+def batch_delete_file_items(user_id: str, file_ids: List[str]) -> List[str]:
+    """
+    Deletes up to 25 file records in one BatchWriteItem, retrying unprocessed
+    items with exponential backoff. Returns the ids still not deleted.
+    """
+    request = {table.name: [{"DeleteRequest": {"Key": {"userId": user_id, "fileId": f}}} for f in file_ids]}
+    for attempt in range(BATCH_MAX_ATTEMPTS):
+        request = ddb.batch_write_item(RequestItems=request).get("UnprocessedItems")
+        if not request:
+            return []
+        time.sleep(BATCH_RETRY_BASE_DELAY * 2 ** attempt)
+    return [entry["DeleteRequest"]["Key"]["fileId"] for entry in request.get(table.name, [])]
+
+
+def delete_s3_objects(keys: List[str]) -> dict:
+    """{key: error message} for the keys S3 could not delete (one DeleteObjects call)."""
+    resp = s3.delete_objects(
+        Bucket=BUCKET,
+        Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+    )
+    return {error["Key"]: error.get("Message", error.get("Code", "unknown")) for error in resp.get("Errors", [])}
+
+
+@app.post("/files/delete-batch")
+async def delete_files_batch(request: FileIdsRequest, claims: dict = Depends(require_auth)):
+    """
+    Deletes many files in a handful of round trips: BatchGetItem for the
+    ownership check, DeleteObjects per 1000 keys and BatchWriteItem per 25
+    records, each stage running its chunks concurrently. Every requested
+    id gets a status: deleted, not_found or failed.
+    """
+    user_id = claims["sub"]
+    file_ids = list(dict.fromkeys(request.fileIds))
+    if len(file_ids) > DELETE_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {DELETE_BATCH_MAX_FILES} files per batch")
+
+    results = {file_id: {"fileId": file_id, "status": "not_found"} for file_id in file_ids}
+
+    def fail(file_id, error):
+        results[file_id] = {"fileId": file_id, "status": "failed", "error": error}
+
+    # 1. Ownership: only the caller's own records come back
+    pages = await asyncio.gather(
+        *(run_aws("dynamodb", batch_get_files, user_id, chunk) for chunk in chunked(file_ids, DDB_BATCH_GET_SIZE)),
+        return_exceptions=True,
+    )
+    items = {}
+    for chunk, page in zip(chunked(file_ids, DDB_BATCH_GET_SIZE), pages):
+        if isinstance(page, Exception):
+            for file_id in chunk:
+                fail(file_id, f"Lookup failed: {page}")
+        else:
+            items.update(page)
+
+    # 2. Objects first, so a record is never removed while its object remains
+    key_to_id = {stored_object_key(item): file_id for file_id, item in items.items()}
+    key_chunks = chunked(list(key_to_id), S3_DELETE_OBJECTS_SIZE)
+    outcomes = await asyncio.gather(
+        *(run_aws("s3", delete_s3_objects, chunk) for chunk in key_chunks),
+        return_exceptions=True,
+    )
+    for chunk, outcome in zip(key_chunks, outcomes):
+        errors = {key: str(outcome) for key in chunk} if isinstance(outcome, Exception) else outcome
+        for key, error in errors.items():
+            fail(key_to_id[key], f"S3 delete failed: {error}")
+            items.pop(key_to_id[key])
+
+    # 3. Records
+    id_chunks = chunked(list(items), DDB_BATCH_WRITE_SIZE)
+    leftovers = await asyncio.gather(
+        *(run_aws("dynamodb", batch_delete_file_items, user_id, chunk) for chunk in id_chunks),
+        return_exceptions=True,
+    )
+    for chunk, leftover in zip(id_chunks, leftovers):
+        for file_id in chunk if isinstance(leftover, Exception) else leftover:
+            fail(file_id, "Object deleted, but failed to delete the database record")
+            items.pop(file_id)
+
+    for file_id in items:
+        results[file_id] = {"fileId": file_id, "status": "deleted"}
+    if items:
+        await run_aws("dynamodb", remove_from_file_indexes, user_id, list(items.values()))
+        invalidate_presigned_urls(user_id, items)
+
+    return {"results": [results[file_id] for file_id in file_ids]}
+# --- END BULK DELETE ---
+
+
+# --- PRESIGNED URL CACHE ---
+# A signed GET URL is reused while more than half of its lifetime remains,
+# so repeated clicks skip the DynamoDB read and the browser sees the same
+# URL (and can cache the object). Entries hold the filename too, and are
+# dropped on rename and delete in this container; another container's
+# rename shows up once its entries age out. Share links are never cached:
+# the email promises their full lifetime.
+DOWNLOAD_URL_EXPIRY = 600
+SHARE_URL_EXPIRY = 3600
+PRESIGNED_URL_REUSE_FRACTION = 0.5
+PRESIGNED_URL_CACHE_SIZE = 4096
+DOWNLOAD_BATCH_MAX_FILES = DDB_BATCH_GET_SIZE  # one BatchGetItem
+
+presigned_urls = ExpiringLRUCache(PRESIGNED_URL_CACHE_SIZE)
+
+
+def _presigned_url_key(user_id: str, file_id: str, expires_in: int) -> str:
+    return f"{user_id}|{file_id}|{expires_in}"
+
+
+def cache_presigned_get(user_id: str, item: dict, expires_in: int) -> dict:
+    entry = {"url": presign_get(item, expires_in), "filename": item["filename"]}
+    reuse_until = time.time() + expires_in * PRESIGNED_URL_REUSE_FRACTION
+    presigned_urls.set(_presigned_url_key(user_id, item["fileId"], expires_in), entry, reuse_until)
+    return entry
+
+
+async def get_presigned_url(user_id: str, file_id: str, expires_in: int) -> dict:
+    """
+    {"url", "filename"} for one of the user's files; 404 if there is no
+    such file.
+    """
+    entry = presigned_urls.get(_presigned_url_key(user_id, file_id, expires_in))
+    if entry is not None:
+        return entry
+    item = (await run_aws("dynamodb", table.get_item, Key={"userId": user_id, "fileId": file_id})).get("Item")
+    if not item:
+        raise HTTPException(status_code=404, detail="File not found")
+    return cache_presigned_get(user_id, item, expires_in)
+
+
+def invalidate_presigned_urls(user_id: str, file_ids):
+    for file_id in file_ids:
+        presigned_urls.pop(_presigned_url_key(user_id, file_id, DOWNLOAD_URL_EXPIRY))
+
+
+@app.get("/download")
+async def get_download_link(fileId: List[str] = Query(...), claims: dict = Depends(require_auth)):
+    """
+    `?fileId=a` returns {"downloadUrl"}. `?fileId=a&fileId=b...` returns
+    {"downloads": [...]} in request order, resolving every uncached id with
+    BatchGetItem; ids that are not the caller's files get an error entry.
+    """
+    user_id = claims["sub"]
+
+    if len(fileId) == 1:
+        # The object key carries no filename; the browser gets it from here
+        return {"downloadUrl": (await get_presigned_url(user_id, fileId[0], DOWNLOAD_URL_EXPIRY))["url"]}
+
+    file_ids = list(dict.fromkeys(fileId))
+    if len(file_ids) > DOWNLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {DOWNLOAD_BATCH_MAX_FILES} files per request")
+
+    entries = {}
+    for file_id in file_ids:
+        entry = presigned_urls.get(_presigned_url_key(user_id, file_id, DOWNLOAD_URL_EXPIRY))
+        if entry is not None:
+            entries[file_id] = entry
+    missing = [file_id for file_id in file_ids if file_id not in entries]
+    if missing:
+        items = await run_aws("dynamodb", batch_get_files, user_id, missing)
+        for file_id, item in items.items():
+            entries[file_id] = cache_presigned_get(user_id, item, DOWNLOAD_URL_EXPIRY)
+
+    downloads = []
+    for file_id in fileId:
+        if file_id in entries:
+            downloads.append({"fileId": file_id, "downloadUrl": entries[file_id]["url"]})
+        else:
+            downloads.append({"fileId": file_id, "error": "File not found"})
+    return {"downloads": downloads}
+# --- END PRESIGNED URL CACHE ---
+
+
+# --- ZIP EXPORT: /export ---
+# The archive is written as a stream: objects are read with ranged GETs, a
+# bounded window of ranges in flight across all files, and the ZIP bytes
+# are handed on as they are produced, either to the HTTP response or to a
+# multipart upload back to S3. Memory stays around
+# EXPORT_PREFETCH_RANGES * EXPORT_RANGE_SIZE + EXPORT_PART_SIZE whatever the
+# archive size. Members are stored uncompressed (documents and media rarely
+# deflate well) with ZIP64 headers so members over 4 GB work.
+#
+# S3 exports run as jobs, since an archive can take far longer than the
+# API Gateway timeout: POST /export returns an exportId and GET
+# /export/{exportId} reports progress and, once done, a fresh link. With
+# EXPORT_QUEUE_URL set the job goes to SQS and is built by the export
+# worker function; without it (tests, local runs) it is built after the
+# response. Job state is kept in {user}#exports items.
+EXPORT_QUEUE_URL = os.environ.get("EXPORT_QUEUE_URL")
+EXPORT_MAX_FILES = 1000
+EXPORT_RANGE_SIZE = 8 * MIB
+EXPORT_PREFETCH_RANGES = 4
+EXPORT_PART_SIZE = 16 * MIB
+EXPORT_URL_EXPIRY = 3600
+EXPORT_PREFIX = "exports"
+EXPORT_JOB_TTL = 7 * 24 * 3600
+
+
+class ExportRequest(BaseModel):
+    fileIds: Optional[List[str]] = None
+    tag: Optional[str] = None
+    # "s3": upload the archive and return a link; "stream": the response is the archive
+    destination: str = "s3"
+    name: str = "clouddocs-export"
+
+
+class _ZipSink:
+    """Write-only, unseekable file object that collects what zipfile writes."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def archive_names(filenames: List[str]) -> List[str]:
+    """Unique member names: the second "a.pdf" becomes "a (1).pdf"."""
+    seen, names = set(), []
+    for filename in filenames:
+        base, dot, extension = filename.rpartition(".")
+        if not base:
+            base, dot, extension = filename, "", ""
+        name, n = filename, 0
+        while name.lower() in seen:
+            n += 1
+            name = f"{base} ({n}){dot}{extension}"
+        seen.add(name.lower())
+        names.append(name)
+    return names
+
+
+def zip_date_time(created_at: Optional[str]) -> tuple:
+    try:
+        stamp = time.gmtime(int(created_at))
+    except (TypeError, ValueError):
+        stamp = time.gmtime()
+    # ZIP timestamps start at 1980
+    return (max(stamp.tm_year, 1980),) + tuple(stamp[1:6])
+
+
+def read_range(key: str, start: int, end: int) -> bytes:
+    resp = s3.get_object(Bucket=BUCKET, Key=key, Range=f"bytes={start}-{end}")
+    return resp["Body"].read()
+
+
+async def export_items(user_id: str, request: ExportRequest) -> List[dict]:
+    if request.fileIds:
+        file_ids = list(dict.fromkeys(request.fileIds))
+    elif request.tag:
+        file_ids, start_key = [], None
+        while True:
+            page = await query_files_page(tag_partition(user_id, request.tag.strip().lower()),
+                                          FILES_MAX_PAGE_SIZE, start_key)
+            file_ids.extend(item["fileId"] for item in page.get("Items", []))
+            start_key = page.get("LastEvaluatedKey")
+            if not start_key or len(file_ids) > EXPORT_MAX_FILES:
+                break
+    else:
+        raise HTTPException(status_code=400, detail="Pass fileIds or a tag")
+    if len(file_ids) > EXPORT_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {EXPORT_MAX_FILES} files per export")
+    if not file_ids:
+        raise HTTPException(status_code=404, detail="No files to export")
+
+    items = await exportable_items(user_id, file_ids)
+    if not items:
+        raise HTTPException(status_code=404, detail="No files to export")
+    return items
+
+
+async def exportable_items(user_id: str, file_ids: List[str]) -> List[dict]:
+    """The file rows for `file_ids`, in order, minus missing and pending ones."""
+    pages = await asyncio.gather(
+        *(run_aws("dynamodb", batch_get_files, user_id, chunk) for chunk in chunked(file_ids, DDB_BATCH_GET_SIZE))
+    )
+    found = {file_id: item for page in pages for file_id, item in page.items()}
+    # Pending uploads have no object yet
+    return [found[f] for f in file_ids if f in found and not is_pending_upload(found[f])]
+
+
+async def zip_stream(items: List[dict]):
+    """
+    Yields the ZIP archive of `items` in pieces. Ranged GETs for the next
+    EXPORT_PREFETCH_RANGES ranges (across file boundaries) run while the
+    current one is written.
+    """
+    heads = await asyncio.gather(
+        *(run_aws("s3", s3.head_object, Bucket=BUCKET, Key=stored_object_key(item)) for item in items)
+    )
+    sizes = [head["ContentLength"] for head in heads]
+    ranges = [
+        (index, start, min(start + EXPORT_RANGE_SIZE, size) - 1)
+        for index, size in enumerate(sizes)
+        for start in range(0, size, EXPORT_RANGE_SIZE)
+    ]
+
+    pending = {}
+    next_range = 0
+
+    def prefetch():
+        nonlocal next_range
+        while next_range < len(ranges) and len(pending) < EXPORT_PREFETCH_RANGES:
+            index, start, end = ranges[next_range]
+            pending[next_range] = asyncio.ensure_future(
+                run_aws("s3", read_range, stored_object_key(items[index]), start, end))
+            next_range += 1
+
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    position = 0
+    try:
+        for index, name in enumerate(archive_names([item["filename"] for item in items])):
+            info = zipfile.ZipInfo(name, date_time=zip_date_time(items[index].get("createdAt")))
+            with archive.open(info, "w", force_zip64=True) as member:
+                while position < len(ranges) and ranges[position][0] == index:
+                    prefetch()
+                    member.write(await pending.pop(position))
+                    position += 1
+                    yield sink.drain()
+            yield sink.drain()
+        archive.close()
+        yield sink.drain()
+    finally:
+        for task in pending.values():
+            task.cancel()
+
+
+async def upload_export(user_id: str, export_id: str, chunks) -> str:
+    """Multipart-uploads the archive bytes from `chunks`; returns the key."""
+    key = f"{EXPORT_PREFIX}/{user_id}/{export_id}.zip"
+    upload_id = (await run_aws("s3", s3.create_multipart_upload, Bucket=BUCKET, Key=key,
+                               ContentType="application/zip"))["UploadId"]
+    parts, buffer = [], bytearray()
+
+    async def flush():
+        number = len(parts) + 1
+        resp = await run_aws("s3", s3.upload_part, Bucket=BUCKET, Key=key, UploadId=upload_id,
+                             PartNumber=number, Body=bytes(buffer))
+        parts.append({"PartNumber": number, "ETag": resp["ETag"]})
+        buffer.clear()
+
+    try:
+        async for chunk in chunks:
+            buffer.extend(chunk)
+            if len(buffer) >= EXPORT_PART_SIZE:
+                await flush()
+        if buffer or not parts:
+            await flush()
+        await run_aws("s3", s3.complete_multipart_upload, Bucket=BUCKET, Key=key, UploadId=upload_id,
+                      MultipartUpload={"Parts": parts})
+    except BaseException:
+        await run_aws("s3", s3.abort_multipart_upload, Bucket=BUCKET, Key=key, UploadId=upload_id)
+        raise
+    return key
+
+
+def _export_job_key(user_id: str, export_id: str) -> dict:
+    return {"userId": f"{user_id}#exports", "fileId": export_id}
+
+
+def set_export_status(user_id: str, export_id: str, status: str, **fields):
+    fields["status"] = status
+    table.update_item(
+        Key=_export_job_key(user_id, export_id),
+        UpdateExpression="SET " + ", ".join(f"#{name} = :{name}" for name in fields),
+        ExpressionAttributeNames={f"#{name}": name for name in fields},
+        ExpressionAttributeValues={f":{name}": value for name, value in fields.items()},
+    )
+
+
+async def run_export(message: dict):
+    """
+    Builds one queued export. Redelivery of a finished job is a no-op;
+    a failure is recorded on the job and re-raised so SQS retries it.
+    """
+    user_id, export_id = message["userId"], message["exportId"]
+    job = (await run_aws("dynamodb", table.get_item, Key=_export_job_key(user_id, export_id))).get("Item")
+    if not job or job.get("status") == "completed":
+        return
+    await run_aws("dynamodb", set_export_status, user_id, export_id, "running")
+    try:
+        # Files deleted since the export was queued are left out
+        items = await exportable_items(user_id, message["fileIds"])
+        if not items:
+            await run_aws("dynamodb", set_export_status, user_id, export_id, "failed",
+                          error="No files to export")
+            return
+        key = await upload_export(user_id, export_id, zip_stream(items))
+    except Exception as e:
+        await run_aws("dynamodb", set_export_status, user_id, export_id, "failed", error=str(e))
+        raise
+    await run_aws("dynamodb", set_export_status, user_id, export_id, "completed",
+                  objectKey=key, files=len(items), completedAt=int(time.time()))
+
+
+async def run_queued_export(message: dict):
+    try:
+        await run_export(message)
+    except Exception as e:
+        print(f"Export {message['exportId']} failed: {e}")
+
+
+def is_export_event(event: dict) -> bool:
+    if not EXPORT_QUEUE_URL:
+        return False
+    queue_name = EXPORT_QUEUE_URL.rstrip("/").rsplit("/", 1)[-1]
+    return all(r.get("eventSourceARN", "").endswith(f":{queue_name}") for r in event["Records"])
+
+
+def handle_export_messages(event: dict) -> dict:
+    # Partial batch response: only the failed records go back on the queue
+    failures = []
+    loop = asyncio.new_event_loop()
+    try:
+        for record in event["Records"]:
+            try:
+                loop.run_until_complete(run_export(json.loads(record["body"])))
+            except Exception as e:
+                print(f"Export failed for message {record.get('messageId')}: {e}")
+                failures.append({"itemIdentifier": record["messageId"]})
+    finally:
+        loop.close()
+    return {"batchItemFailures": failures}
+
+
+@app.post("/export")
+async def export_files(request: ExportRequest, background_tasks: BackgroundTasks,
+                       claims: dict = Depends(require_auth)):
+    """
+    A ZIP of the given files, or of every file carrying `tag`. By default
+    the archive is built in the background and written to S3: poll
+    /export/{exportId} for a 1-hour link. With `"destination": "stream"`
+    the response body is the archive itself.
+    """
+    user_id = claims["sub"]
+    if request.destination not in ("s3", "stream"):
+        raise HTTPException(status_code=400, detail="destination must be 's3' or 'stream'")
+    items = await export_items(user_id, request)
+    archive_name = f"{request.name.strip() or 'clouddocs-export'}.zip"
+
+    if request.destination == "stream":
+        return StreamingResponse(
+            zip_stream(items),
+            media_type="application/zip",
+            headers={"Content-Disposition": content_disposition(archive_name)},
+        )
+
+    export_id = str(uuid.uuid4())
+    file_ids = [item["fileId"] for item in items]
+    await run_aws("dynamodb", table.put_item, Item={
+        **_export_job_key(user_id, export_id),
+        "status": "queued",
+        "archiveName": archive_name,
+        "total": len(file_ids),
+        "queuedAt": int(time.time()),
+        "expiresAt": int(time.time()) + EXPORT_JOB_TTL,
+    })
+    message = {"exportId": export_id, "userId": user_id, "fileIds": file_ids}
+    if EXPORT_QUEUE_URL:
+        await run_aws("sqs", sqs.send_message, QueueUrl=EXPORT_QUEUE_URL, MessageBody=json.dumps(message))
+    else:
+        background_tasks.add_task(run_queued_export, message)
+    return {"exportId": export_id, "status": "queued", "files": len(file_ids)}
+
+
+@app.get("/export/{exportId}")
+async def get_export(exportId: str, claims: dict = Depends(require_auth)):
+    """Export job status; a completed job carries a link signed now."""
+    item = (await run_aws("dynamodb", table.get_item, Key=_export_job_key(claims["sub"], exportId))).get("Item")
+    if not item:
+        raise HTTPException(status_code=404, detail="Export not found")
+    body = {"exportId": exportId, "status": item["status"], "files": int(item.get("files", item["total"]))}
+    if item["status"] == "completed":
+        body["downloadUrl"] = s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": BUCKET, "Key": item["objectKey"],
+                    "ResponseContentDisposition": content_disposition(item["archiveName"])},
+            ExpiresIn=EXPORT_URL_EXPIRY,
+        )
+    elif item["status"] == "failed":
+        body["error"] = item.get("error")
+    return body
+# --- END ZIP EXPORT ---
+
+
+# --- SUGGESTION CACHE ---
+# Suggestions depend only on the model, the prompt and the filename, so they
+# are cached under a hash of the three: first in process, then in a DynamoDB
+# table whose TTL expires old answers. Bump the prompt version whenever a
+# prompt below changes.
+SUGGESTION_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+SUGGESTION_PROMPT_VERSIONS = {"tags": "1", "name": "1"}
+SUGGESTION_CACHE_TABLE = "CloudDocsSuggestionCache"
+SUGGESTION_CACHE_SIZE = 2048
+SUGGESTION_CACHE_TTL = 30 * 24 * 3600
+
+suggestion_cache = ExpiringLRUCache(SUGGESTION_CACHE_SIZE)
+suggestion_cache_stats = Counter()
+suggestion_table = LazyAWS(lambda: ddb.Table(SUGGESTION_CACHE_TABLE))
+
+
+def normalize_suggestion_filename(filename: str) -> str:
+    return " ".join(filename.split()).lower()
+
+
+def suggestion_cache_key(kind: str, filename: str) -> str:
+    raw = "|".join([SUGGESTION_MODEL_ID, kind, SUGGESTION_PROMPT_VERSIONS[kind],
+                    normalize_suggestion_filename(filename)])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def cached_suggestion(kind: str, filename: str, compute, hedge: bool = True):
+    """
+    Returns compute(filename) through the two cache tiers. compute runs on
+    the bedrock backend under the suggestion latency budget (hedged unless
+    `hedge` is False) and returns None when it has no model answer; the
+    rule-based fallback is returned instead and never cached.
+    """
+    value = await lookup_suggestion(kind, filename)
+    if value is not None:
+        return value
+
+    try:
+        value = await run_bedrock_hedged(compute, filename, hedge_after=None if hedge else float("inf"))
+    except BedrockUnavailable as e:
+        print(f"Suggestion for {filename!r} timed out: {e}")
+        value = None
+    if value is None:
+        suggestion_cache_stats["fallback"] += 1
+        return SUGGESTION_FALLBACKS[kind](filename)
+    await store_suggestion(kind, filename, value)
+    return value
 
-    return {"uploadUrl": url, "fileId": file_id}
-# --- END MODIFIED /upload ---
 
+def record_suggestion_cache(kind: str, tier: str, hit: bool):
+    """Counts a lookup in one tier, locally and as an EMF metric per tier."""
+    suggestion_cache_stats[f"{tier}_{'hit' if hit else 'miss'}"] += 1
+    document = emf_document({"Tier": tier},
+                            {"SuggestionCacheHit": int(hit), "SuggestionCacheMiss": int(not hit)},
+                            {"SuggestionCacheHit": "Count", "SuggestionCacheMiss": "Count"})
+    document["Kind"] = kind
+    metrics_sink.emit(document)
 
-# --- MODIFIED /files ENDPOINT ---
-# (No changes needed)
-@app.get("/files")
-def list_files(Authorization: str = Header(None)):
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
 
-    token = Authorization.split(" ")[1]
-    claims = verify_token(token)
-    user_id = claims["sub"]
+async def lookup_suggestion(kind: str, filename: str):
+    """The cached suggestion, or None on a miss in both tiers."""
+    key = suggestion_cache_key(kind, filename)
+    value = suggestion_cache.get(key)
+    record_suggestion_cache(kind, "memory", value is not None)
+    if value is not None:
+        return value
 
-    # Query DynamoDB instead of listing S3
     try:
-        resp = table.query(
-            KeyConditionExpression=Key('userId').eq(user_id)
-        )
-        items = resp.get("Items", [])
-        
-        # Handle pagination
-        while 'LastEvaluatedKey' in resp:
-            resp = table.query(
-                KeyConditionExpression=Key('userId').eq(user_id),
-                ExclusiveStartKey=resp['LastEvaluatedKey']
-            )
-            items.extend(resp.get('Items', []))
+        item = (await run_aws("dynamodb", suggestion_table.get_item, Key={"cacheKey": key})).get("Item")
+    except Exception as e:
+        print(f"Suggestion cache read failed: {e}")
+        item = None
+    if item and int(item.get("expiresAt", 0)) > time.time():
+        value = json.loads(item["value"])
+        suggestion_cache.set(key, value, int(item["expiresAt"]))
+        record_suggestion_cache(kind, "table", True)
+        return value
 
-        # Format the files as expected by the frontend
-        files = []
-        for item in items:
-            files.append({
-                "fileId": item["fileId"],
-                "filename": item.get("filename", "unknown"),
-                "createdAt": item.get("createdAt", "0"),
-                "tags": item.get("tags", []) # Return tags
-            })
-            
-        # Sort by creation date, descending
-        files.sort(key=lambda x: int(x['createdAt']), reverse=True)
-        
-        return files
-        
+    record_suggestion_cache(kind, "table", False)
+    suggestion_cache_stats["miss"] += 1
+    return None
+
+
+async def store_suggestion(kind: str, filename: str, value):
+    key = suggestion_cache_key(kind, filename)
+    expires_at = int(time.time()) + SUGGESTION_CACHE_TTL
+    suggestion_cache.set(key, value, expires_at)
+    try:
+        await run_aws("dynamodb", suggestion_table.put_item, Item={
+            "cacheKey": key,
+            "value": json.dumps(value),
+            "expiresAt": expires_at,
+        })
     except Exception as e:
-        print(f"Error querying DynamoDB: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch files from database")
-# --- END MODIFIED /files ---
+        print(f"Suggestion cache write failed: {e}")
+# --- END SUGGESTION CACHE ---
 
 
-@app.delete("/delete")
-def delete_file(fileId: str, Authorization: str = Header(None)):
-    # (No changes needed)
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
+def clean_suggested_tags(raw_tags) -> List[str]:
+    # Unique, lowercase, max 3
+    unique_tags = []
+    for tag in raw_tags:
+        if not isinstance(tag, str):
+            continue
+        tag = tag.strip().strip('"').strip("'").strip().lower()
+        if tag and tag not in unique_tags:
+            unique_tags.append(tag)
+        if len(unique_tags) >= 3:
+            break
+    return unique_tags
 
-    token = Authorization.split(" ")[1]
-    claims = verify_token(token)
-    user_id = claims["sub"]
 
-    # Fetch file info from DynamoDB
-    resp = table.get_item(Key={"userId": user_id, "fileId": fileId})
-    item = resp.get("Item")
-    if not item:
-        raise HTTPException(status_code=404, detail="File not found")
+def clean_suggested_name(suggested_name, original_filename: str) -> Optional[str]:
+    if not isinstance(suggested_name, str):
+        return None
+    # Remove quotes, extra whitespace, newlines
+    suggested_name = suggested_name.strip().strip('"').strip("'").strip()
 
-    key = f"{user_id}/{fileId}/{item['filename']}"
+    # If response has multiple lines, take the first one
+    if '\n' in suggested_name:
+        suggested_name = suggested_name.split('\n')[0].strip()
+    if not suggested_name:
+        return None
 
-    # Delete from S3
-    s3.delete_object(Bucket=BUCKET, Key=key)
+    # Ensure the extension is still there if it's supposed to be
+    parts = original_filename.rsplit('.', 1)
+    extension = parts[1] if len(parts) == 2 else ""
+    if extension and not suggested_name.lower().endswith(f".{extension.lower()}"):
+        # If the model forgot the extension, add it back
+        clean_base = suggested_name.rsplit('.', 1)[0].strip()
+        return f"{clean_base}.{extension}"
+    return suggested_name
 
-    # Delete from DynamoDB
-    table.delete_item(Key={"userId": user_id, "fileId": fileId})
 
-    return {"message": "File deleted successfully"}
+# --- RULE-BASED SUGGESTIONS ---
+# Deterministic stand-ins for the model, used whenever Bedrock has no
+# answer in time. They follow the same rules as the prompts, as far as
+# rules can.
+EXTENSION_TAGS = {
+    "pdf": "document", "doc": "document", "docx": "document", "txt": "document", "md": "document",
+    "rtf": "document", "odt": "document",
+    "xls": "spreadsheet", "xlsx": "spreadsheet", "csv": "spreadsheet", "ods": "spreadsheet",
+    "ppt": "presentation", "pptx": "presentation", "key": "presentation", "odp": "presentation",
+    "jpg": "photo", "jpeg": "photo", "heic": "photo", "png": "image", "gif": "image", "svg": "image",
+    "mp4": "video", "mov": "video", "avi": "video", "mkv": "video",
+    "mp3": "audio", "wav": "audio", "m4a": "audio",
+    "zip": "archive", "rar": "archive", "7z": "archive", "tar": "archive", "gz": "archive",
+}
+KEYWORD_TAGS = {
+    "invoice": ["finance", "invoice"], "receipt": ["finance", "receipt"], "budget": ["finance", "budget"],
+    "tax": ["finance", "tax"], "payroll": ["finance", "payroll"], "statement": ["finance"],
+    "salary": ["finance"], "bill": ["finance"],
+    "contract": ["legal", "contract"], "agreement": ["legal"], "policy": ["legal", "policy"],
+    "resume": ["career", "resume"], "cv": ["career", "resume"],
+    "meeting": ["meeting", "notes"], "minutes": ["meeting", "notes"], "agenda": ["meeting"],
+    "notes": ["notes"], "report": ["report"], "summary": ["report"],
+    "project": ["project"], "proposal": ["project", "proposal"], "roadmap": ["project"],
+    "spec": ["project"], "design": ["design"], "diagram": ["design"],
+    "photo": ["photo", "media"], "img": ["photo", "media"], "screenshot": ["screenshot", "image"],
+    "scan": ["scan"], "ticket": ["travel"], "itinerary": ["travel"], "boarding": ["travel"],
+    "prescription": ["health"], "medical": ["health"], "insurance": ["insurance"],
+    "assignment": ["school"], "homework": ["school"], "transcript": ["school"],
+}
+_B, _E = r"(?<![a-z0-9])", r"(?![a-z0-9])"
+_FILENAME_JUNK_RES = [
+    re.compile(r"\((?:copy|\d+)\)|\s-\s*copy$"),
+    re.compile(_B + r"\d{4}[-_.]?\d{2}[-_.]?\d{2}" + _E),                                # dates
+    re.compile(rf"(?:{_B}at\s+)?{_B}\d{{1,2}}[.:]\d{{2}}(?:[.:]\d{{2}})?(?:\s*[ap]m)?{_E}"),  # times
+    re.compile(_B + r"v\d+" + _E),                                                     # versions
+]
 
 
-@app.get("/download")
-def get_download_link(fileId: str, Authorization: str = Header(None)):
-    # (No changes needed)
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
+def split_extension(filename: str) -> tuple:
+    parts = filename.rsplit(".", 1)
+    return (parts[0], parts[1]) if len(parts) == 2 and parts[0] else (filename, "")
 
-    token = Authorization.split(" ")[1]
-    claims = verify_token(token)
-    user_id = claims["sub"]
 
-    # Fetch the file from DynamoDB
-    item = table.get_item(Key={"userId": user_id, "fileId": fileId}).get("Item")
-    if not item:
-        raise HTTPException(status_code=404, detail="File not found")
+def rule_based_tags(filename: str) -> List[str]:
+    """
+    "Invoice_2025_Jan.pdf" -> ["finance", "invoice", "document"]
+    """
+    base, extension = split_extension(filename)
+    tags = [tag for token in tokenize(base) for tag in KEYWORD_TAGS.get(token, [])]
+    tags.append(EXTENSION_TAGS.get(extension.lower(), "document"))
+    return clean_suggested_tags(tags)
 
-    key = f"{user_id}/{fileId}/{item['filename']}"
 
-    url = s3.generate_presigned_url(
-        "get_object",
-        Params={"Bucket": BUCKET, "Key": key},
-        ExpiresIn=600  
-    )
+def normalize_filename(filename: str) -> str:
+    """
+    "IMG_8821_v2 (copy).jpg" -> "img_8821.jpg"
+    """
+    base, extension = split_extension(filename.strip())
+    cleaned = base.lower()
+    for junk in _FILENAME_JUNK_RES:
+        cleaned = junk.sub(" ", cleaned)
+    cleaned = re.sub(r"[^a-z0-9]+", "_", cleaned).strip("_")
+    # Nothing left but junk: keep what the name had
+    cleaned = cleaned or re.sub(r"[^a-z0-9]+", "_", base.lower()).strip("_") or "file"
+    return f"{cleaned}.{extension.lower()}" if extension else cleaned
 
-    return {"downloadUrl": url}
+
+SUGGESTION_FALLBACKS = {"tags": rule_based_tags, "name": normalize_filename}
+# --- END RULE-BASED SUGGESTIONS ---
 
 
 # --- NEW ENDPOINT: /suggest-tags ---
 # (No changes needed)
 # --- MODIFIED: get_ai_tags function ---
-def get_ai_tags(filename: str) -> List[str]:
+def get_ai_tags(filename: str) -> Optional[List[str]]:
     """
     Use Claude via Bedrock to suggest relevant tags for a file based on its name.
-    Falls back to rule-based logic if Bedrock fails.
+    None if Bedrock fails; cached_suggestion then falls back to rule_based_tags.
     """
     try:
         prompt = f"""You are an intelligent file organization assistant.
@@ -288,7 +3355,7 @@ Examples:
 
 Now suggest tags for: "{filename}" """
 
-        body = json.dumps({
+        body = {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": 50,
             "temperature": 0.1,
@@ -298,58 +3365,40 @@ Now suggest tags for: "{filename}" """
                     "content": [{"type": "text", "text": prompt}]
                 }
             ]
-        })
-        
-        response = bedrock_runtime.invoke_model(
-            body=body, 
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",
-            contentType="application/json",
-            accept="application/json"
-        )
-        
-        response_body = json.loads(response.get("body").read())
-        raw_tags = response_body.get("content", [{}])[0].get("text", "")
+        }
+
+        raw_tags = response_text(invoke_bedrock(body, SUGGESTION_MODEL_ID))
         
         print(f"Claude response for tags: {raw_tags}")
         
         # Clean up the LLM output
         # Remove any extra whitespace, quotes, or newlines
         raw_tags = raw_tags.strip().strip('"').strip("'")
-        tags = [tag.strip().lower() for tag in raw_tags.split(",") if tag.strip()]
+        tags = clean_suggested_tags(raw_tags.split(","))
         
         if tags:
-            # Return unique tags, max 3
-            unique_tags = []
-            for tag in tags:
-                if tag not in unique_tags:
-                    unique_tags.append(tag)
-                if len(unique_tags) >= 3:
-                    break
-            return unique_tags
+            return tags
             
     except Exception as e:
         print(f"Bedrock call failed: {e}. Falling back to rule-based tags.")
 
+    return None
 
 
-@app.get("/suggest-tags")
-def suggest_tags(filename: str, Authorization: str = Header(None)):
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
-    
-    # Verify token to ensure user is authenticated
-    verify_token(Authorization.split(" ")[1]) 
-    
-    tags = get_ai_tags(filename)
+
+@app.get("/suggest-tags", dependencies=[Depends(require_auth)])
+async def suggest_tags(filename: str):
+    tags = await cached_suggestion("tags", filename, get_ai_tags)
     return {"tags": tags}
 # --- END NEW ENDPOINT ---
 
 
-# --- !! NEW: HELPER FUNCTION get_ai_name !! ---
-def get_ai_name(original_filename: str) -> str:
+# --- !! NEW: HELPER FUNCTION get_ai_name_or_none !! ---
+def get_ai_name_or_none(original_filename: str) -> Optional[str]:
     """
-    Use Claude via Bedrock to suggest a cleaned-up filename.
-    Falls back to the original name if Bedrock fails.
+    Claude's cleaned-up filename via Bedrock, or None when there is no
+    usable suggestion, so a fallback is never cached as if it were a model
+    answer.
     """
     try:
         # Get the file extension, if it exists
@@ -381,7 +3430,7 @@ Original filename: "{original_filename}"
 
 Provide ONLY the cleaned filename with extension, nothing else."""
 
-        body = json.dumps({
+        body = {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": 100,
             "temperature": 0.2,
@@ -391,196 +3440,818 @@ Provide ONLY the cleaned filename with extension, nothing else."""
                     "content": [{"type": "text", "text": prompt}]
                 }
             ]
-        })
-        
-        response = bedrock_runtime.invoke_model(
-            body=body, 
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",
-            contentType="application/json",
-            accept="application/json"
-        )
-        
-        response_body = json.loads(response.get("body").read())
-        suggested_name = response_body.get("content", [{}])[0].get("text", "").strip()
+        }
+
+        suggested_name = response_text(invoke_bedrock(body, SUGGESTION_MODEL_ID)).strip()
         
         print(f"Claude response for name: {suggested_name}")
         
-        # Clean up the response - remove quotes, extra whitespace, newlines
-        suggested_name = suggested_name.strip().strip('"').strip("'").strip()
-        
-        # If response has multiple lines, take the first one
-        if '\n' in suggested_name:
-            suggested_name = suggested_name.split('\n')[0].strip()
-
-        # Validate the suggestion
-        if suggested_name and len(suggested_name) > 0:
-            # Ensure the extension is still there if it's supposed to be
-            if extension and not suggested_name.lower().endswith(f".{extension.lower()}"):
-                # If the model forgot the extension, add it back
-                clean_base = suggested_name.rsplit('.', 1)[0].strip()
-                return f"{clean_base}.{extension}"
-            
-            return suggested_name
+        return clean_suggested_name(suggested_name, original_filename)
             
     except Exception as e:
-        print(f"Bedrock name suggestion failed: {e}. Falling back to original name.")
-    
-    # Fallback to the original name if AI fails
-    return original_filename
+        print(f"Bedrock name suggestion failed: {e}. Falling back to the normalized name.")
+
+    return None
 # --- !! END HELPER FUNCTION !! ---
 
 
 # --- !! NEW ENDPOINT: /suggest-name !! ---
-@app.get("/suggest-name")
-def suggest_name(filename: str, Authorization: str = Header(None)):
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
-    
-    # Verify token to ensure user is authenticated
-    verify_token(Authorization.split(" ")[1]) 
-    
+@app.get("/suggest-name", dependencies=[Depends(require_auth)])
+async def suggest_name(filename: str):
     # Get the AI-suggested name
-    suggested_name = get_ai_name(filename)
+    suggested_name = await cached_suggestion("name", filename, get_ai_name_or_none)
     
     return {"suggested_name": suggested_name}
 # --- !! END NEW ENDPOINT !! ---
 
 
-# --- NEW ENDPOINT: /files/{fileId}/tags ---
-@app.put("/files/{fileId}/tags")
-def update_tags(fileId: str, tags_update: TagsUpdate, Authorization: str = Header(None)):
-    # (No changes needed)
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
+# --- BATCH SUGGESTIONS: /suggest/batch ---
+SUGGEST_BATCH_MAX_FILES = 200
+# Per-chunk budgets. Input is estimated at ~4 characters per token; each
+# answer is a short JSON object.
+SUGGEST_BATCH_INPUT_TOKENS = 6000
+SUGGEST_BATCH_MAX_OUTPUT_TOKENS = 4096
+SUGGEST_BATCH_OUTPUT_TOKENS_PER_FILE = 40
+# Files a batch answer left out are retried in prompts this small, and
+# only what is still missing goes to the single-file path, a few at a time
+SUGGEST_BATCH_RETRY_FILES = 10
+SUGGEST_BATCH_FALLBACK_CONCURRENCY = 2
 
-    token = Authorization.split(" ")[1]
-    claims = verify_token(token)
-    user_id = claims["sub"]
+SUGGEST_BATCH_PROMPT = """You are a file organization assistant. For every file below, suggest a
+cleaned-up filename and 2-3 short, relevant, lowercase tags.
 
-    # 1. Check if file exists and belongs to user
-    resp = table.get_item(Key={"userId": user_id, "fileId": fileId})
-    item = resp.get("Item")
-    if not item:
-        raise HTTPException(status_code=404, detail="File not found")
+Filename rules:
+- Use underscores (_) instead of spaces
+- Use lowercase
+- Remove special characters, timestamps, version numbers, or junk
+- Keep it descriptive and concise
+- MUST keep the original file extension
+
+Examples:
+- "IMG_8821_v2 (copy).jpg" -> name "img_8821.jpg", tags ["photo", "media"]
+- "2025-01-20_Invoice-CLIENT.pdf" -> name "invoice_client.pdf", tags ["finance", "invoice", "document"]
+
+Files (index: filename):
+{files}
+
+Respond with ONLY a JSON array, one object per file, in this form:
+[{{"i": 0, "name": "cleaned_name.ext", "tags": ["tag1", "tag2"]}}]"""
+
+
+class BatchSuggestRequest(BaseModel):
+    filenames: List[str]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def chunk_for_prompt(filenames: List[str]) -> List[List[str]]:
+    """
+    Packs filenames into as few prompts as the input and output token
+    budgets allow.
+    """
+    base = estimate_tokens(SUGGEST_BATCH_PROMPT)
+    max_per_chunk = SUGGEST_BATCH_MAX_OUTPUT_TOKENS // SUGGEST_BATCH_OUTPUT_TOKENS_PER_FILE
+    chunks, current, used = [], [], base
+    for filename in filenames:
+        cost = estimate_tokens(filename) + 4
+        if current and (used + cost > SUGGEST_BATCH_INPUT_TOKENS or len(current) >= max_per_chunk):
+            chunks.append(current)
+            current, used = [], base
+        current.append(filename)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
 
-    # 2. Update the item with new tags
+
+def parse_batch_answer(text: str, filenames: List[str]) -> dict:
+    """
+    {filename: {"suggested_name", "tags"}} for every well-formed entry.
+    Entries that are missing or malformed are left out.
+    """
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end <= start:
+        return {}
     try:
-        table.update_item(
-            Key={"userId": user_id, "fileId": fileId},
-            UpdateExpression="SET tags = :t",
-            ExpressionAttributeValues={":t": tags_update.tags}
-        )
-        return {"message": "Tags updated successfully", "fileId": fileId, "tags": tags_update.tags}
+        entries = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+
+    results = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get("i")
+        if not isinstance(index, int) or not 0 <= index < len(filenames):
+            continue
+        filename = filenames[index]
+        name = clean_suggested_name(entry.get("name"), filename)
+        tags = clean_suggested_tags(entry.get("tags")) if isinstance(entry.get("tags"), list) else []
+        if name and tags:
+            results[filename] = {"suggested_name": name, "tags": tags}
+    return results
+
+
+def invoke_batch_suggestions(filenames: List[str]) -> dict:
+    listing = "\n".join(f"{i}: {json.dumps(name)}" for i, name in enumerate(filenames))
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": min(SUGGEST_BATCH_MAX_OUTPUT_TOKENS,
+                          SUGGEST_BATCH_OUTPUT_TOKENS_PER_FILE * len(filenames) + 50),
+        "temperature": 0.1,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": SUGGEST_BATCH_PROMPT.format(files=listing)}]
+            }
+        ]
+    }
+    try:
+        text = response_text(invoke_bedrock(body, SUGGESTION_MODEL_ID))
+    except Exception as e:
+        print(f"Bedrock batch suggestion failed: {e}. Falling back to per-file suggestions.")
+        return {}
+    return parse_batch_answer(text, filenames)
+
+
+async def suggest_one(filename: str) -> dict:
+    # One of many: a hedge would only add to the fan-out's load
+    name, tags = await asyncio.gather(
+        cached_suggestion("name", filename, get_ai_name_or_none, hedge=False),
+        cached_suggestion("tags", filename, get_ai_tags, hedge=False),
+    )
+    return {"suggested_name": name, "tags": tags}
+
+
+async def run_batch_prompts(chunks: List[List[str]], suggestions: dict):
+    """Runs the batch prompts concurrently and caches and collects the answers."""
+    answers = await asyncio.gather(*(run_aws("bedrock", invoke_batch_suggestions, chunk) for chunk in chunks))
+    stores = []
+    for answer in answers:
+        for filename, suggestion in answer.items():
+            suggestions[filename] = suggestion
+            stores.append(store_suggestion("name", filename, suggestion["suggested_name"]))
+            stores.append(store_suggestion("tags", filename, suggestion["tags"]))
+    await asyncio.gather(*stores)
+
+
+@app.post("/suggest/batch", dependencies=[Depends(require_auth)])
+async def suggest_batch(request: BatchSuggestRequest):
+    """
+    Names and tags for many files at once. Cached answers are used as-is;
+    the rest are packed into as few Bedrock prompts as the token budget
+    allows, run concurrently. Files the model answers badly are retried in
+    smaller prompts, and only those still missing fall back to the
+    single-file suggestion path.
+    """
+    if len(request.filenames) > SUGGEST_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {SUGGEST_BATCH_MAX_FILES} files per batch")
+
+    unique = list(dict.fromkeys(f for f in request.filenames if f.strip()))
+    suggestions = {}
+
+    async def from_cache(filename):
+        name, tags = await asyncio.gather(lookup_suggestion("name", filename), lookup_suggestion("tags", filename))
+        if name is not None and tags is not None:
+            suggestions[filename] = {"suggested_name": name, "tags": tags}
+
+    await asyncio.gather(*(from_cache(f) for f in unique))
+    pending = [f for f in unique if f not in suggestions]
+
+    await run_batch_prompts(chunk_for_prompt(pending), suggestions)
+    missing = [f for f in pending if f not in suggestions]
+    await run_batch_prompts(chunked(missing, SUGGEST_BATCH_RETRY_FILES), suggestions)
+
+    missing = [f for f in pending if f not in suggestions]
+    fallback_slots = asyncio.Semaphore(SUGGEST_BATCH_FALLBACK_CONCURRENCY)
+
+    async def fall_back(filename):
+        async with fallback_slots:
+            suggestions[filename] = await suggest_one(filename)
+
+    await asyncio.gather(*(fall_back(f) for f in missing))
+
+    results = []
+    for filename in request.filenames:
+        suggestion = suggestions.get(filename, {"suggested_name": filename, "tags": None})
+        results.append({"filename": filename, **suggestion})
+    return {"results": results}
+# --- END BATCH SUGGESTIONS ---
+
+
+# --- FILE METADATA WRITES ---
+# A metadata edit is one conditional update_item. It fails if the file does
+# not exist and, when the client sends the version it last saw, if anyone
+# edited the file since (409 instead of a silent overwrite). Every edit
+# bumps `version`; a file never edited is version 0. The write returns the
+# record as it was (ALL_OLD): the index diff needs the old tags, and the
+# new record follows from it.
+#
+# PATCH /files/{fileId} edits name and tags together. When tag index items
+# are involved, the record and its index items are written in one
+# TransactWriteItems, guarded on the version it read.
+DDB_TRANSACT_MAX_ITEMS = 100
+FILE_PATCH_ATTEMPTS = 3
+# Cancellation reasons that mean "try again from a fresh read": the record
+# changed, or another transaction was holding one of the items (typically
+# a shared {user}#tags count)
+FILE_PATCH_RETRYABLE_REASONS = {"ConditionalCheckFailed", "TransactionConflict"}
+_ddb_deserializer = TypeDeserializer()
+
+
+class FileVersionConflict(Exception):
+    def __init__(self, item: dict):
+        super().__init__(f"File {item['fileId']} is at version {file_version(item)}")
+        self.item = item
+
+
+class FilePatch(BaseModel):
+    filename: Optional[str] = None
+    tags: Optional[List[str]] = None
+    version: Optional[int] = None
+
+
+def file_version(item: dict) -> int:
+    return int(item.get("version", 0))
+
+
+def _version_condition(version: Optional[int], values: dict) -> str:
+    if version is None:
+        return ""
+    values[":seen"] = version
+    if version == 0:
+        return " AND (attribute_not_exists(version) OR version = :seen)"
+    return " AND version = :seen"
+
+
+def _conflict_response(e: FileVersionConflict) -> HTTPException:
+    # A plain-string detail, like every other error the API returns
+    return HTTPException(status_code=409,
+                         detail=f"File was changed by another request (now at version {file_version(e.item)})")
+
+
+def update_file_record(user_id: str, file_id: str, changes: dict,
+                       expected_version: Optional[int] = None) -> Optional[tuple]:
+    """
+    Applies {attribute: value} in one conditional update_item and bumps the
+    version. Returns (old, new) records, or None if there is no such file;
+    raises FileVersionConflict if expected_version is stale. A write that
+    would change nothing is refused by its condition, so the version is
+    not bumped, and (current, current) is returned: the same object twice.
+    A legacy row (no objectKey) being renamed gets its key pinned in a
+    second write, guarded on the version the failed write returned.
+    """
+    key = {"userId": user_id, "fileId": file_id}
+    names, values, sets = {}, {":one": 1}, []
+    for i, (name, value) in enumerate(changes.items()):
+        names[f"#c{i}"] = name
+        values[f":c{i}"] = value
+        sets.append(f"#c{i} = :c{i}")
+    if "objectKey" in changes:
+        condition = "attribute_exists(fileId) AND attribute_not_exists(objectKey)"
+    elif "filename" in changes:
+        condition = "attribute_exists(objectKey)"
+    else:
+        condition = "attribute_exists(fileId)"
+    condition += _version_condition(expected_version, values)
+    condition += " AND (" + " OR ".join(f"attribute_not_exists(#c{i}) OR #c{i} <> :c{i}"
+                                        for i in range(len(changes))) + ")"
+    try:
+        old = table.update_item(
+            Key=key,
+            UpdateExpression=f"SET {', '.join(sets)} ADD version :one",
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_OLD",
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
+        )["Attributes"]
+        return old, {**old, **changes, "version": file_version(old) + 1}
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        current = e.response.get("Item")
+
+    if not current:
+        return None
+    current = {name: _ddb_deserializer.deserialize(value) for name, value in current.items()}
+    if expected_version is not None and file_version(current) != expected_version:
+        raise FileVersionConflict(current)
+    requested = {name: value for name, value in changes.items() if name != "objectKey"}
+    if all(name in current and current[name] == value for name, value in requested.items()):
+        return current, current
+    if "objectKey" in current or "filename" not in requested:
+        # Changed between the two checks; go again against the new state
+        return update_file_record(user_id, file_id, requested, expected_version)
+    # A legacy row being renamed: pin the key its current filename implies,
+    # guarded on the version that filename was read at
+    try:
+        return update_file_record(user_id, file_id, {**requested, "objectKey": stored_object_key(current)},
+                                  file_version(current))
+    except FileVersionConflict:
+        if expected_version is not None:
+            raise
+        return update_file_record(user_id, file_id, requested)
+
+
+def _tag_index_operations(user_id: str, old: dict, new: dict) -> tuple:
+    """
+    (TransactWriteItems operations, {tag: count delta}) that bring the tag
+    index from `old` to `new`.
+    """
+    old_tags = set(normalize_tags(old.get("tags")))
+    new_tags = normalize_tags(new.get("tags"))
+    operations = []
+    for tag in new_tags:
+        operations.append({"Put": {"TableName": table.name, "Item": {
+            **format_file(new), "userId": tag_partition(user_id, tag)}}})
+    for tag in old_tags - set(new_tags):
+        operations.append({"Delete": {"TableName": table.name, "Key": {
+            "userId": tag_partition(user_id, tag), "fileId": new["fileId"]}}})
+    deltas = {**{tag: 1 for tag in set(new_tags) - old_tags}, **{tag: -1 for tag in old_tags - set(new_tags)}}
+    for tag, delta in deltas.items():
+        operations.append({"Update": {
+            "TableName": table.name,
+            "Key": {"userId": tag_counts_partition(user_id), "fileId": tag},
+            "UpdateExpression": "ADD fileCount :d",
+            "ExpressionAttributeValues": {":d": delta},
+        }})
+    return operations, deltas
+
+
+def patch_file_record(user_id: str, file_id: str, filename: Optional[str], tags: Optional[List[str]],
+                      expected_version: Optional[int] = None) -> Optional[tuple]:
+    """
+    (old, new) after applying a rename and/or new tags, or None if there is
+    no such file. The record and its tag index items change in one
+    transaction guarded on the version read; a concurrent edit makes it
+    start over from a fresh read, or raise FileVersionConflict if the
+    caller pinned a version.
+    """
+    key = {"userId": user_id, "fileId": file_id}
+    item = None
+    for _ in range(FILE_PATCH_ATTEMPTS):
+        item = table.get_item(Key=key, ConsistentRead=True).get("Item")
+        if not item:
+            return None
+        if expected_version is not None and file_version(item) != expected_version:
+            raise FileVersionConflict(item)
+
+        changes = {}
+        if filename is not None and filename != item.get("filename"):
+            changes["filename"] = filename
+        if tags is not None and tags != item.get("tags", []):
+            changes["tags"] = tags
+        if not changes:
+            return item, item
+        if "filename" in changes and "objectKey" not in item:
+            changes["objectKey"] = stored_object_key(item)
+        new = {**item, **changes, "version": file_version(item) + 1}
+
+        if is_pending_upload(item):
+            # Not indexed until confirmed
+            index_operations, deltas = [], {}
+        else:
+            index_operations, deltas = _tag_index_operations(user_id, item, new)
+        if not index_operations or len(index_operations) >= DDB_TRANSACT_MAX_ITEMS:
+            try:
+                result = update_file_record(user_id, file_id, changes, file_version(item))
+            except FileVersionConflict:
+                continue
+            if result and (index_operations or is_pending_upload(item)) and not is_pending_upload(result[0]):
+                # Too many tags for one transaction, or confirmed since the
+                # read: the tag index follows separately
+                sync_tag_index(user_id, file_id, result[0].get("tags", []), result[1])
+            return result
+
+        values = {":one": 1}
+        condition = "attribute_exists(fileId)" + _version_condition(file_version(item), values)
+        values.update({f":c{i}": value for i, value in enumerate(changes.values())})
+        record_update = {"Update": {
+            "TableName": table.name,
+            "Key": key,
+            "UpdateExpression": "SET " + ", ".join(f"#c{i} = :c{i}" for i in range(len(changes))) + " ADD version :one",
+            "ConditionExpression": condition,
+            "ExpressionAttributeNames": {f"#c{i}": name for i, name in enumerate(changes)},
+            "ExpressionAttributeValues": values,
+        }}
+        try:
+            ddb.meta.client.transact_write_items(TransactItems=[record_update] + index_operations)
+        except ClientError as e:
+            reasons = {r.get("Code") for r in e.response.get("CancellationReasons") or []} - {"None", None}
+            if (e.response["Error"]["Code"] != "TransactionCanceledException"
+                    or not reasons or not reasons <= FILE_PATCH_RETRYABLE_REASONS):
+                raise
+            continue  # edited concurrently, or a tag count item was busy
+        for tag, delta in deltas.items():
+            if delta < 0:
+                _drop_empty_tag_count(user_id, tag)
+        return item, new
+    raise FileVersionConflict(item)
+
+
+# --- NEW ENDPOINT: /files/{fileId}/tags ---
+@app.put("/files/{fileId}/tags")
+async def update_tags(fileId: str, tags_update: TagsUpdate, claims: dict = Depends(require_auth)):
+    user_id = claims["sub"]
+    new_tags = normalize_tags(tags_update.tags)
+    try:
+        result = await run_aws("dynamodb", update_file_record, user_id, fileId, {"tags": new_tags},
+                               tags_update.version)
+    except FileVersionConflict as e:
+        raise _conflict_response(e)
     except Exception as e:
         print(f"Error updating tags: {e}")
         raise HTTPException(status_code=500, detail="Failed to update tags")
+    if result is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Keep the tag and search indexes in step
+    old, new = result
+    if new is not old and not is_pending_upload(old):
+        await run_aws("dynamodb", sync_file_indexes, user_id, fileId, old.get("tags", []), new)
+    return {"message": "Tags updated successfully", "fileId": fileId, "tags": new_tags,
+            "version": file_version(new)}
 # --- END NEW ENDPOINT ---
 
 
 # --- !! NEW ENDPOINT: /files/{fileId}/rename !! ---
 @app.put("/files/{fileId}/rename")
-def rename_file(fileId: str, update: FilenameUpdate, Authorization: str = Header(None)):
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
-
-    token = Authorization.split(" ")[1]
-    claims = verify_token(token)
+async def rename_file(fileId: str, update: FilenameUpdate, claims: dict = Depends(require_auth)):
     user_id = claims["sub"]
 
-    # 1. Get current file data from DDB
-    resp = table.get_item(Key={"userId": user_id, "fileId": fileId})
-    item = resp.get("Item")
-    if not item:
-        raise HTTPException(status_code=404, detail="File not found")
-
-    old_filename = item.get("filename", "unknown")
     new_filename = update.new_filename.strip()
 
     if not new_filename:
          raise HTTPException(status_code=400, detail="New filename cannot be empty")
 
-    if old_filename == new_filename:
-        # No change needed
-        return {"message": "Filename is unchanged", "fileId": fileId, "filename": new_filename}
-
-    # 2. Rename in S3 (Copy + Delete)
-    old_key = f"{user_id}/{fileId}/{old_filename}"
-    new_key = f"{user_id}/{fileId}/{new_filename}"
-
-    try:
-        s3.copy_object(
-            Bucket=BUCKET,
-            CopySource={'Bucket': BUCKET, 'Key': old_key},
-            Key=new_key
-        )
-        s3.delete_object(Bucket=BUCKET, Key=old_key)
-    except Exception as e:
-        print(f"Error renaming in S3: {e}")
-        # If S3 fails, we should NOT update DynamoDB.
-        raise HTTPException(status_code=500, detail=f"Failed to rename file in S3: {e}")
-
-    # 3. Update filename in DynamoDB
+    # The filename lives only in DynamoDB, so a rename is a metadata write
+    # whatever the object's size.
     try:
-        table.update_item(
-            Key={"userId": user_id, "fileId": fileId},
-            UpdateExpression="SET filename = :f",
-            ExpressionAttributeValues={":f": new_filename}
-        )
-        return {"message": "File renamed successfully", "fileId": fileId, "filename": new_filename}
+        result = await run_aws("dynamodb", update_file_record, user_id, fileId, {"filename": new_filename},
+                               update.version)
+    except FileVersionConflict as e:
+        raise _conflict_response(e)
     except Exception as e:
         print(f"Error updating DynamoDB: {e}")
-        # This is an inconsistent state, but we must report the error.
-        raise HTTPException(status_code=500, detail="S3 rename OK, but failed to update database.")
+        raise HTTPException(status_code=500, detail="Failed to rename file")
+    if result is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    old, new = result
+    if new is old:
+        # No change needed
+        return {"message": "Filename is unchanged", "fileId": fileId, "filename": new_filename,
+                "version": file_version(new)}
+
+    # Tag and search index entries carry the filename too, and so does the
+    # Content-Disposition of any cached download URL
+    invalidate_presigned_urls(user_id, [fileId])
+    if not is_pending_upload(old):
+        await run_aws("dynamodb", sync_file_indexes, user_id, fileId, old.get("tags", []), new)
+    return {"message": "File renamed successfully", "fileId": fileId, "filename": new_filename,
+            "version": file_version(new)}
 # --- !! END NEW ENDPOINT !! ---
 
-@app.post("/share")
-def share_file(fileId: str, recipient: str, Authorization: str = Header(None)):
-    print("🔥 SHARE ENDPOINT HIT", fileId, recipient)
-    if not Authorization:
-        raise HTTPException(status_code=401, detail="Missing token")
 
-    token = Authorization.split(" ")[1]
-    claims = verify_token(token)
+@app.patch("/files/{fileId}")
+async def patch_file(fileId: str, patch: FilePatch, claims: dict = Depends(require_auth)):
+    """
+    Rename and/or retag a file in one request. Send `version` to have the
+    edit rejected with 409 if the file changed since that version.
+    """
     user_id = claims["sub"]
-    sender_email = claims.get("email", "no-reply@clouddocs.com")
+    filename = patch.filename.strip() if patch.filename is not None else None
+    if filename == "":
+        raise HTTPException(status_code=400, detail="New filename cannot be empty")
+    tags = normalize_tags(patch.tags) if patch.tags is not None else None
 
-    # Fetch file info
-    item = table.get_item(Key={"userId": user_id, "fileId": fileId}).get("Item")
-    if not item:
+    try:
+        result = await run_aws("dynamodb", patch_file_record, user_id, fileId, filename, tags, patch.version)
+    except FileVersionConflict as e:
+        raise _conflict_response(e)
+    if result is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Generate 1-hour link
-    key = f"{user_id}/{fileId}/{item['filename']}"
-    download_url = s3.generate_presigned_url(
-        "get_object",
-        Params={"Bucket": BUCKET, "Key": key},
-        ExpiresIn=3600
-    )
+    old, new = result
+    if new is not old:
+        if new.get("filename") != old.get("filename"):
+            invalidate_presigned_urls(user_id, [fileId])
+        if not is_pending_upload(old):
+            await run_aws("dynamodb", update_search_index, user_id, fileId, new)
+    return {**format_file(new), "version": file_version(new)}
+# --- END FILE METADATA WRITES ---
 
-    # Email content
-    subject = f"CloudDocs File Shared: {item['filename']}"
-    body_text = (
-        f"Hello,\n\n"
-        f"{sender_email} has shared a file with you.\n\n"
-        f"File name: {item['filename']}\n"
-        f"Download link (valid for 60 minutes):\n{download_url}\n\n"
-        f"Regards,\nCloudDocs"
-    )
+# --- SHARE PIPELINE ---
+# /share and /share/batch only check the files and enqueue the sends; a
+# worker signs the links and delivers them with SES bulk templated email.
+# Links are signed at send time, so SQS retries and DLQ redrives never
+# mail out a link that has already expired. With SHARE_QUEUE_URL
+# set the queue is SQS and the worker is this function's SQS trigger;
+# without it (tests, local runs) the queue lives in process and is drained
+# after the response. Job progress is kept in {user}#jobs items: each
+# recipient is added to sentRecipients or failedRecipients as soon as SES
+# answers for it, so a redelivered message skips whoever was already
+# handled.
+SHARE_QUEUE_URL = os.environ.get("SHARE_QUEUE_URL")
+SHARE_MAX_FILES = 20
+SHARE_MAX_RECIPIENTS = 500
+SES_BULK_DESTINATIONS = 50
+SES_MAX_SEND_RATE = 10.0  # emails per second, per container
+SHARE_MAX_ATTEMPTS = 4
+SHARE_RETRY_BASE_DELAY = 0.5
+SHARE_JOB_TTL = 7 * 24 * 3600
+SHARE_EMAIL_TEMPLATE = "CloudDocsShare"
+# Per-destination statuses worth another attempt
+SES_RETRYABLE_STATUSES = {"AccountThrottled", "TransientFailure", "Failed"}
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+SHARE_TEMPLATE_CONTENT = {
+    "TemplateName": SHARE_EMAIL_TEMPLATE,
+    "SubjectPart": "CloudDocs File Shared: {{subject}}",
+    "TextPart": (
+        "Hello,\n\n"
+        "{{sender}} has shared {{count}} file(s) with you.\n\n"
+        "{{#each files}}File name: {{filename}}\n"
+        f"Download link (valid for {SHARE_URL_EXPIRY // 60} minutes):\n"
+        "{{url}}\n\n{{/each}}"
+        "Regards,\nCloudDocs"
+    ),
+}
+
+
+class ShareRequest(BaseModel):
+    fileIds: List[str]
+    recipients: List[str]
+
+
+class InProcessShareQueue:
+    """Local stand-in for the SQS queue."""
+
+    def __init__(self):
+        self._messages = []
+        self._lock = threading.Lock()
+
+    def send(self, messages: List[dict]):
+        with self._lock:
+            self._messages.extend(messages)
+
+    def take(self) -> List[dict]:
+        with self._lock:
+            messages, self._messages = self._messages, []
+        return messages
+
+
+class SQSShareQueue:
+    def __init__(self, queue_url: str):
+        self.queue_url = queue_url
+
+    def send(self, messages: List[dict]):
+        for batch in chunked(messages, 10):
+            resp = sqs.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{"Id": str(i), "MessageBody": json.dumps(m)} for i, m in enumerate(batch)],
+            )
+            if resp.get("Failed"):
+                raise RuntimeError(f"SQS rejected {len(resp['Failed'])} share messages")
+
+
+share_queue = SQSShareQueue(SHARE_QUEUE_URL) if SHARE_QUEUE_URL else InProcessShareQueue()
 
+
+class RateLimiter:
+    """Thread-safe token bucket: acquire(n) blocks until n tokens are free."""
+
+    def __init__(self, rate: float, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self._available = rate
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: int = 1):
+        with self._lock:
+            now = self.clock()
+            self._available = min(self.rate, self._available + (now - self._updated) * self.rate)
+            self._updated = now
+            self._available -= n
+            wait = -self._available / self.rate if self._available < 0 else 0
+        if wait:
+            self.sleep(wait)
+
+
+ses_rate = RateLimiter(SES_MAX_SEND_RATE)
+_share_template_ready = False
+
+
+def ensure_share_template():
+    global _share_template_ready
+    if _share_template_ready:
+        return
     try:
-        # SES send email
-        ses.send_email(
-            Source=sender_email,  # must be verified in SES
-            Destination={
-                "ToAddresses": [recipient]
-            },
-            Message={
-                "Subject": {"Data": subject},
-                "Body": {"Text": {"Data": body_text}},
-            },
+        ses.create_template(Template=SHARE_TEMPLATE_CONTENT)
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "AlreadyExists":
+            raise
+    _share_template_ready = True
+
+
+def _share_job_key(user_id: str, job_id: str) -> dict:
+    return {"userId": f"{user_id}#jobs", "fileId": job_id}
+
+
+def share_links(user_id: str, file_ids: List[str]) -> List[dict]:
+    """
+    [{"filename", "url"}] signed now for SHARE_URL_EXPIRY. Files deleted
+    since the share was queued are left out.
+    """
+    items = batch_get_files(user_id, file_ids)
+    return [{"filename": items[f]["filename"], "url": presign_get(items[f], SHARE_URL_EXPIRY)}
+            for f in file_ids if f in items]
+
+
+def record_share_outcome(message: dict, sent: List[str], failed: List[str]):
+    # String sets, so recording a recipient twice doesn't count it twice
+    additions = {name: set(recipients) for name, recipients in
+                 (("sentRecipients", sent), ("failedRecipients", failed)) if recipients}
+    if not additions:
+        return
+    table.update_item(
+        Key=_share_job_key(message["userId"], message["jobId"]),
+        UpdateExpression="ADD " + ", ".join(f"{name} :{name}" for name in additions),
+        ExpressionAttributeValues={f":{name}": value for name, value in additions.items()},
+    )
+
+
+def send_share_message(message: dict) -> dict:
+    """
+    Delivers one queued message (up to 50 recipients) with
+    SendBulkTemplatedEmail, retrying throttled and transient failures with
+    jittered exponential backoff. Each attempt's outcome is recorded on the
+    job before the next one; recipients the job already has an outcome for
+    (a redelivered message) are skipped.
+    """
+    job = table.get_item(Key=_share_job_key(message["userId"], message["jobId"]),
+                         ConsistentRead=True).get("Item") or {}
+    handled = set(job.get("sentRecipients", ())) | set(job.get("failedRecipients", ()))
+    pending = [r for r in message["recipients"] if r not in handled]
+    if not pending:
+        return {"sent": [], "failed": []}
+    ensure_share_template()
+    files = share_links(message["userId"], message["fileIds"])
+    if not files:
+        # Every shared file was deleted before the send
+        record_share_outcome(message, [], pending)
+        return {"sent": [], "failed": pending}
+    template_data = json.dumps({
+        "sender": message["sender"],
+        "subject": files[0]["filename"] if len(files) == 1 else f"{len(files)} files",
+        "count": len(files),
+        "files": files,
+    })
+    sent, failed = [], []
+    for attempt in range(SHARE_MAX_ATTEMPTS):
+        ses_rate.acquire(len(pending))
+        try:
+            resp = ses.send_bulk_templated_email(
+                Source=message["sender"],  # must be verified in SES
+                Template=SHARE_EMAIL_TEMPLATE,
+                DefaultTemplateData=template_data,
+                Destinations=[{"Destination": {"ToAddresses": [r]}} for r in pending],
+            )
+            statuses = [s.get("Status", "Failed") for s in resp["Status"]]
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("Throttling", "ThrottlingException", "ServiceUnavailable"):
+                raise
+            statuses = ["AccountThrottled"] * len(pending)
+
+        retry, newly_sent, newly_failed = [], [], []
+        for recipient, status in zip(pending, statuses):
+            if status == "Success":
+                newly_sent.append(recipient)
+            elif status in SES_RETRYABLE_STATUSES:
+                retry.append(recipient)
+            else:
+                newly_failed.append(recipient)
+        record_share_outcome(message, newly_sent, newly_failed)
+        sent += newly_sent
+        failed += newly_failed
+        pending = retry
+        if not pending:
+            break
+        if attempt < SHARE_MAX_ATTEMPTS - 1:
+            time.sleep(SHARE_RETRY_BASE_DELAY * 2 ** attempt * (0.5 + random.random()))
+    record_share_outcome(message, [], pending)
+    failed.extend(pending)
+    return {"sent": sent, "failed": failed}
+
+
+async def drain_share_queue():
+    for message in share_queue.take():
+        try:
+            await run_aws("ses", send_share_message, message)
+        except Exception as e:
+            print(f"Share send failed for job {message['jobId']}: {e}")
+
+
+def handle_share_messages(event: dict) -> dict:
+    # Partial batch response: only the failed records go back on the queue
+    failures = []
+    for record in event["Records"]:
+        try:
+            send_share_message(json.loads(record["body"]))
+        except Exception as e:
+            print(f"Share send failed for message {record.get('messageId')}: {e}")
+            failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": failures}
+
+
+async def enqueue_share(user_id: str, sender: str, file_ids: List[str], recipients: List[str]) -> dict:
+    file_ids = list(dict.fromkeys(file_ids))
+    recipients = list(dict.fromkeys(r.strip() for r in recipients if r.strip()))
+    if not file_ids or not recipients:
+        raise HTTPException(status_code=400, detail="At least one file and one recipient are required")
+    if len(file_ids) > SHARE_MAX_FILES or len(recipients) > SHARE_MAX_RECIPIENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {SHARE_MAX_FILES} files and {SHARE_MAX_RECIPIENTS} recipients per share",
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"SES email send failed: {e}")
+    invalid = [r for r in recipients if not _EMAIL_RE.match(r)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid recipient: {invalid[0]}")
 
-    return {"message": "Email sent successfully"}
+    # Any file that isn't the caller's fails the share; the links are
+    # signed by the worker
+    items = await run_aws("dynamodb", batch_get_files, user_id, file_ids)
+    if any(f not in items or is_pending_upload(items[f]) for f in file_ids):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    job_id = str(uuid.uuid4())
+    await run_aws("dynamodb", table.put_item, Item={
+        **_share_job_key(user_id, job_id),
+        "total": len(recipients),
+        "fileIds": file_ids,
+        "queuedAt": int(time.time()),
+        "expiresAt": int(time.time()) + SHARE_JOB_TTL,
+    })
+    messages = [
+        {"jobId": job_id, "userId": user_id, "sender": sender, "fileIds": file_ids, "recipients": batch}
+        for batch in chunked(recipients, SES_BULK_DESTINATIONS)
+    ]
+    if isinstance(share_queue, SQSShareQueue):
+        await run_aws("sqs", share_queue.send, messages)
+    else:
+        share_queue.send(messages)
+    return {"message": "Share queued", "jobId": job_id, "recipients": len(recipients)}
+
+
+def _schedule_drain(background_tasks: BackgroundTasks):
+    if isinstance(share_queue, InProcessShareQueue):
+        background_tasks.add_task(drain_share_queue)
+
+
+@app.post("/share")
+async def share_file(fileId: str, recipient: str, background_tasks: BackgroundTasks,
+                     claims: dict = Depends(require_auth)):
+    sender_email = claims.get("email", "no-reply@clouddocs.com")
+    job = await enqueue_share(claims["sub"], sender_email, [fileId], [recipient])
+    _schedule_drain(background_tasks)
+    return job
+
+
+@app.post("/share/batch")
+async def share_files(request: ShareRequest, background_tasks: BackgroundTasks,
+                      claims: dict = Depends(require_auth)):
+    """
+    Shares several files with several recipients: one email per recipient
+    listing every file. Returns at once with a job id for /share/jobs.
+    """
+    sender_email = claims.get("email", "no-reply@clouddocs.com")
+    job = await enqueue_share(claims["sub"], sender_email, request.fileIds, request.recipients)
+    _schedule_drain(background_tasks)
+    return job
 
+
+@app.get("/share/jobs/{jobId}")
+async def get_share_job(jobId: str, claims: dict = Depends(require_auth)):
+    item = (await run_aws("dynamodb", table.get_item, Key=_share_job_key(claims["sub"], jobId))).get("Item")
+    if not item:
+        raise HTTPException(status_code=404, detail="Share job not found")
+    total = int(item["total"])
+    sent, failed = len(item.get("sentRecipients", ())), len(item.get("failedRecipients", ()))
+    if sent + failed >= total:
+        status = "completed" if not failed else "completed_with_errors"
+    else:
+        status = "sending" if sent + failed else "queued"
+    return {
+        "jobId": jobId,
+        "status": status,
+        "total": total,
+        "sent": sent,
+        "failed": failed,
+        "failedRecipients": sorted(item.get("failedRecipients", [])),
+    }
+# --- END SHARE PIPELINE ---
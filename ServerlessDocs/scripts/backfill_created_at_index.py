@@ -0,0 +1,150 @@
+"""
+Adds the userId-createdAt-index to an existing CloudDocsFiles table and
+backfills createdAt so every file record is visible to the newest-first
+listing.
+
+CloudDocsFiles is not part of the SAM stack, so --create-index is also
+where the table gets its expiresAt TTL (unconfirmed /upload/batch rows).
+Run it before deploying a stack version that lists from the index.
+
+    python scripts/backfill_created_at_index.py --create-index
+    python scripts/backfill_created_at_index.py --dry-run
+
+Items with no createdAt are left out of the index entirely (GSIs are
+sparse), so they get the upload time of their S3 object. Values that are
+not 10-digit epoch strings are rewritten in that form so the index sorts
+them in time order. Pending /upload/batch rows (uploadStatus set) are left
+alone: they have no createdAt on purpose and get one when confirmed.
+"""
+import argparse
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+TABLE = "CloudDocsFiles"
+BUCKET = "clouddocs-uploads-bucket"
+INDEX = "userId-createdAt-index"
+TTL_ATTRIBUTE = "expiresAt"
+REGION = "ap-south-1"
+
+
+def create_index(client):
+    description = client.describe_table(TableName=TABLE)["Table"]
+    existing = {i["IndexName"] for i in description.get("GlobalSecondaryIndexes", [])}
+    if INDEX in existing:
+        print(f"{INDEX} already exists")
+    else:
+        client.update_table(
+            TableName=TABLE,
+            AttributeDefinitions=[
+                {"AttributeName": "userId", "AttributeType": "S"},
+                {"AttributeName": "createdAt", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexUpdates=[{
+                "Create": {
+                    "IndexName": INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "userId", "KeyType": "HASH"},
+                        {"AttributeName": "createdAt", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {
+                        "ProjectionType": "INCLUDE",
+                        "NonKeyAttributes": ["filename", "tags"],
+                    },
+                }
+            }],
+        )
+        print(f"Creating {INDEX}...")
+
+    while True:
+        indexes = client.describe_table(TableName=TABLE)["Table"].get("GlobalSecondaryIndexes", [])
+        status = next(i["IndexStatus"] for i in indexes if i["IndexName"] == INDEX)
+        if status == "ACTIVE":
+            print(f"{INDEX} is ACTIVE")
+            return
+        time.sleep(10)
+
+
+def enable_ttl(client):
+    ttl = client.describe_time_to_live(TableName=TABLE)["TimeToLiveDescription"]
+    if ttl.get("TimeToLiveStatus") in ("ENABLED", "ENABLING"):
+        print(f"TTL on {ttl.get('AttributeName')} is {ttl['TimeToLiveStatus']}")
+        return
+    client.update_time_to_live(
+        TableName=TABLE,
+        TimeToLiveSpecification={"AttributeName": TTL_ATTRIBUTE, "Enabled": True},
+    )
+    print(f"Enabled TTL on {TTL_ATTRIBUTE}")
+
+
+def normalized_created_at(value):
+    try:
+        return f"{int(value):010d}"
+    except (TypeError, ValueError):
+        return None
+
+
+def object_created_at(s3, item):
+    key = f"{item['userId']}/{item['fileId']}/{item.get('filename', '')}"
+    try:
+        head = s3.head_object(Bucket=BUCKET, Key=key)
+        return f"{int(head['LastModified'].timestamp()):010d}"
+    except ClientError:
+        return f"{int(time.time()):010d}"
+
+
+def backfill(table, s3, dry_run=False):
+    scanned = updated = 0
+    params = {"ProjectionExpression": "userId, fileId, filename, createdAt, uploadStatus"}
+    while True:
+        resp = table.scan(**params)
+        for item in resp.get("Items", []):
+            scanned += 1
+            # Skip index and bookkeeping items that live in the same table
+            if "#" in item["userId"]:
+                continue
+            # Unconfirmed uploads stay out of the listing until confirmed
+            if "uploadStatus" in item:
+                continue
+            current = item.get("createdAt")
+            wanted = normalized_created_at(current) if current is not None else object_created_at(s3, item)
+            if wanted is None:
+                wanted = object_created_at(s3, item)
+            if wanted == current:
+                continue
+            updated += 1
+            print(f"{item['userId']}/{item['fileId']}: createdAt {current!r} -> {wanted!r}")
+            if not dry_run:
+                table.update_item(
+                    Key={"userId": item["userId"], "fileId": item["fileId"]},
+                    UpdateExpression="SET createdAt = :c",
+                    ConditionExpression="attribute_exists(fileId) AND attribute_not_exists(uploadStatus)",
+                    ExpressionAttributeValues={":c": wanted},
+                )
+        if "LastEvaluatedKey" not in resp:
+            break
+        params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    print(f"Scanned {scanned} items, {'would update' if dry_run else 'updated'} {updated}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--create-index", action="store_true",
+                        help=f"create {INDEX} and the {TTL_ATTRIBUTE} TTL if they are missing")
+    parser.add_argument("--dry-run", action="store_true", help="report changes without writing")
+    args = parser.parse_args()
+
+    if args.create_index:
+        client = boto3.client("dynamodb", region_name=REGION)
+        create_index(client)
+        enable_ttl(client)
+    backfill(
+        boto3.resource("dynamodb", region_name=REGION).Table(TABLE),
+        boto3.client("s3", region_name=REGION),
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
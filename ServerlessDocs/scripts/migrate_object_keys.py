@@ -0,0 +1,96 @@
+"""
+Moves objects stored under the legacy {userId}/{fileId}/{filename} key to
+the immutable {userId}/{fileId} key and records it in the row's objectKey.
+Safe to re-run, and safe to run while the API is serving traffic.
+
+    python scripts/migrate_object_keys.py [--dry-run]
+
+Each object is copied first (a managed multipart copy, so objects over
+5 GB work), then the row is switched with a conditional write, and only
+then is the old object deleted. A row renamed in the meantime keeps its
+legacy key pinned by the API and is left alone.
+"""
+import argparse
+
+import boto3
+from botocore.exceptions import ClientError
+
+TABLE = "CloudDocsFiles"
+BUCKET = "clouddocs-uploads-bucket"
+REGION = "ap-south-1"
+
+
+def new_key(item):
+    return f"{item['userId']}/{item['fileId']}"
+
+
+def legacy_key(item):
+    return f"{item['userId']}/{item['fileId']}/{item['filename']}"
+
+
+def migrate_item(table, s3, item, dry_run=False):
+    """Returns "migrated", "missing" (no legacy object) or "skipped"."""
+    old, new = legacy_key(item), new_key(item)
+    try:
+        s3.head_object(Bucket=BUCKET, Key=old)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return "missing"
+        raise
+    if dry_run:
+        return "migrated"
+
+    s3.copy({"Bucket": BUCKET, "Key": old}, BUCKET, new)
+    try:
+        table.update_item(
+            Key={"userId": item["userId"], "fileId": item["fileId"]},
+            UpdateExpression="SET objectKey = :k",
+            ConditionExpression="attribute_not_exists(objectKey) AND filename = :f",
+            ExpressionAttributeValues={":k": new, ":f": item["filename"]},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        # Renamed or deleted since the scan: the row still points at `old`
+        s3.delete_object(Bucket=BUCKET, Key=new)
+        return "skipped"
+    s3.delete_object(Bucket=BUCKET, Key=old)
+    return "migrated"
+
+
+def migrate(table, s3, dry_run=False):
+    counts = {"migrated": 0, "missing": 0, "skipped": 0}
+    params = {
+        "ProjectionExpression": "userId, fileId, filename, objectKey",
+        "FilterExpression": "attribute_not_exists(objectKey) AND attribute_exists(filename)",
+    }
+    while True:
+        resp = table.scan(**params)
+        for item in resp.get("Items", []):
+            # Skip index and bookkeeping items that live in the same table
+            if "#" in item["userId"]:
+                continue
+            outcome = migrate_item(table, s3, item, dry_run=dry_run)
+            counts[outcome] += 1
+            print(f"{legacy_key(item)} -> {new_key(item)}: {outcome}")
+        if "LastEvaluatedKey" not in resp:
+            break
+        params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    verb = "would migrate" if dry_run else "migrated"
+    print(f"{verb} {counts['migrated']}, missing {counts['missing']}, skipped {counts['skipped']}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dry-run", action="store_true", help="report changes without writing")
+    args = parser.parse_args()
+    migrate(
+        boto3.resource("dynamodb", region_name=REGION).Table(TABLE),
+        boto3.client("s3", region_name=REGION),
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Rebuilds the tag index (the {user}#tag#{tag} membership items and the
+{user}#tags counters) from the file records in CloudDocsFiles. Run it once
+for tables that have files from before the index existed; it is safe to
+re-run.
+
+    python scripts/rebuild_tag_index.py [--dry-run]
+
+The index is made to match the records exactly: memberships for files or
+tags that no longer exist are deleted and every counter is rewritten, so
+drifted counts are corrected too. Pending /upload/batch rows are not
+indexed until they are confirmed. Counters are written outright, so run it
+while no tag edits are in flight.
+"""
+import argparse
+import os
+import sys
+from collections import Counter, defaultdict
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hello_world"))
+from app import format_file, is_pending_upload, normalize_tags, tag_counts_partition, tag_partition  # noqa: E402
+
+TABLE = "CloudDocsFiles"
+REGION = "ap-south-1"
+
+
+def rebuild(table, dry_run=False):
+    files = defaultdict(list)
+    existing = defaultdict(set)  # user -> {(partition, fileId)} of current index items
+    params = {"ProjectionExpression": "userId, fileId, filename, createdAt, tags, uploadStatus"}
+    while True:
+        resp = table.scan(**params)
+        for item in resp.get("Items", []):
+            partition = item["userId"]
+            if "#" not in partition:
+                if not is_pending_upload(item):
+                    files[partition].append(item)
+                continue
+            user_id = partition.split("#", 1)[0]
+            if partition == tag_counts_partition(user_id) or partition.startswith(tag_partition(user_id, "")):
+                existing[user_id].add((partition, item["fileId"]))
+        if "LastEvaluatedKey" not in resp:
+            break
+        params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+    for user_id in set(files) | set(existing):
+        items = files.get(user_id, [])
+        counts = Counter()
+        memberships = []
+        for item in items:
+            tags = normalize_tags(item.get("tags"))
+            counts.update(tags)
+            for tag in tags:
+                memberships.append({**format_file(item), "tags": tags, "userId": tag_partition(user_id, tag)})
+        wanted = {(m["userId"], m["fileId"]) for m in memberships}
+        wanted |= {(tag_counts_partition(user_id), tag) for tag in counts}
+        stale = existing.get(user_id, set()) - wanted
+        print(f"{user_id}: {len(items)} files, {len(counts)} tags, {len(memberships)} index items, "
+              f"{len(stale)} stale items")
+        if dry_run:
+            continue
+        with table.batch_writer() as batch:
+            for partition, sort_key in stale:
+                batch.delete_item(Key={"userId": partition, "fileId": sort_key})
+            for membership in memberships:
+                batch.put_item(Item=membership)
+            for tag, count in counts.items():
+                batch.put_item(Item={"userId": tag_counts_partition(user_id), "fileId": tag, "fileCount": count})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dry-run", action="store_true", help="report changes without writing")
+    args = parser.parse_args()
+    rebuild(boto3.resource("dynamodb", region_name=REGION).Table(TABLE), dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
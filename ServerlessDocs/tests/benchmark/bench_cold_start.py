@@ -0,0 +1,121 @@
+"""
+Cold-start cost of the Lambda handler: where import time goes
+(`python -X importtime`) and how long a fresh interpreter takes to import
+the app and answer its first Mangum event.
+
+    python -m tests.benchmark.bench_cold_start [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional
+
+ROOT = Path(__file__).resolve().parents[2]
+
+# Modules the request path only needs on demand
+DEFERRED_MODULES = ("jose", "requests")
+
+FIRST_EVENT = """
+import json, sys, time
+start = time.perf_counter()
+from hello_world import app
+imported = time.perf_counter()
+loaded = [name for name in DEFERRED if name in sys.modules]
+response = app.lambda_handler(json.loads(EVENT), None)
+handled = time.perf_counter()
+print(json.dumps({
+    "importMs": (imported - start) * 1000,
+    "firstEventMs": (handled - start) * 1000,
+    "statusCode": response["statusCode"],
+    "awsClientsBuilt": app._aws_session is not None,
+    "deferredModulesImported": loaded,
+}))
+"""
+
+
+def api_gateway_event(path: str = "/", method: str = "GET", query: Optional[dict] = None,
+                      headers: Optional[dict] = None, body: Optional[str] = None) -> dict:
+    """
+    REST API proxy event. `query` maps names to a value or a list of values.
+    """
+    multi_query = {name: value if isinstance(value, list) else [value]
+                   for name, value in (query or {}).items()} or None
+    return {
+        "resource": "/{proxy+}",
+        "path": path,
+        "httpMethod": method,
+        "headers": {"Host": "example.execute-api.ap-south-1.amazonaws.com", **(headers or {})},
+        "multiValueHeaders": {},
+        "queryStringParameters": {name: values[-1] for name, values in multi_query.items()} if multi_query else None,
+        "multiValueQueryStringParameters": multi_query,
+        "pathParameters": {"proxy": path.lstrip("/")},
+        "stageVariables": None,
+        "requestContext": {
+            "resourcePath": "/{proxy+}",
+            "httpMethod": method,
+            "path": f"/Prod{path}",
+            "stage": "Prod",
+            "requestId": "cold-start-bench",
+            "identity": {"sourceIp": "127.0.0.1"},
+        },
+        "body": body,
+        "isBase64Encoded": False,
+    }
+
+
+def _python(code: str, *flags: str) -> subprocess.CompletedProcess:
+    env = {
+        **os.environ,
+        "AWS_DEFAULT_REGION": "ap-south-1",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+    }
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def import_profile(top: int = 15) -> dict:
+    """
+    Cumulative import time of hello_world.app and the slowest imports by
+    self time, both in milliseconds, from `python -X importtime`.
+    """
+    stderr = _python("import hello_world.app", "-X", "importtime").stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((name, int(self_us) / 1000, int(cumulative_us) / 1000))
+    total = next(cumulative for name, _, cumulative in rows if name == "hello_world.app")
+    slowest = sorted(rows, key=lambda row: row[1], reverse=True)[:top]
+    return {"totalMs": total, "slowest": [(name, self_ms) for name, self_ms, _ in slowest]}
+
+
+def first_event(path: str = "/") -> dict:
+    code = (f"EVENT = {json.dumps(json.dumps(api_gateway_event(path)))}\n"
+            f"DEFERRED = {list(DEFERRED_MODULES)!r}\n{FIRST_EVENT}")
+    return json.loads(_python(code).stdout.strip().splitlines()[-1])
+
+
+def run(runs: int = 5) -> dict:
+    samples = [first_event() for _ in range(runs)]
+    return {
+        "imports": import_profile(),
+        "importMs": statistics.median(s["importMs"] for s in samples),
+        "firstEventMs": statistics.median(s["firstEventMs"] for s in samples),
+        "awsClientsBuilt": any(s["awsClientsBuilt"] for s in samples),
+    }
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    result = run(runs)
+    print(f"import hello_world.app (-X importtime): {result['imports']['totalMs']:8.1f} ms")
+    for name, self_ms in result["imports"]["slowest"]:
+        print(f"  {self_ms:8.1f} ms  {name}")
+    print(f"median import (fresh process):         {result['importMs']:8.1f} ms")
+    print(f"median time to first event:            {result['firstEventMs']:8.1f} ms")
+    print(f"AWS clients built for GET /:           {result['awsClientsBuilt']}")
@@ -0,0 +1,287 @@
+"""
+Offline load test of the HTTP API: throughput and p50/p95/p99 latency per
+endpoint against a seeded dataset, with moto standing in for S3, DynamoDB
+and SES and a FakeBedrock with configurable latency. Tokens are minted
+locally, so nothing leaves the machine.
+
+Requests go through the Mangum `lambda_handler` one at a time, as a Lambda
+container sees them, or with `--concurrency N` through the ASGI app with N
+requests in flight. Results are compared against a stored baseline and the
+run fails (exit 1) when an endpoint regresses past the tolerance.
+
+    python -m tests.benchmark.bench_endpoints [--files 10000] [--users 2]
+        [--requests 200] [--concurrency 1] [--bedrock-latency 0.05]
+        [--baseline tests/benchmark/baseline.json] [--tolerance 0.5]
+        [--update-baseline]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from tests import conftest, tokens
+from tests.benchmark.bench_cold_start import api_gateway_event
+from tests.benchmark.bench_search import TAGS, synthetic_filename
+from tests.fakes import FakeBedrock, FakeSES
+from hello_world import app
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+PERCENTILES = (50, 95, 99)
+REGION = "ap-south-1"
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    # Nearest rank
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Dataset:
+    """The seeded users and their files, for building request parameters."""
+
+    def __init__(self, users: int):
+        self.users = [f"bench-user-{n}" for n in range(users)]
+        self.files = {user: [] for user in self.users}
+        self.auth = {user: {"Authorization": f"Bearer {tokens.mint_token(sub=user)}"} for user in self.users}
+
+
+def seed(dataset: Dataset, files_per_user: int, rng: random.Random):
+    """
+    Writes file records straight to the table together with the tag index
+    items and counts the app maintains, much faster than going through
+    POST /upload for every file.
+    """
+    created = 1_700_000_000
+    for user in dataset.users:
+        tag_counts = {}
+        with app.table.batch_writer() as batch:
+            for n in range(files_per_user):
+                file_id = f"f{n:06d}"
+                item = {
+                    "userId": user,
+                    "fileId": file_id,
+                    "filename": synthetic_filename(rng),
+                    "objectKey": app.object_key(user, file_id),
+                    "createdAt": f"{created + n:010d}",
+                    "tags": rng.sample(TAGS, rng.randint(0, 2)),
+                }
+                batch.put_item(Item=item)
+                for tag in item["tags"]:
+                    batch.put_item(Item={**app.format_file(item), "userId": app.tag_partition(user, tag)})
+                    tag_counts[tag] = tag_counts.get(tag, 0) + 1
+                dataset.files[user].append(item)
+            for tag, count in tag_counts.items():
+                batch.put_item(Item={"userId": app.tag_counts_partition(user), "fileId": tag, "fileCount": count})
+
+
+def tags_response(prompt: str) -> str:
+    return "finance, document, report"
+
+
+# name -> builder(dataset, user, rng) -> (method, path, query, body)
+SCENARIOS = {
+    "GET /": lambda d, user, rng: ("GET", "/", None, None),
+    "GET /files": lambda d, user, rng: ("GET", "/files", {"limit": "100"}, None),
+    "GET /files?tag": lambda d, user, rng: ("GET", "/files", {"tag": rng.choice(TAGS)}, None),
+    "GET /tags": lambda d, user, rng: ("GET", "/tags", None, None),
+    "GET /search": lambda d, user, rng: (
+        "GET", "/search", {"q": rng.choice(d.files[user])["filename"].split("_")[0][:5]}, None),
+    "GET /download": lambda d, user, rng: (
+        "GET", "/download", {"fileId": rng.choice(d.files[user])["fileId"]}, None),
+    "GET /download (batch)": lambda d, user, rng: (
+        "GET", "/download", {"fileId": [f["fileId"] for f in rng.sample(d.files[user], 20)]}, None),
+    "POST /upload": lambda d, user, rng: (
+        "POST", "/upload", {"filename": synthetic_filename(rng), "tags": json.dumps([rng.choice(TAGS)])}, None),
+    "PUT /files/{fileId}/tags": lambda d, user, rng: (
+        "PUT", f"/files/{rng.choice(d.files[user])['fileId']}/tags", None,
+        {"tags": rng.sample(TAGS, 2)}),
+    "PUT /files/{fileId}/rename": lambda d, user, rng: (
+        "PUT", f"/files/{rng.choice(d.files[user])['fileId']}/rename", None,
+        {"new_filename": synthetic_filename(rng)}),
+    "GET /suggest-tags": lambda d, user, rng: (
+        "GET", "/suggest-tags", {"filename": synthetic_filename(rng)}, None),
+    "POST /api/claude": lambda d, user, rng: (
+        "POST", "/api/claude", None, {"messages": [{"role": "user", "content": "Summarise my files"}]}),
+}
+
+
+@contextlib.contextmanager
+def environment(users: int = 2, files_per_user: int = 10_000, bedrock_latency: float = 0.05, seed_value: int = 7):
+    """
+    moto-backed AWS with the app's clients, JWKS and Bedrock replaced for
+    the duration, and the dataset seeded. Yields the Dataset.
+    """
+    import boto3
+    import moto
+
+    patched = ("s3", "ddb", "table", "suggestion_table", "ses", "bedrock_runtime", "jwks_keys", "metrics_sink",
+               "CLAUDE_REQUESTS_PER_MINUTE", "CLAUDE_DAILY_TOKENS")
+    originals = {name: getattr(app, name) for name in patched}
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name=REGION)
+        s3.create_bucket(Bucket=app.BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION})
+        ddb = boto3.resource("dynamodb", region_name=REGION)
+        for client in (s3, ddb.meta.client):
+            app.instrument_client(client)
+        app.s3 = s3
+        app.ddb = ddb
+        app.table = conftest.create_files_table(ddb)
+        app.suggestion_table = conftest.create_suggestion_cache_table(ddb)
+        app.ses = FakeSES()
+        app.bedrock_runtime = FakeBedrock(tags_response, latency=bedrock_latency)
+        app.jwks_keys = app.JWKSKeyManager(app.JWKS_URL, fetcher=lambda url: tokens.jwks())
+        app.metrics_sink = app.InMemoryMetricsSink()
+        # Measure the endpoints, not the per-user limits
+        app.CLAUDE_REQUESTS_PER_MINUTE = app.CLAUDE_DAILY_TOKENS = 10 ** 9
+        for cache in (app.token_cache, app.suggestion_cache, app.presigned_urls, app.search_indexes):
+            cache.clear()
+        try:
+            dataset = Dataset(users)
+            seed(dataset, files_per_user, random.Random(seed_value))
+            yield dataset
+        finally:
+            for name, value in originals.items():
+                setattr(app, name, value)
+
+
+def _requests(dataset: Dataset, scenario: str, count: int, rng: random.Random) -> list:
+    plan = []
+    for _ in range(count):
+        user = rng.choice(dataset.users)
+        method, path, query, body = SCENARIOS[scenario](dataset, user, rng)
+        plan.append((method, path, query, dataset.auth[user], body))
+    return plan
+
+
+def drive_lambda(plan: list) -> list:
+    """[(status, ms)] for each request sent through lambda_handler."""
+    results = []
+    for method, path, query, headers, body in plan:
+        headers = {**headers, "Content-Type": "application/json"} if body is not None else headers
+        event = api_gateway_event(path, method, query, headers, json.dumps(body) if body is not None else None)
+        start = time.perf_counter()
+        response = app.lambda_handler(event, None)
+        results.append((response["statusCode"], (time.perf_counter() - start) * 1000))
+    return results
+
+
+async def drive_asgi(plan: list, concurrency: int) -> list:
+    """[(status, ms)] with up to `concurrency` requests in flight on one event loop."""
+    import httpx
+
+    gate = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def send(method, path, query, headers, body):
+            async with gate:
+                start = time.perf_counter()
+                response = await client.request(method, path, params=query, headers=headers, json=body)
+                return response.status_code, (time.perf_counter() - start) * 1000
+
+        return await asyncio.gather(*(send(*request) for request in plan))
+
+
+def summarize(results: list, wall_seconds: float) -> dict:
+    latencies = sorted(ms for _, ms in results)
+    summary = {
+        "requests": len(results),
+        "errors": sum(1 for status, _ in results if status >= 400),
+        "throughput_rps": round(len(results) / wall_seconds, 1),
+    }
+    for pct in PERCENTILES:
+        summary[f"p{pct}_ms"] = round(percentile(latencies, pct), 2)
+    return summary
+
+
+def run(files: int = 10_000, users: int = 2, requests: int = 200, concurrency: int = 1,
+        bedrock_latency: float = 0.05, scenarios: Optional[list] = None, seed_value: int = 7) -> dict:
+    """{"config": ..., "endpoints": {scenario: summary}}"""
+    rng = random.Random(seed_value)
+    endpoints = {}
+    with environment(users, files, bedrock_latency, seed_value) as dataset:
+        for scenario in scenarios or SCENARIOS:
+            plan = _requests(dataset, scenario, requests, rng)
+            start = time.perf_counter()
+            if concurrency > 1:
+                # Not asyncio.run: it clears the thread's event loop, which
+                # Mangum relies on for later lambda_handler calls
+                loop = asyncio.new_event_loop()
+                try:
+                    results = loop.run_until_complete(drive_asgi(plan, concurrency))
+                finally:
+                    loop.close()
+            else:
+                results = drive_lambda(plan)
+            endpoints[scenario] = summarize(results, time.perf_counter() - start)
+    return {
+        "config": {"files": files, "users": users, "requests": requests, "concurrency": concurrency,
+                   "bedrock_latency": bedrock_latency},
+        "endpoints": endpoints,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float = 0.5) -> list:
+    """
+    Regressions against the baseline, as readable strings: p95 more than
+    `tolerance` above the baseline, throughput more than `tolerance` below
+    it, or any failed requests. Endpoints missing from the baseline are not
+    compared, and a baseline recorded with another config is not comparable.
+    """
+    if baseline.get("config") != result["config"]:
+        return [f"baseline config {baseline.get('config')} differs from {result['config']}"]
+    regressions = []
+    for scenario, current in result["endpoints"].items():
+        previous = baseline["endpoints"].get(scenario)
+        if previous is None:
+            continue
+        if current["errors"]:
+            regressions.append(f"{scenario}: {current['errors']} failed requests")
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {current['p95_ms']:.2f} ms vs {previous['p95_ms']:.2f} ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{scenario}: {current['throughput_rps']:.1f} req/s "
+                               f"vs {previous['throughput_rps']:.1f} req/s")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=10_000, help="files per user")
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--bedrock-latency", type=float, default=0.05, help="seconds per Bedrock call")
+    parser.add_argument("--endpoint", action="append", choices=list(SCENARIOS), help="repeatable; default all")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    result = run(args.files, args.users, args.requests, args.concurrency, args.bedrock_latency, args.endpoint)
+    print(f"{args.files:,} files x {args.users} users, {args.requests} requests per endpoint, "
+          f"concurrency {args.concurrency}")
+    print(f"{'endpoint':30} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for scenario, s in result["endpoints"].items():
+        print(f"{scenario:30} {s['throughput_rps']:8.1f} {s['p50_ms']:8.2f} {s['p95_ms']:8.2f} "
+              f"{s['p99_ms']:8.2f} {s['errors']:6d}")
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}; run with --update-baseline to record one")
+        return 0
+    regressions = compare(result, json.loads(args.baseline.read_text()), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Query latency of the in-memory SearchIndex at a realistic per-user size,
+and what a cold container pays before its first query: rebuilding from the
+user's file records versus loading the saved snapshot.
+
+    python -m tests.benchmark.bench_search [files] [queries]
+
+The rebuild figure covers deserializing the DynamoDB items and indexing
+them, but not the network time of the ~1 MB query pages themselves.
+"""
+import random
+import statistics
+import sys
+import time
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from tests import conftest  # noqa: F401  (AWS env defaults for importing app)
+from hello_world import app
+
+WORDS = (
+    "invoice receipt budget report meeting notes project proposal contract "
+    "photo scan resume presentation spreadsheet draft final review summary "
+    "quarterly annual tax payroll design spec roadmap minutes agenda memo "
+    "letter statement policy plan schedule diagram screenshot backup archive"
+).split()
+TAGS = "finance work personal media legal travel health school".split()
+EXTENSIONS = "pdf docx xlsx pptx jpg png txt zip".split()
+
+
+def synthetic_filename(rng: random.Random) -> str:
+    words = rng.sample(WORDS, rng.randint(2, 4))
+    if rng.random() < 0.5:
+        words.append(str(rng.randint(2015, 2026)))
+    if rng.random() < 0.3:
+        words.append(f"v{rng.randint(1, 9)}")
+    return "_".join(w.capitalize() if rng.random() < 0.5 else w for w in words) + "." + rng.choice(EXTENSIONS)
+
+
+def typo(word: str, rng: random.Random) -> str:
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def run(files: int = 100_000, queries: int = 500, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    serializer, deserializer = TypeSerializer(), TypeDeserializer()
+    records = [{
+        "fileId": serializer.serialize(f"{rng.getrandbits(128):032x}"),
+        "filename": serializer.serialize(synthetic_filename(rng)),
+        "createdAt": serializer.serialize(f"{1_700_000_000 + n:010d}"),
+        "tags": serializer.serialize(rng.sample(TAGS, rng.randint(0, 2))),
+    } for n in range(files)]
+
+    # Cold path 1: rebuild from the file records
+    start = time.perf_counter()
+    index = app.SearchIndex()
+    for record in records:
+        index.add({name: deserializer.deserialize(value) for name, value in record.items()})
+    rebuild_seconds = time.perf_counter() - start
+
+    # Cold path 2: load the snapshot
+    snapshot = index.to_snapshot()
+    start = time.perf_counter()
+    app.SearchIndex.from_snapshot(snapshot, index.version)
+    load_seconds = time.perf_counter() - start
+
+    query_mix = []
+    for _ in range(queries):
+        kind = rng.random()
+        word = rng.choice(WORDS)
+        if kind < 0.4:
+            query_mix.append(word[:rng.randint(2, len(word))])   # prefix
+        elif kind < 0.7:
+            query_mix.append(typo(word, rng))                    # typo
+        else:
+            query_mix.append(f"{word} {rng.choice(WORDS)}")     # multi-term
+
+    latencies = []
+    for query in query_mix:
+        start = time.perf_counter()
+        index.search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "files": files,
+        "rebuild_s": rebuild_seconds,
+        "snapshot_load_s": load_seconds,
+        "snapshot_bytes": len(snapshot),
+        "snapshot_chunks": -(-len(snapshot) // app.SEARCH_SNAPSHOT_CHUNK_BYTES),
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+if __name__ == "__main__":
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    result = run(files, queries)
+    print(f"{result['files']:,} files")
+    print(f"cold: rebuild {result['rebuild_s']:.2f}s   snapshot load {result['snapshot_load_s']:.2f}s "
+          f"({result['snapshot_bytes'] / 1e6:.1f} MB in {result['snapshot_chunks']} items)")
+    print(f"warm: p50 {result['p50_ms']:.2f} ms   p99 {result['p99_ms']:.2f} ms")
@@ -0,0 +1,32 @@
+"""
+Micro-benchmark of verify_token throughput with the verified-token cache
+off and on.
+
+    python -m tests.benchmark.bench_verify_token [iterations]
+"""
+import sys
+import time
+
+from tests import conftest  # noqa: F401  (AWS env defaults for importing app)
+from hello_world import app
+from tests import tokens
+
+
+def run(iterations: int = 2000) -> dict:
+    app.jwks_keys = app.JWKSKeyManager(app.JWKS_URL, fetcher=lambda url: tokens.jwks())
+    token = tokens.mint_token()
+    results = {}
+    for label, cache in (("cache off", None), ("cache on", app.ExpiringLRUCache(app.TOKEN_CACHE_SIZE))):
+        app.verify_token(token, cache=cache)  # warm the key manager
+        start = time.perf_counter()
+        for _ in range(iterations):
+            app.verify_token(token, cache=cache)
+        elapsed = time.perf_counter() - start
+        results[label] = iterations / elapsed
+    return results
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for label, per_second in run(iterations).items():
+        print(f"{label:>10}: {per_second:12,.0f} verifications/s")
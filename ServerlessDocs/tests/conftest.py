@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+# The app builds its AWS clients against these; nothing in the unit tests
+# talks to a real AWS endpoint.
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-south-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+def create_files_table(ddb):
+    return ddb.create_table(
+        TableName="CloudDocsFiles",
+        KeySchema=[
+            {"AttributeName": "userId", "KeyType": "HASH"},
+            {"AttributeName": "fileId", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "userId", "AttributeType": "S"},
+            {"AttributeName": "fileId", "AttributeType": "S"},
+            {"AttributeName": "createdAt", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "userId-createdAt-index",
+                "KeySchema": [
+                    {"AttributeName": "userId", "KeyType": "HASH"},
+                    {"AttributeName": "createdAt", "KeyType": "RANGE"},
+                ],
+                "Projection": {
+                    "ProjectionType": "INCLUDE",
+                    "NonKeyAttributes": ["filename", "tags"],
+                },
+            },
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+def create_suggestion_cache_table(ddb):
+    return ddb.create_table(
+        TableName="CloudDocsSuggestionCache",
+        KeySchema=[{"AttributeName": "cacheKey", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "cacheKey", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+@pytest.fixture()
+def aws(monkeypatch):
+    """
+    moto-backed S3/DynamoDB/SES with the app's clients pointed at them.
+    """
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    from hello_world import app
+
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="ap-south-1")
+        s3.create_bucket(
+            Bucket=app.BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "ap-south-1"},
+        )
+        ddb = boto3.resource("dynamodb", region_name="ap-south-1")
+        table = create_files_table(ddb)
+        suggestion_table = create_suggestion_cache_table(ddb)
+        ses = boto3.client("ses", region_name="ap-south-1")
+        for client in (s3, ddb.meta.client, ses):
+            app.instrument_client(client)
+
+        monkeypatch.setattr(app, "s3", s3)
+        monkeypatch.setattr(app, "ddb", ddb)
+        monkeypatch.setattr(app, "table", table)
+        monkeypatch.setattr(app, "suggestion_table", suggestion_table)
+        monkeypatch.setattr(app, "ses", ses)
+        monkeypatch.setattr(app, "metrics_sink", app.InMemoryMetricsSink())
+        app.suggestion_cache.clear()
+        app.presigned_urls.clear()
+        app.bedrock_breaker.reset()
+        yield app
+        app.suggestion_cache.clear()
+        app.presigned_urls.clear()
+        app.bedrock_breaker.reset()
@@ -0,0 +1,102 @@
+"""
+Stand-ins for AWS clients that moto does not cover.
+"""
+import io
+import json
+import threading
+import time
+
+
+class FakeBedrock:
+    """
+    bedrock-runtime stand-in. `responder(prompt) -> str` produces the text
+    of each completion; every call is recorded in `calls`.
+    """
+
+    def __init__(self, responder=None, latency: float = 0.0):
+        self.responder = responder or (lambda prompt: "")
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _complete(self, modelId, body):
+        request = json.loads(body)
+        with self._lock:
+            self.calls.append({"modelId": modelId, "body": request})
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = request["messages"][-1]["content"]
+        if isinstance(prompt, list):
+            prompt = "".join(block.get("text", "") for block in prompt)
+        return prompt, self.responder(prompt)
+
+    def invoke_model(self, modelId, body, **kwargs):
+        prompt, text = self._complete(modelId, body)
+        payload = {
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4},
+        }
+        return {"body": io.BytesIO(json.dumps(payload).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        prompt, text = self._complete(modelId, body)
+        words = text.split(" ")
+        events = [{"type": "message_start", "message": {"usage": {"input_tokens": len(prompt) // 4}}},
+                  {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}]
+        for i, word in enumerate(words):
+            delta = word if i == len(words) - 1 else word + " "
+            events.append({"type": "content_block_delta", "index": 0,
+                           "delta": {"type": "text_delta", "text": delta}})
+        events += [{"type": "content_block_stop", "index": 0},
+                   {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                    "usage": {"output_tokens": len(text) // 4}},
+                   {"type": "message_stop"}]
+        return {"body": FakeEventStream({"chunk": {"bytes": json.dumps(e).encode()}} for e in events)}
+
+
+class FakeEventStream:
+    """botocore EventStream stand-in: an iterator that records close()."""
+
+    def __init__(self, events):
+        self._events = iter(events)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        return next(self._events)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSES:
+    """
+    SES stand-in for the bulk templated API. `statuses(recipients)` returns
+    one status per destination (default: all "Success"); every call is
+    recorded in `calls`.
+    """
+
+    def __init__(self, statuses=None):
+        self.statuses = statuses or (lambda recipients: ["Success"] * len(recipients))
+        self.templates = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def create_template(self, Template):
+        from botocore.exceptions import ClientError
+
+        if Template["TemplateName"] in self.templates:
+            raise ClientError({"Error": {"Code": "AlreadyExists", "Message": "exists"}}, "CreateTemplate")
+        self.templates[Template["TemplateName"]] = Template
+
+    def send_bulk_templated_email(self, Source, Template, DefaultTemplateData, Destinations, **kwargs):
+        recipients = [d["Destination"]["ToAddresses"][0] for d in Destinations]
+        with self._lock:
+            self.calls.append({"source": Source, "template": Template,
+                               "data": json.loads(DefaultTemplateData), "recipients": recipients})
+        return {"Status": [{"Status": status} for status in self.statuses(recipients)]}
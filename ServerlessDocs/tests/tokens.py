@@ -0,0 +1,32 @@
+"""
+Locally minted RS256 tokens and a matching JWKS document, so tests and
+benchmarks can exercise verify_token without reaching Cognito.
+"""
+import time
+from functools import lru_cache
+
+import rsa
+from jose import jwk, jwt
+
+KID = "test-key-1"
+
+
+@lru_cache(maxsize=None)
+def private_key_pem(kid: str = KID) -> str:
+    _, private_key = rsa.newkeys(1024)
+    return private_key.save_pkcs1().decode()
+
+
+def jwks(*kids: str) -> dict:
+    keys = []
+    for kid in kids or (KID,):
+        public = jwk.construct(private_key_pem(kid), "RS256").public_key().to_dict()
+        public.update({"kid": kid, "use": "sig"})
+        keys.append(public)
+    return {"keys": keys}
+
+
+def mint_token(sub: str = "user-1", kid: str = KID, expires_in: int = 3600, **claims) -> str:
+    payload = {"sub": sub, "exp": int(time.time()) + expires_in, "token_use": "id"}
+    payload.update(claims)
+    return jwt.encode(payload, private_key_pem(kid), algorithm="RS256", headers={"kid": kid})
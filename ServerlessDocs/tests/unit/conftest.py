@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from hello_world import app
+from tests import tokens
+from tests.fakes import FakeBedrock
+
+
+@pytest.fixture()
+def client(aws, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(app, "jwks_keys",
+                        app.JWKSKeyManager(app.JWKS_URL, fetcher=lambda url: tokens.jwks()))
+    app.token_cache.clear()
+    return TestClient(app.app)
+
+
+@pytest.fixture()
+def headers():
+    return {"Authorization": f"Bearer {tokens.mint_token(sub='user-1')}"}
+
+
+@pytest.fixture()
+def upload(client, headers):
+    """
+    upload(filename, tags=(), body=None, sub="user-1") -> fileId through
+    POST /upload. With a body, the object is stored in S3 too.
+    """
+    def upload(filename, tags=(), body=None, sub="user-1"):
+        auth = headers if sub == "user-1" else {"Authorization": f"Bearer {tokens.mint_token(sub=sub)}"}
+        resp = client.post("/upload", params={"filename": filename, "tags": json.dumps(list(tags))},
+                           headers=auth)
+        assert resp.status_code == 200
+        file_id = resp.json()["fileId"]
+        if body is not None:
+            app.s3.put_object(Bucket=app.BUCKET, Key=app.object_key(sub, file_id), Body=body)
+        return file_id
+    return upload
+
+
+@pytest.fixture()
+def bedrock(monkeypatch):
+    """
+    FakeBedrock installed as the app's bedrock-runtime client. Tests set
+    `bedrock.responder` for the completions they need.
+    """
+    fake = FakeBedrock()
+    monkeypatch.setattr(app, "bedrock_runtime", fake)
+    app.suggestion_cache_stats.clear()
+    return fake
@@ -0,0 +1,165 @@
+import pytest
+from fastapi import HTTPException
+
+from hello_world import app
+from tests import tokens
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def empty_token_cache():
+    app.token_cache.clear()
+    yield
+    app.token_cache.clear()
+
+
+@pytest.fixture()
+def fetches():
+    return []
+
+
+@pytest.fixture()
+def key_manager(fetches, monkeypatch):
+    clock = FakeClock()
+
+    def fetcher(url):
+        fetches.append(url)
+        return tokens.jwks(*manager.kids)
+
+    manager = app.JWKSKeyManager("https://example.test/jwks.json", fetcher=fetcher,
+                                 ttl=60, min_refresh_interval=10, clock=clock)
+    manager.kids = [tokens.KID]
+    manager.fake_clock = clock
+    monkeypatch.setattr(app, "jwks_keys", manager)
+    return manager
+
+
+def test_jwks_is_not_fetched_until_first_use(key_manager, fetches):
+    assert fetches == []
+    key_manager.get_key(tokens.KID)
+    key_manager.get_key(tokens.KID)
+    assert len(fetches) == 1
+
+
+def test_jwks_refreshes_after_ttl(key_manager, fetches):
+    key_manager.get_key(tokens.KID)
+    key_manager.fake_clock.now += 61
+    key_manager.get_key(tokens.KID)
+    assert len(fetches) == 2
+
+
+def test_unknown_kid_triggers_one_refetch(key_manager, fetches):
+    key_manager.get_key(tokens.KID)
+    key_manager.kids = [tokens.KID, "rotated"]
+    key_manager.fake_clock.now += 11
+    assert key_manager.get_key("rotated") is not None
+    assert len(fetches) == 2
+
+
+def test_unknown_kid_refetch_is_rate_limited(key_manager, fetches):
+    key_manager.get_key(tokens.KID)
+    with pytest.raises(KeyError):
+        key_manager.get_key("bogus")
+    assert len(fetches) == 1
+
+
+def test_stale_keys_are_kept_when_refresh_fails(key_manager, fetches):
+    key_manager.get_key(tokens.KID)
+
+    def broken(url):
+        raise ConnectionError("cognito unreachable")
+
+    key_manager.fetcher = broken
+    key_manager.fake_clock.now += 61
+    assert key_manager.get_key(tokens.KID) is not None
+
+
+def test_verify_token_accepts_valid_token(key_manager):
+    claims = app.verify_token(tokens.mint_token(sub="abc"))
+    assert claims["sub"] == "abc"
+
+
+def test_verify_token_rejects_expired_token(key_manager):
+    with pytest.raises(HTTPException) as exc:
+        app.verify_token(tokens.mint_token(expires_in=-10))
+    assert exc.value.status_code == 401
+
+
+def test_verify_token_rejects_forged_signature(key_manager):
+    header, payload, _ = tokens.mint_token().split(".")
+    _, _, other_sig = tokens.mint_token(kid="other").split(".")
+    with pytest.raises(HTTPException) as exc:
+        app.verify_token(f"{header}.{payload}.{other_sig}")
+    assert exc.value.status_code == 401
+
+
+def test_verify_token_caches_verified_claims(key_manager, monkeypatch):
+    token = tokens.mint_token(sub="cached")
+    app.verify_token(token)
+
+    def fail(kid):
+        raise AssertionError("signature should not be re-verified")
+
+    monkeypatch.setattr(key_manager, "get_key", fail)
+    assert app.verify_token(token)["sub"] == "cached"
+
+
+def test_forged_token_does_not_hit_cache(key_manager):
+    token = tokens.mint_token()
+    app.verify_token(token)
+    header, payload, _ = token.split(".")
+    _, _, other_sig = tokens.mint_token(kid="other").split(".")
+    with pytest.raises(HTTPException):
+        app.verify_token(f"{header}.{payload}.{other_sig}")
+
+
+def test_token_cache_evicts_at_expiry():
+    clock = FakeClock()
+    cache = app.ExpiringLRUCache(maxsize=2, clock=clock)
+    cache.set("a", {"sub": "a"}, clock.now + 5)
+    assert cache.get("a") == {"sub": "a"}
+    clock.now += 5
+    assert cache.get("a") is None
+
+
+def test_token_cache_is_bounded():
+    clock = FakeClock()
+    cache = app.ExpiringLRUCache(maxsize=2, clock=clock)
+    for key in "abc":
+        cache.set(key, key, clock.now + 60)
+    assert cache.get("a") is None
+    assert len(cache) == 2
+
+
+@pytest.fixture()
+def client(key_manager, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    async def fake_suggestion(kind, filename, compute):
+        return ["doc"]
+
+    monkeypatch.setattr(app, "cached_suggestion", fake_suggestion)
+    return TestClient(app.app)
+
+
+@pytest.mark.parametrize("header", [None, "Bearer", "Basic abc", "Bearer a b"])
+def test_malformed_authorization_header_is_401(client, header):
+    headers = {"Authorization": header} if header is not None else {}
+    resp = client.get("/suggest-tags", params={"filename": "a.pdf"}, headers=headers)
+    assert resp.status_code == 401
+
+
+def test_auth_dependency_reports_auth_timing(client):
+    token = tokens.mint_token()
+    resp = client.get("/suggest-tags", params={"filename": "a.pdf"},
+                      headers={"Authorization": f"Bearer {token}"})
+    assert resp.status_code == 200
+    assert resp.json() == {"tags": ["doc"]}
+    assert resp.headers["Server-Timing"].startswith("auth;dur=")
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+from hello_world import app
+
+
+def run(coro):
+    # A private loop, so the loop Mangum uses in other tests is left alone
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_backend_semaphore_bounds_concurrency(monkeypatch):
+    monkeypatch.setitem(app.BACKEND_CONCURRENCY, "bedrock", 2)
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def slow_call():
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+
+    async def main():
+        await asyncio.gather(*(app.run_aws("bedrock", slow_call) for _ in range(6)))
+
+    run(main())
+    assert state["peak"] == 2
+
+
+def test_fast_backend_is_not_blocked_by_slow_backend(monkeypatch):
+    monkeypatch.setitem(app.BACKEND_CONCURRENCY, "bedrock", 1)
+    finished = []
+
+    def bedrock_call():
+        time.sleep(0.2)
+        finished.append("bedrock")
+
+    def dynamodb_call():
+        finished.append("dynamodb")
+
+    async def main():
+        await asyncio.gather(
+            app.run_aws("bedrock", bedrock_call),
+            app.run_aws("bedrock", bedrock_call),
+            app.run_aws("dynamodb", dynamodb_call),
+        )
+
+    run(main())
+    assert finished[0] == "dynamodb"
+
+
+def test_cancelled_call_keeps_its_slot_until_the_thread_returns(monkeypatch):
+    monkeypatch.setitem(app.BACKEND_CONCURRENCY, "bedrock", 1)
+    released = threading.Event()
+    order = []
+
+    def stuck_call():
+        released.wait(5)
+        order.append("stuck")
+
+    def next_call():
+        order.append("next")
+
+    async def main():
+        stuck = asyncio.ensure_future(app.run_aws("bedrock", stuck_call))
+        await asyncio.sleep(0.05)
+        stuck.cancel()
+        following = asyncio.ensure_future(app.run_aws("bedrock", next_call))
+        await asyncio.sleep(0.1)
+        assert order == []  # still queued behind the abandoned call
+        released.set()
+        await following
+
+    run(main())
+    assert order == ["stuck", "next"]
+
+
+def test_cancelled_stream_keeps_its_slot_until_the_read_returns(monkeypatch):
+    monkeypatch.setitem(app.BACKEND_CONCURRENCY, "bedrock", 1)
+    released = threading.Event()
+    order = []
+
+    def events():
+        yield "first"
+        released.wait(5)
+        order.append("stuck read")
+        yield "second"
+
+    async def consume():
+        async for _ in app.iterate_aws("bedrock", events()):
+            pass
+
+    async def main():
+        stream = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.05)
+        stream.cancel()
+        following = asyncio.ensure_future(app.run_aws("bedrock", order.append, "next"))
+        await asyncio.sleep(0.1)
+        assert order == []  # still queued behind the abandoned read
+        released.set()
+        await following
+
+    run(main())
+    assert order == ["stuck read", "next"]
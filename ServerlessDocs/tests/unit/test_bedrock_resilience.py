@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from hello_world import app
+
+
+@pytest.fixture(autouse=True)
+def no_hedging(monkeypatch):
+    # A hedge still running after its test could touch the next test's breaker
+    monkeypatch.setattr(app, "SUGGESTION_HEDGE_AFTER", 30)
+
+
+class Gate:
+    """Holds Bedrock calls until released, and tracks how many finished."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.released = threading.Event()
+        self.finished = 0
+        self.held = 0
+
+    def hold(self, prompt):
+        self.held += 1
+        self.released.wait(5)
+        self.finished += 1
+        return self.answer
+
+    def drain(self):
+        """Lets held calls finish before the test ends."""
+        self.released.set()
+        deadline = time.monotonic() + 5
+        while self.finished < self.held and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)  # for the breaker bookkeeping after the call
+
+
+def failing(prompt):
+    raise RuntimeError("ServiceUnavailable")
+
+
+def suggest_tags(client, headers, filename="Invoice_2025_Jan.pdf"):
+    return client.get("/suggest-tags", params={"filename": filename}, headers=headers).json()["tags"]
+
+
+def test_breaker_opens_and_suggestions_fall_back_locally(client, headers, bedrock):
+    bedrock.responder = failing
+    for _ in range(app.BEDROCK_BREAKER_FAILURES):
+        assert suggest_tags(client, headers) == ["finance", "invoice", "document"]
+    assert app.bedrock_breaker.state == "open"
+
+    calls = len(bedrock.calls)
+    assert suggest_tags(client, headers) == ["finance", "invoice", "document"]
+    assert len(bedrock.calls) == calls  # short-circuited
+    assert app.suggestion_cache_stats["fallback"] >= app.BEDROCK_BREAKER_FAILURES + 1
+
+
+def test_breaker_probes_after_cooldown_and_closes(client, headers, monkeypatch, bedrock):
+    bedrock.responder = failing
+    for _ in range(app.BEDROCK_BREAKER_FAILURES):
+        suggest_tags(client, headers)
+    opened_at = app.bedrock_breaker.opened_at
+    monkeypatch.setattr(app.bedrock_breaker, "clock", lambda: opened_at + app.BEDROCK_BREAKER_COOLDOWN)
+    assert app.bedrock_breaker.state == "half-open"
+
+    bedrock.responder = lambda prompt: "photo, media"
+    assert suggest_tags(client, headers, "IMG_1.jpg") == ["photo", "media"]
+    assert app.bedrock_breaker.state == "closed"
+
+
+def test_caller_errors_do_not_trip_the_breaker():
+    app.bedrock_breaker.reset()
+    error = app.ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "InvokeModel")
+
+    def invalid(**kwargs):
+        raise error
+
+    for _ in range(app.BEDROCK_BREAKER_FAILURES + 1):
+        with pytest.raises(app.ClientError):
+            app._call_bedrock(invalid)
+    assert app.bedrock_breaker.state == "closed"
+
+
+def test_caller_error_on_the_probe_lets_the_next_call_probe(monkeypatch):
+    app.bedrock_breaker.reset()
+    for _ in range(app.BEDROCK_BREAKER_FAILURES):
+        with pytest.raises(RuntimeError):
+            app._call_bedrock(lambda: failing(""))
+    opened_at = app.bedrock_breaker.opened_at
+    monkeypatch.setattr(app.bedrock_breaker, "clock", lambda: opened_at + app.BEDROCK_BREAKER_COOLDOWN)
+
+    def invalid():
+        raise app.ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "InvokeModel")
+
+    with pytest.raises(app.ClientError):
+        app._call_bedrock(invalid)
+    assert app.bedrock_breaker.state == "half-open"
+    assert app._call_bedrock(lambda: "ok") == "ok"
+    assert app.bedrock_breaker.state == "closed"
+
+
+def test_slow_call_is_hedged(client, headers, monkeypatch, bedrock):
+    gate = Gate("finance, tax")
+
+    def slow_once(prompt):
+        return gate.hold(prompt) if gate.held == 0 else "finance, tax"
+
+    bedrock.responder = slow_once
+    monkeypatch.setattr(app, "SUGGESTION_HEDGE_AFTER", 0.05)
+    try:
+        assert suggest_tags(client, headers, "Tax_2024.pdf") == ["finance", "tax"]
+        assert len(bedrock.calls) == 2
+        assert gate.finished == 0  # answered by the hedge
+    finally:
+        gate.drain()
+
+
+def test_latency_budget_falls_back_without_caching(client, headers, monkeypatch, bedrock):
+    gate = Gate("model_answer.pdf")
+    bedrock.responder = gate.hold
+    monkeypatch.setattr(app, "SUGGESTION_LATENCY_BUDGET", 0.05)
+    try:
+        name = client.get("/suggest-name", params={"filename": "Scan 2024-03-01 (1).PDF"}, headers=headers).json()
+        assert name == {"suggested_name": "scan.pdf"}
+        assert app.bedrock_breaker.failures == 1
+        assert app.suggestion_cache.get(app.suggestion_cache_key("name", "Scan 2024-03-01 (1).PDF")) is None
+    finally:
+        gate.drain()
+
+
+def test_time_queued_for_a_slot_is_not_a_bedrock_failure(monkeypatch):
+    monkeypatch.setitem(app.BACKEND_CONCURRENCY, "bedrock", 1)
+    app.bedrock_breaker.reset()
+
+    async def main():
+        busy = asyncio.ensure_future(app.run_aws("bedrock", time.sleep, 0.2))
+        await asyncio.sleep(0.01)
+        # Waits 0.2s for the slot, then answers well within its budget
+        answer = await app.run_bedrock_hedged(lambda: "ok", budget=0.1)
+        await busy
+        return answer
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(main()) == "ok"
+    finally:
+        loop.close()
+    assert app.bedrock_breaker.failures == 0
+
+
+def test_claude_fails_fast_while_breaker_is_open(client, headers, bedrock):
+    bedrock.responder = lambda prompt: "hi"
+    for _ in range(app.BEDROCK_BREAKER_FAILURES):
+        app.bedrock_breaker.record_failure()
+    response = client.post("/api/claude", headers=headers, json={"messages": [{"role": "user", "content": "hi"}]})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(app.BEDROCK_BREAKER_COOLDOWN)
+    assert bedrock.calls == []
+
+
+def test_bedrock_client_has_timeouts_and_adaptive_retries():
+    config = app._client_config("bedrock", app.BEDROCK_CLIENT_CONFIG)
+    assert config.retries["mode"] == "adaptive"
+    # Every attempt plus a second of backoff fits in API Gateway's 29s
+    attempts = config.retries["total_max_attempts"]
+    assert attempts * (config.connect_timeout + config.read_timeout) + (attempts - 1) < 29
+    assert config.max_pool_connections == app.BACKEND_CONCURRENCY["bedrock"]
+
+
+@pytest.mark.parametrize("filename, name, tags", [
+    ("IMG_8821_v2 (copy).jpg", "img_8821.jpg", ["photo", "media"]),
+    ("2025-01-20_Invoice-CLIENT.pdf", "invoice_client.pdf", ["finance", "invoice", "document"]),
+    ("screenshot 2025-11-12 at 11.30.45 AM.png", "screenshot.png", ["screenshot", "image"]),
+    ("Meeting_Notes_Nov.txt", "meeting_notes_nov.txt", ["meeting", "notes", "document"]),
+    ("v2", "v2", ["document"]),
+])
+def test_rule_based_fallbacks(filename, name, tags):
+    assert app.normalize_filename(filename) == name
+    assert app.rule_based_tags(filename) == tags
@@ -0,0 +1,46 @@
+from tests.benchmark import bench_endpoints
+
+
+def test_every_endpoint_answers_against_a_small_dataset():
+    result = bench_endpoints.run(files=50, users=2, requests=3, bedrock_latency=0)
+    assert set(result["endpoints"]) == set(bench_endpoints.SCENARIOS)
+    for scenario, summary in result["endpoints"].items():
+        assert summary["errors"] == 0, scenario
+        assert summary["p50_ms"] <= summary["p95_ms"] <= summary["p99_ms"]
+
+
+def test_concurrent_driver():
+    result = bench_endpoints.run(files=20, users=1, requests=4, concurrency=4, bedrock_latency=0,
+                                 scenarios=["GET /download", "POST /upload"])
+    assert all(s["errors"] == 0 for s in result["endpoints"].values())
+
+
+def summary(p95_ms, throughput_rps, errors=0):
+    return {"requests": 10, "errors": errors, "throughput_rps": throughput_rps,
+            "p50_ms": p95_ms, "p95_ms": p95_ms, "p99_ms": p95_ms}
+
+
+def test_compare_flags_regressions_past_tolerance():
+    config = {"files": 10}
+    baseline = {"config": config, "endpoints": {"GET /a": summary(10, 100), "GET /b": summary(10, 100)}}
+    result = {"config": config, "endpoints": {
+        "GET /a": summary(14, 80),            # within 50%
+        "GET /b": summary(16, 40, errors=1),
+        "GET /new": summary(1000, 1),         # not in the baseline
+    }}
+    regressions = bench_endpoints.compare(result, baseline, tolerance=0.5)
+    assert len(regressions) == 3
+    assert all(line.startswith("GET /b") for line in regressions)
+
+
+def test_compare_rejects_baseline_from_other_config():
+    baseline = {"config": {"files": 10}, "endpoints": {}}
+    result = {"config": {"files": 20}, "endpoints": {}}
+    assert bench_endpoints.compare(result, baseline)
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert bench_endpoints.percentile(values, 50) == 50
+    assert bench_endpoints.percentile(values, 99) == 99
+    assert bench_endpoints.percentile([7], 95) == 7
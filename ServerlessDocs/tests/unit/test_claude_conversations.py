@@ -0,0 +1,159 @@
+import asyncio
+
+from hello_world import app
+from tests.unit.test_claude_stream import read_events
+
+CACHING_MODEL = "anthropic.claude-3-5-haiku-20241022-v1:0"
+
+
+def responder(prompt):
+    if "running summary" in prompt:
+        return "The user introduced themselves as Sam."
+    return f"echo: {prompt}"
+
+
+def start(client, headers, system="Be brief."):
+    return client.post("/api/claude/conversations", json={"system": system}, headers=headers).json()["conversationId"]
+
+
+def say(client, headers, conversation_id, text, **extra):
+    return client.post("/api/claude", headers=headers, json={
+        "conversationId": conversation_id,
+        "messages": [{"role": "user", "content": text}],
+        **extra,
+    })
+
+
+def test_history_is_kept_server_side(client, headers, bedrock):
+    bedrock.responder = responder
+    conversation_id = start(client, headers)
+
+    first = say(client, headers, conversation_id, "I am Sam")
+    assert first.json()["conversationId"] == conversation_id
+    say(client, headers, conversation_id, "What is my name?")
+
+    sent = bedrock.calls[-1]["body"]
+    assert sent["system"] == "Be brief."
+    assert [m["role"] for m in sent["messages"]] == ["user", "assistant", "user"]
+    assert sent["messages"][1]["content"] == [{"type": "text", "text": "echo: I am Sam"}]
+    assert "cache_control" not in str(sent)  # the default model has no prompt caching
+
+    stored = client.get(f"/api/claude/conversations/{conversation_id}", headers=headers).json()
+    assert stored["turnCount"] == 4
+    assert stored["messages"][-1]["content"][0]["text"] == "echo: What is my name?"
+
+
+def test_stable_prefix_is_marked_for_prompt_caching(client, headers, bedrock):
+    bedrock.responder = responder
+    conversation_id = start(client, headers)
+    say(client, headers, conversation_id, "one", model=CACHING_MODEL)
+    say(client, headers, conversation_id, "two", model=CACHING_MODEL)
+
+    sent = bedrock.calls[-1]["body"]
+    assert sent["system"] == [{"type": "text", "text": "Be brief.", "cache_control": {"type": "ephemeral"}}]
+    assert sent["messages"][1]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in sent["messages"][2]["content"][-1]  # the new turn
+
+
+def test_overflowing_history_is_summarized(client, headers, monkeypatch, bedrock):
+    bedrock.responder = responder
+    monkeypatch.setattr(app, "CONVERSATION_HISTORY_TOKENS", 30)
+    conversation_id = start(client, headers)
+    say(client, headers, conversation_id, "I am Sam " + "and I like long messages " * 3)
+    say(client, headers, conversation_id, "Hello again")
+
+    stored = client.get(f"/api/claude/conversations/{conversation_id}", headers=headers).json()
+    assert stored["summary"] == "The user introduced themselves as Sam."
+    assert stored["messages"][0] == {"role": "user", "content": "Hello again"}
+
+    say(client, headers, conversation_id, "Who am I?")
+    sent = bedrock.calls[-1]["body"]
+    assert "introduced themselves as Sam" in sent["system"]
+
+
+def test_summaries_count_against_the_quota(client, headers, monkeypatch, bedrock):
+    bedrock.responder = responder
+    monkeypatch.setattr(app, "CONVERSATION_HISTORY_TOKENS", 30)
+    conversation_id = start(client, headers)
+    say(client, headers, conversation_id, "I am Sam " + "and I like long messages " * 3)
+    say(client, headers, conversation_id, "Hello again")
+
+    usage = client.get("/api/claude/usage", headers=headers).json()
+    assert usage["requests"] == 2
+    assert usage["completions"] == len(bedrock.calls) == 3
+
+
+def test_fit_history_starts_with_a_user_turn():
+    turns = [{"role": "user", "content": "a" * 40}, {"role": "assistant", "content": "b" * 40},
+             {"role": "user", "content": "c"}, {"role": "assistant", "content": "d"}]
+    kept, dropped = app.fit_history(turns, budget=15)
+    assert kept == turns[2:]
+    assert dropped == turns[:2]
+
+
+def test_streamed_turn_is_saved(client, headers, bedrock):
+    bedrock.responder = lambda prompt: "streamed reply"
+    conversation_id = start(client, headers)
+    events = read_events(say(client, headers, conversation_id, "hi", stream=True))
+    assert events[-1][0] == "metrics"
+
+    stored = client.get(f"/api/claude/conversations/{conversation_id}", headers=headers).json()
+    assert stored["messages"][-1] == {"role": "assistant", "content": [{"type": "text", "text": "streamed reply"}]}
+
+
+def test_concurrent_turn_is_rejected(client, headers, monkeypatch):
+    conversation_id = start(client, headers)
+    user_id = "user-1"
+    loop = asyncio.new_event_loop()
+    try:
+        stale = loop.run_until_complete(app.load_conversation(user_id, conversation_id))
+        turn = [{"role": "user", "content": "x"}, {"role": "assistant", "content": "y"}]
+        assert loop.run_until_complete(app.save_conversation_turns(user_id, stale, turn))
+        assert not loop.run_until_complete(app.save_conversation_turns(user_id, stale, turn))
+    finally:
+        loop.close()
+
+
+def test_unknown_conversation_and_bad_turns(client, headers, bedrock):
+    bedrock.responder = responder
+    assert say(client, headers, "missing", "hi").status_code == 404
+    conversation_id = start(client, headers)
+    response = client.post("/api/claude", headers=headers, json={
+        "conversationId": conversation_id, "messages": [{"role": "assistant", "content": "hi"}]})
+    assert response.status_code == 400
+
+
+def test_requests_per_minute_limit(client, headers, monkeypatch, bedrock):
+    bedrock.responder = responder
+    monkeypatch.setattr(app, "CLAUDE_REQUESTS_PER_MINUTE", 2)
+    body = {"messages": [{"role": "user", "content": "hi"}]}
+    statuses = [client.post("/api/claude", headers=headers, json=body).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+
+def test_daily_token_quota_and_usage(client, headers, monkeypatch, bedrock):
+    bedrock.responder = responder
+    monkeypatch.setattr(app, "CLAUDE_DAILY_TOKENS", 50)
+    body = {"messages": [{"role": "user", "content": "word " * 50}]}
+    assert client.post("/api/claude", headers=headers, json=body).status_code == 200
+    response = client.post("/api/claude", headers=headers, json=body)
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+    usage = client.get("/api/claude/usage", headers=headers).json()
+    assert usage["completions"] == 1
+    assert usage["requests"] == 1  # the rejected request is not counted
+    assert usage["tokens"] == usage["inputTokens"] + usage["outputTokens"] >= 50
+
+    [document] = [d for d in app.metrics_sink.documents if "InputTokens" in d]
+    assert document["UserId"] == "user-1"
+    assert document["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Model"]]
+
+
+def test_cache_tokens_are_accounted(client, headers):
+    app.record_claude_usage("user-1", None, CACHING_MODEL,
+                            {"input_tokens": 10, "output_tokens": 5, "cache_read_input_tokens": 900,
+                             "cache_creation_input_tokens": 100}, 120.4)
+    usage = client.get("/api/claude/usage", headers=headers).json()
+    assert (usage["cacheReadTokens"], usage["cacheWriteTokens"], usage["tokens"]) == (900, 100, 15)
+    assert usage["modelMs"] == 120
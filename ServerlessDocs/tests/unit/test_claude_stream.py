@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+
+from hello_world import app
+
+
+@pytest.fixture()
+def bedrock(bedrock):
+    bedrock.responder = lambda prompt: "Hello there from Claude"
+    return bedrock
+
+
+def read_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = "message", None
+        for line in block.splitlines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        events.append((event, data))
+    return events
+
+
+def test_stream_forwards_deltas_and_reports_ttft(client, headers, bedrock):
+    response = client.post("/api/claude", headers=headers, json={
+        "messages": [{"role": "user", "content": "hi"}],
+        "stream": True,
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = read_events(response)
+    text = "".join(data["delta"]["text"] for event, data in events
+                   if event == "message" and data["type"] == "content_block_delta")
+    assert text == "Hello there from Claude"
+    assert events[-2][1]["type"] == "message_stop"
+    event, metrics = events[-1]
+    assert event == "metrics"
+    assert metrics["timeToFirstTokenMs"] is not None
+    assert metrics["timeToFirstTokenMs"] <= metrics["totalMs"]
+
+
+def test_non_streaming_mode_is_unchanged(client, headers, bedrock):
+    body = client.post("/api/claude", headers=headers, json={
+        "messages": [{"role": "user", "content": "hi"}],
+    }).json()
+    assert body["content"][0]["text"] == "Hello there from Claude"
+
+
+def test_stream_error_is_reported_in_band(client, headers, bedrock):
+    def broken(prompt):
+        raise RuntimeError("throttled")
+
+    bedrock.responder = broken
+    response = client.post("/api/claude", headers=headers, json={
+        "messages": [{"role": "user", "content": "hi"}],
+        "stream": True,
+    })
+    event, data = read_events(response)[-1]
+    assert event == "error"
+    assert "throttled" in data["error"]
+
+
+def test_client_disconnect_closes_bedrock_stream(bedrock, monkeypatch):
+    streams = []
+    invoke = bedrock.invoke_model_with_response_stream
+
+    def recording_invoke(**kwargs):
+        response = invoke(**kwargs)
+        streams.append(response["body"])
+        return response
+
+    monkeypatch.setattr(bedrock, "invoke_model_with_response_stream", recording_invoke)
+
+    class GoneAfterFirstEvent:
+        checks = 0
+
+        async def is_disconnected(self):
+            self.checks += 1
+            return self.checks > 1
+
+    recorded, completed = [], []
+
+    async def on_usage(usage, ms):
+        recorded.append(dict(usage))
+
+    async def on_complete(text, usage, ms):
+        completed.append(text)
+
+    async def main():
+        body = {"messages": [{"role": "user", "content": "tell me a long story"}]}
+        return [e async for e in app.stream_claude_events(body, "model", GoneAfterFirstEvent(),
+                                                          on_complete=on_complete, on_usage=on_usage)]
+
+    loop = asyncio.new_event_loop()
+    try:
+        events = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert len(events) == 1
+    assert streams[0].closed
+    # The tokens used before the disconnect are still recorded
+    assert completed == []
+    assert len(recorded) == 1 and recorded[0]["input_tokens"] > 0
@@ -0,0 +1,18 @@
+from tests.benchmark import bench_cold_start
+
+# Generous: catches an eager client or a JWKS fetch, not interpreter noise
+FIRST_EVENT_BUDGET_MS = 3000
+
+
+def test_first_event_builds_no_aws_clients():
+    result = bench_cold_start.first_event("/")
+    assert result["statusCode"] == 200
+    assert not result["awsClientsBuilt"]
+    assert result["deferredModulesImported"] == []
+    assert result["firstEventMs"] < FIRST_EVENT_BUDGET_MS
+
+
+def test_import_profile_reports_app_import():
+    profile = bench_cold_start.import_profile(top=5)
+    assert profile["totalMs"] > 0
+    assert len(profile["slowest"]) == 5
@@ -0,0 +1,61 @@
+from hello_world import app
+
+
+def put_object(user_id, file_id):
+    app.s3.put_object(Bucket=app.BUCKET, Key=app.object_key(user_id, file_id), Body=b"x")
+
+
+def test_delete_batch_reports_each_file(client, headers, upload):
+    mine = [upload(f"doc-{i}.pdf", ["finance"]) for i in range(3)]
+    for file_id in mine:
+        put_object("user-1", file_id)
+    theirs = upload("secret.pdf", sub="user-2")
+
+    body = client.post("/files/delete-batch", json={"fileIds": mine + ["missing", theirs]},
+                       headers=headers).json()
+    statuses = {r["fileId"]: r["status"] for r in body["results"]}
+    assert [statuses[f] for f in mine] == ["deleted"] * 3
+    assert statuses["missing"] == "not_found"
+    assert statuses[theirs] == "not_found"
+
+    assert app.s3.list_objects_v2(Bucket=app.BUCKET, Prefix="user-1/").get("KeyCount") == 0
+    assert client.get("/files", headers=headers).json()["files"] == []
+    assert client.get("/tags", headers=headers).json()["tags"] == []
+    # The other user's record is untouched
+    assert app.table.get_item(Key={"userId": "user-2", "fileId": theirs}).get("Item")
+
+
+def test_delete_batch_chunks_write_requests(client, headers, monkeypatch, upload):
+    monkeypatch.setattr(app, "DDB_BATCH_WRITE_SIZE", 2)
+    monkeypatch.setattr(app, "DDB_BATCH_GET_SIZE", 3)
+    monkeypatch.setattr(app, "S3_DELETE_OBJECTS_SIZE", 4)
+    file_ids = [upload(f"f{i}.txt") for i in range(7)]
+    body = client.post("/files/delete-batch", json={"fileIds": file_ids}, headers=headers).json()
+    assert {r["status"] for r in body["results"]} == {"deleted"}
+    assert [r["fileId"] for r in body["results"]] == file_ids
+
+
+def test_unprocessed_items_are_retried(monkeypatch):
+    calls = []
+
+    class FlakyDdb:
+        def batch_write_item(self, RequestItems):
+            calls.append(RequestItems)
+            if len(calls) == 1:
+                return {"UnprocessedItems": {app.table.name: RequestItems[app.table.name][:1]}}
+            return {"UnprocessedItems": {}}
+
+    class Table:
+        name = "CloudDocsFiles"
+
+    monkeypatch.setattr(app, "ddb", FlakyDdb())
+    monkeypatch.setattr(app, "table", Table())
+    monkeypatch.setattr(app, "BATCH_RETRY_BASE_DELAY", 0)
+    assert app.batch_delete_file_items("user-1", ["a", "b"]) == []
+    assert len(calls[1][app.table.name]) == 1
+
+
+def test_delete_batch_size_is_limited(client, headers):
+    resp = client.post("/files/delete-batch", json={"fileIds": [str(i) for i in range(1001)]},
+                       headers=headers)
+    assert resp.status_code == 400
@@ -0,0 +1,71 @@
+from urllib.parse import parse_qs, urlparse
+
+from hello_world import app
+from tests import tokens
+
+
+def auth(sub="user-1"):
+    return {"Authorization": f"Bearer {tokens.mint_token(sub=sub)}"}
+
+
+class CountingTable:
+    def __init__(self, table):
+        self.table = table
+        self.reads = 0
+
+    def get_item(self, **kwargs):
+        self.reads += 1
+        return self.table.get_item(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+def test_repeated_download_reuses_url(client, monkeypatch, upload):
+    file_id = upload("a.pdf")
+    counting = CountingTable(app.table)
+    monkeypatch.setattr(app, "table", counting)
+
+    first = client.get("/download", params={"fileId": file_id}, headers=auth()).json()["downloadUrl"]
+    second = client.get("/download", params={"fileId": file_id}, headers=auth()).json()["downloadUrl"]
+    assert first == second
+    assert counting.reads == 1
+
+
+def test_url_is_resigned_after_half_its_lifetime(client, monkeypatch, upload):
+    file_id = upload("a.pdf")
+    client.get("/download", params={"fileId": file_id}, headers=auth())
+    entry = app.presigned_urls.get(f"user-1|{file_id}|{app.DOWNLOAD_URL_EXPIRY}")
+    assert entry is not None
+
+    now = app.time.time()
+    monkeypatch.setattr(app.presigned_urls, "clock", lambda: now + app.DOWNLOAD_URL_EXPIRY / 2 + 1)
+    assert app.presigned_urls.get(f"user-1|{file_id}|{app.DOWNLOAD_URL_EXPIRY}") is None
+
+
+def test_rename_drops_cached_url(client, upload):
+    file_id = upload("a.pdf")
+    before = client.get("/download", params={"fileId": file_id}, headers=auth()).json()["downloadUrl"]
+    client.put(f"/files/{file_id}/rename", json={"new_filename": "b.pdf"}, headers=auth())
+    after = client.get("/download", params={"fileId": file_id}, headers=auth()).json()["downloadUrl"]
+    disposition = parse_qs(urlparse(after).query)["response-content-disposition"][0]
+    assert before != after
+    assert 'filename="b.pdf"' in disposition
+
+
+def test_batch_download_resolves_many_files(client, upload):
+    mine = [upload(f"thumb-{i}.jpg") for i in range(5)]
+    theirs = upload("secret.jpg", sub="user-2")
+    # one id already cached
+    client.get("/download", params={"fileId": mine[0]}, headers=auth())
+
+    params = [("fileId", f) for f in mine + [theirs]]
+    downloads = client.get("/download", params=params, headers=auth()).json()["downloads"]
+    assert [d["fileId"] for d in downloads] == mine + [theirs]
+    assert all("downloadUrl" in d for d in downloads[:5])
+    assert downloads[5] == {"fileId": theirs, "error": "File not found"}
+
+
+def test_single_download_of_missing_file_is_404(client):
+    resp = client.get("/download", params={"fileId": "nope"}, headers=auth())
+    assert resp.status_code == 404
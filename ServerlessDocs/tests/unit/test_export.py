@@ -0,0 +1,87 @@
+import io
+import zipfile
+
+import pytest
+
+from hello_world import app
+from tests import tokens
+
+
+@pytest.fixture()
+def small_ranges(monkeypatch):
+    # Exercise multi-range reads and multi-part uploads on tiny objects
+    monkeypatch.setattr(app, "EXPORT_RANGE_SIZE", 7)
+    monkeypatch.setattr(app, "EXPORT_PREFETCH_RANGES", 3)
+
+
+def test_stream_export_contains_every_file(client, headers, small_ranges, upload):
+    contents = {"a.txt": b"alpha" * 10, "b.txt": b"", "c.bin": bytes(range(256))}
+    ids = [upload(name, body=body) for name, body in contents.items()]
+    ids.append(upload("a.txt", body=b"second"))
+
+    resp = client.post("/export", json={"fileIds": ids, "destination": "stream"}, headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(resp.content))
+    assert archive.namelist() == ["a.txt", "b.txt", "c.bin", "a (1).txt"]
+    for name, body in contents.items():
+        assert archive.read(name) == body
+    assert archive.read("a (1).txt") == b"second"
+
+
+def test_export_by_tag_to_s3(client, headers, monkeypatch, upload):
+    # Two parts: S3's 5 MiB minimum, then the remainder
+    monkeypatch.setattr(app, "EXPORT_PART_SIZE", 5 * 1024 * 1024)
+    monkeypatch.setattr(app, "EXPORT_RANGE_SIZE", 1024 * 1024)
+    big = bytes(6 * 1024 * 1024)
+    upload("big.bin", ["trip"], big)
+    upload("note.txt", ["trip"], b"hi")
+    upload("other.txt", ["work"], b"no")
+
+    body = client.post("/export", json={"tag": "trip"}, headers=headers).json()
+    assert body["status"] == "queued" and body["files"] == 2
+    # The test client runs the background build before returning
+    job = client.get(f"/export/{body['exportId']}", headers=headers).json()
+    assert job["status"] == "completed"
+    assert f"exports/user-1/{body['exportId']}.zip" in job["downloadUrl"]
+    key = f"exports/user-1/{body['exportId']}.zip"
+    data = app.s3.get_object(Bucket=app.BUCKET, Key=key)["Body"].read()
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert sorted(archive.namelist()) == ["big.bin", "note.txt"]
+    assert archive.read("big.bin") == big
+
+
+def test_queued_export_is_built_by_the_worker(client, headers, monkeypatch, upload):
+    queue_url = app.sqs.create_queue(QueueName="exports")["QueueUrl"]
+    monkeypatch.setattr(app, "EXPORT_QUEUE_URL", queue_url)
+    kept = upload("kept.txt", body=b"kept")
+    gone = upload("gone.txt", body=b"gone")
+
+    body = client.post("/export", json={"fileIds": [kept, gone]}, headers=headers).json()
+    assert client.get(f"/export/{body['exportId']}", headers=headers).json()["status"] == "queued"
+    assert client.delete("/delete", params={"fileId": gone}, headers=headers).status_code == 200
+
+    messages = app.sqs.receive_message(QueueUrl=queue_url)["Messages"]
+    records = [{"eventSource": "aws:sqs", "eventSourceARN": "arn:aws:sqs:ap-south-1:123456789012:exports",
+                "messageId": m["MessageId"], "body": m["Body"]} for m in messages]
+    assert app.lambda_handler({"Records": records}, None) == {"batchItemFailures": []}
+
+    job = client.get(f"/export/{body['exportId']}", headers=headers).json()
+    assert job["status"] == "completed" and job["files"] == 1
+    data = app.s3.get_object(Bucket=app.BUCKET, Key=f"exports/user-1/{body['exportId']}.zip")["Body"].read()
+    assert zipfile.ZipFile(io.BytesIO(data)).namelist() == ["kept.txt"]
+
+
+def test_export_job_is_private(client, headers, upload):
+    body = client.post("/export", json={"fileIds": [upload("a.txt", body=b"a")]}, headers=headers).json()
+    other = {"Authorization": f"Bearer {tokens.mint_token(sub='user-2')}"}
+    assert client.get(f"/export/{body['exportId']}", headers=other).status_code == 404
+
+
+def test_export_needs_files(client, headers):
+    assert client.post("/export", json={}, headers=headers).status_code == 400
+    assert client.post("/export", json={"fileIds": ["nope"]}, headers=headers).status_code == 404
+
+
+def test_archive_names_are_unique():
+    assert app.archive_names(["a.pdf", "A.pdf", "README", "README"]) == ["a.pdf", "A (1).pdf", "README", "README (1)"]
@@ -0,0 +1,146 @@
+from hello_world import app
+
+
+def tag_counts(client, headers):
+    return {t["tag"]: t["count"] for t in client.get("/tags", headers=headers).json()["tags"]}
+
+
+def tagged(client, headers, tag):
+    return [f["filename"] for f in client.get("/files", params={"tag": tag}, headers=headers).json()["files"]]
+
+
+class CountingTable:
+    def __init__(self, table):
+        self.table = table
+        self.reads = 0
+
+    def get_item(self, **kwargs):
+        self.reads += 1
+        return self.table.get_item(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+def test_tag_update_is_one_write_without_a_read(client, headers, monkeypatch, upload):
+    file_id = upload("a.pdf", ["finance"])
+    counting = CountingTable(app.table)
+    monkeypatch.setattr(app, "table", counting)
+
+    first = client.put(f"/files/{file_id}/tags", json={"tags": ["Tax"]}, headers=headers).json()
+    second = client.put(f"/files/{file_id}/tags", json={"tags": ["tax", "2024"]}, headers=headers).json()
+    assert (first["version"], second["version"]) == (1, 2)
+    assert counting.reads == 0
+    assert tag_counts(client, headers) == {"tax": 1, "2024": 1}
+
+
+def test_stale_version_is_rejected(client, headers, upload):
+    file_id = upload("a.pdf")
+    assert client.put(f"/files/{file_id}/rename", json={"new_filename": "b.pdf", "version": 0},
+                      headers=headers).status_code == 200
+
+    stale = client.put(f"/files/{file_id}/tags", json={"tags": ["x"], "version": 0}, headers=headers)
+    assert stale.status_code == 409
+    assert stale.json()["detail"] == "File was changed by another request (now at version 1)"
+    item = app.table.get_item(Key={"userId": "user-1", "fileId": file_id})["Item"]
+    assert item["tags"] == [] and item["filename"] == "b.pdf"
+
+
+def test_unchanged_write_keeps_the_version(client, headers, monkeypatch, upload):
+    file_id = upload("a.pdf", ["tax"])
+    synced = []
+    monkeypatch.setattr(app, "sync_file_indexes", lambda *args: synced.append(args))
+
+    same_tags = client.put(f"/files/{file_id}/tags", json={"tags": ["Tax"], "version": 0}, headers=headers)
+    same_name = client.put(f"/files/{file_id}/rename", json={"new_filename": "a.pdf", "version": 0},
+                           headers=headers)
+    assert (same_tags.status_code, same_name.status_code) == (200, 200)
+    assert same_tags.json()["version"] == same_name.json()["version"] == 0
+    assert synced == []
+    # A client still holding version 0 isn't told the file changed
+    assert client.put(f"/files/{file_id}/tags", json={"tags": ["2024"], "version": 0},
+                      headers=headers).json()["version"] == 1
+
+
+def test_missing_file_is_404(client, headers):
+    assert client.put("/files/nope/tags", json={"tags": ["x"]}, headers=headers).status_code == 404
+    assert client.patch("/files/nope", json={"tags": ["x"]}, headers=headers).status_code == 404
+    assert app.table.get_item(Key={"userId": "user-1", "fileId": "nope"}).get("Item") is None
+
+
+def test_patch_renames_and_retags_in_one_transaction(client, headers, aws, monkeypatch, upload):
+    file_id = upload("draft.pdf", ["finance", "draft"])
+    upload("other.pdf", ["finance"])
+    client.get("/search", params={"q": "draft"}, headers=headers)  # warm the search index
+
+    transactions = []
+    transact = aws.ddb.meta.client.transact_write_items
+
+    def spy(**kwargs):
+        transactions.append(kwargs["TransactItems"])
+        return transact(**kwargs)
+
+    monkeypatch.setattr(aws.ddb.meta.client, "transact_write_items", spy)
+    resp = client.patch(f"/files/{file_id}", json={"filename": "contract.pdf", "tags": ["finance", "legal"]},
+                        headers=headers)
+    assert resp.status_code == 200
+    assert resp.json()["filename"] == "contract.pdf"
+    assert resp.json()["version"] == 1
+    assert len(transactions) == 1
+
+    assert tag_counts(client, headers) == {"finance": 2, "legal": 1}
+    assert tagged(client, headers, "legal") == ["contract.pdf"]
+    assert sorted(tagged(client, headers, "finance")) == ["contract.pdf", "other.pdf"]
+    assert tagged(client, headers, "draft") == []
+    hits = client.get("/search", params={"q": "contract"}, headers=headers).json()["results"]
+    assert [h["filename"] for h in hits] == ["contract.pdf"]
+
+
+def test_patch_retries_a_transaction_conflict(client, headers, aws, monkeypatch, upload):
+    file_id = upload("draft.pdf", ["draft"])
+    transact = aws.ddb.meta.client.transact_write_items
+    attempts = []
+
+    def busy_once(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            raise app.ClientError({
+                "Error": {"Code": "TransactionCanceledException", "Message": "busy"},
+                "CancellationReasons": [{"Code": "None"}, {"Code": "TransactionConflict"}],
+            }, "TransactWriteItems")
+        return transact(**kwargs)
+
+    monkeypatch.setattr(aws.ddb.meta.client, "transact_write_items", busy_once)
+    resp = client.patch(f"/files/{file_id}", json={"tags": ["legal"]}, headers=headers)
+    assert resp.status_code == 200
+    assert len(attempts) == 2
+    assert tag_counts(client, headers) == {"legal": 1}
+
+
+def test_patch_without_tags_is_a_plain_update(client, headers, aws, monkeypatch, upload):
+    file_id = upload("a.pdf")
+    monkeypatch.setattr(aws.ddb.meta.client, "transact_write_items",
+                        lambda **kwargs: (_ for _ in ()).throw(AssertionError("no transaction expected")))
+    resp = client.patch(f"/files/{file_id}", json={"filename": "b.pdf"}, headers=headers)
+    assert resp.json()["filename"] == "b.pdf"
+
+    unchanged = client.patch(f"/files/{file_id}", json={"filename": "b.pdf"}, headers=headers).json()
+    assert unchanged["version"] == 1
+
+
+def test_patch_with_stale_version_is_rejected(client, headers, upload):
+    file_id = upload("a.pdf", ["x"])
+    client.patch(f"/files/{file_id}", json={"tags": ["y"]}, headers=headers)
+    resp = client.patch(f"/files/{file_id}", json={"filename": "c.pdf", "version": 0}, headers=headers)
+    assert resp.status_code == 409
+    assert client.patch(f"/files/{file_id}", json={"filename": ""}, headers=headers).status_code == 400
+
+
+def test_patch_pins_legacy_key(client, headers):
+    app.table.put_item(Item={"userId": "user-1", "fileId": "old", "filename": "a.pdf",
+                             "createdAt": "1700000000", "tags": ["work"]})
+    client.patch("/files/old", json={"filename": "b.pdf"}, headers=headers)
+    item = app.table.get_item(Key={"userId": "user-1", "fileId": "old"})["Item"]
+    assert item["filename"] == "b.pdf"
+    assert item["objectKey"] == "user-1/old/a.pdf"
+    assert item["version"] == 1
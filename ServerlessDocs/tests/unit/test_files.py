@@ -0,0 +1,105 @@
+import json
+
+from hello_world import app
+from tests import tokens
+
+
+def auth(sub="user-1"):
+    return {"Authorization": f"Bearer {tokens.mint_token(sub=sub)}"}
+
+
+def put_files(user_id, count, start=1_700_000_000):
+    with app.table.batch_writer() as batch:
+        for i in range(count):
+            batch.put_item(Item={
+                "userId": user_id,
+                "fileId": f"file-{i:05d}",
+                "filename": f"doc-{i}.pdf",
+                "createdAt": str(start + i),
+                "tags": ["t"],
+                "notListed": "x" * 100,
+            })
+
+
+def test_files_are_paginated_with_opaque_cursor(client):
+    put_files("user-1", 25)
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 10}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/files", params=params, headers=auth()).json()
+        pages += 1
+        assert len(body["files"]) <= 10
+        seen.extend(f["fileId"] for f in body["files"])
+        cursor = body["nextCursor"]
+        if not cursor:
+            break
+    assert sorted(seen) == [f"file-{i:05d}" for i in range(25)]
+    assert pages >= 3
+
+
+def test_files_are_listed_newest_first_across_pages(client):
+    put_files("user-1", 15)
+    first = client.get("/files", params={"limit": 10}, headers=auth()).json()
+    second = client.get("/files", params={"limit": 10, "cursor": first["nextCursor"]},
+                        headers=auth()).json()
+    created = [f["createdAt"] for f in first["files"] + second["files"]]
+    assert created == sorted(created, reverse=True)
+    assert len(created) == 15
+
+
+def test_files_only_returns_projected_fields(client):
+    put_files("user-1", 1)
+    body = client.get("/files", headers=auth()).json()
+    assert set(body["files"][0]) == {"fileId", "filename", "createdAt", "tags"}
+
+
+def test_cursor_for_another_user_is_rejected(client):
+    put_files("user-2", 3)
+    cursor = client.get("/files", params={"limit": 1}, headers=auth("user-2")).json()["nextCursor"]
+    resp = client.get("/files", params={"cursor": cursor}, headers=auth("user-1"))
+    assert resp.status_code == 400
+
+
+def test_garbage_cursor_is_rejected(client):
+    resp = client.get("/files", params={"cursor": "not-a-cursor!"}, headers=auth())
+    assert resp.status_code == 400
+
+
+def test_files_stream_returns_ndjson(client):
+    put_files("user-1", 12)
+    resp = client.get("/files/stream", headers=auth())
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(rows) == 12
+
+
+def test_rename_only_writes_metadata(client, aws):
+    file_id = client.post("/upload", params={"filename": "draft.pdf"}, headers=auth()).json()["fileId"]
+    aws.s3.put_object(Bucket=app.BUCKET, Key=app.object_key("user-1", file_id), Body=b"x")
+
+    resp = client.put(f"/files/{file_id}/rename", json={"new_filename": "Résumé final.pdf"}, headers=auth())
+    assert resp.status_code == 200
+    keys = [o["Key"] for o in aws.s3.list_objects_v2(Bucket=app.BUCKET)["Contents"]]
+    assert keys == [f"user-1/{file_id}"]
+
+    url = client.get("/download", params={"fileId": file_id}, headers=auth()).json()["downloadUrl"]
+    assert "response-content-disposition=" in url
+    assert "R%25C3%25A9sum%25C3%25A9%2520final.pdf" in url
+
+
+def test_legacy_key_is_pinned_on_rename(client):
+    app.table.put_item(Item={"userId": "user-1", "fileId": "old", "filename": "a.pdf",
+                             "createdAt": "1700000000", "tags": []})
+    client.put("/files/old/rename", json={"new_filename": "b.pdf"}, headers=auth())
+    item = app.table.get_item(Key={"userId": "user-1", "fileId": "old"})["Item"]
+    assert item["filename"] == "b.pdf"
+    assert item["objectKey"] == "user-1/old/a.pdf"
+
+
+def test_rename_missing_file_is_404(client):
+    resp = client.put("/files/nope/rename", json={"new_filename": "b.pdf"}, headers=auth())
+    assert resp.status_code == 404
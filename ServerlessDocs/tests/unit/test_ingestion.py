@@ -0,0 +1,132 @@
+import io
+import json
+import zipfile
+import zlib
+
+import pytest
+
+from hello_world import app
+
+
+def make_docx(text):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", "<Types/>")
+        docx.writestr("word/document.xml",
+                      f'<w:document><w:body><w:p><w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+                      "<w:p><w:r><w:t>Second paragraph</w:t></w:r></w:p></w:body></w:document>")
+        docx.writestr("word/media/image1.png", b"\x89PNG" + bytes(100_000))
+    return buffer.getvalue()
+
+
+def make_pdf(text):
+    content = zlib.compress(f"BT /F1 12 Tf ({text}) Tj ET BT [(Tot) -20 (al\\051)] TJ ET".encode())
+    header = f"%PDF-1.4\n1 0 obj << /Length {len(content)} /Filter /FlateDecode >>\nstream\n"
+    return header.encode() + content + b"\nendstream\nendobj\n%%EOF"
+
+
+def test_docx_text_from_a_truncated_prefix():
+    data = make_docx("Quarterly invoice for Acme Corp")
+    text = app.extract_text("scan001.docx", "", data[:len(data) // 2])
+    assert "Quarterly invoice for Acme Corp" in text
+    assert "Second paragraph" in text
+
+
+def test_pdf_text_from_content_streams():
+    text = app.extract_text("scan001.pdf", "application/pdf", make_pdf("Invoice \\(copy\\) for Acme"))
+    assert "Invoice (copy) for Acme" in text
+    assert "Total)" in text
+
+
+def test_unknown_binary_gives_no_text():
+    assert app.extract_text("photo.jpg", "image/jpeg", b"\xff\xd8\xff" + bytes(100)) == ""
+
+
+@pytest.fixture()
+def bedrock(bedrock):
+    answer = json.dumps({"tags": ["Invoice", "finance"], "summary": "An invoice for Acme Corp."})
+    bedrock.responder = lambda prompt: answer if "Acme" in prompt else "no idea"
+    return bedrock
+
+
+def object_created(key):
+    return {"source": "aws.s3", "detail-type": "Object Created",
+            "detail": {"bucket": {"name": app.BUCKET}, "object": {"key": key}}}
+
+
+def test_object_event_tags_file_from_content(client, headers, bedrock, upload):
+    text = "Invoice number 42 issued to Acme Corp for consulting services. " * 20
+    file_id = upload("scan001.txt", ["mine"], text.encode())
+    key = app.object_key("user-1", file_id)
+
+    assert app.lambda_handler(object_created(key), None)["ingested"] == 1
+    item = app.table.get_item(Key={"userId": "user-1", "fileId": file_id})["Item"]
+    assert item["tags"] == ["mine", "invoice", "finance"]
+    assert item["summary"] == "An invoice for Acme Corp."
+    tags = client.get("/tags", headers=headers).json()["tags"]
+    assert {t["tag"] for t in tags} == {"mine", "invoice", "finance"}
+
+    # Redelivery of the same event neither calls Bedrock nor rewrites
+    assert app.handle_s3_event(object_created(key))["ingested"] == 0
+    assert len(bedrock.calls) == 1
+
+
+def test_files_without_text_are_left_alone(bedrock, upload):
+    file_id = upload("photo.jpg", body=b"\xff\xd8\xff" + bytes(1000))
+    assert app.handle_s3_event(object_created(app.object_key("user-1", file_id)))["ingested"] == 0
+    assert bedrock.calls == []
+
+
+def bedrock_error(code):
+    return app.ClientError({"Error": {"Code": code, "Message": code}}, "InvokeModel")
+
+
+def test_retryable_failures_propagate_for_redelivery(bedrock, upload):
+    text = "Invoice number 42 issued to Acme Corp for consulting services. " * 20
+    key = app.object_key("user-1", upload("scan001.txt", body=text.encode()))
+    answer = bedrock.responder
+
+    def throttled(prompt):
+        raise bedrock_error("ThrottlingException")
+    bedrock.responder = throttled
+    with pytest.raises(app.ClientError):
+        app.lambda_handler(object_created(key), None)
+
+    # The redelivered event tags the file
+    bedrock.responder = answer
+    app.bedrock_breaker.reset()
+    assert app.lambda_handler(object_created(key), None)["ingested"] == 1
+
+
+def test_permanent_failures_are_not_retried(bedrock, upload, monkeypatch):
+    text = "Invoice number 42 issued to Acme Corp for consulting services. " * 20
+    key = app.object_key("user-1", upload("scan001.txt", body=text.encode()))
+
+    def rejected(prompt):
+        raise bedrock_error("ValidationException")
+    bedrock.responder = rejected
+    assert app.handle_s3_event(object_created(key)) == {"confirmed": 0, "ingested": 0}
+
+    def unreadable(filename, content_type, data):
+        raise ValueError("bad stream")
+    monkeypatch.setattr(app, "extract_text", unreadable)
+    assert app.handle_s3_event(object_created(key)) == {"confirmed": 0, "ingested": 0}
+
+
+def test_row_confirmed_by_the_same_event_is_read_consistently(bedrock, upload, monkeypatch):
+    text = "Invoice number 42 issued to Acme Corp for consulting services. " * 20
+    key = app.object_key("user-1", upload("scan001.txt", body=text.encode()))
+    reads = []
+    table = app.table
+
+    class RecordingTable:
+        def get_item(self, **kwargs):
+            reads.append(kwargs.get("ConsistentRead", False))
+            return table.get_item(**kwargs)
+
+        def __getattr__(self, name):
+            return getattr(table, name)
+
+    monkeypatch.setattr(app, "table", RecordingTable())
+    assert app.ingest_object(key)
+    assert reads and all(reads)
@@ -0,0 +1,94 @@
+import pytest
+from botocore.exceptions import ReadTimeoutError
+from botocore.stub import Stubber
+
+from hello_world import app
+
+
+def request_documents(sink):
+    return [d for d in sink.documents if "Latency" in d]
+
+
+def service_documents(sink, route):
+    return {d["Service"]: d for d in sink.documents if "Service" in d and d["Route"] == route}
+
+
+def test_request_emits_emf_document(client, headers):
+    client.post("/upload", params={"filename": "a.pdf"}, headers=headers)
+    [doc] = request_documents(app.metrics_sink)
+
+    assert doc["Route"] == "POST /upload"
+    assert doc["StatusCode"] == 200
+    assert doc["AuthMs"] >= 0
+    assert doc["AwsCalls"] >= 1
+    directive = doc["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "CloudDocs"
+    assert directive["Dimensions"] == [["Route"]]
+    assert {m["Name"] for m in directive["Metrics"]} == {
+        "Latency", "AwsCalls", "AwsMs", "AwsRetries", "AwsThrottles"}
+
+
+def test_aws_calls_are_broken_down_by_service(client, headers):
+    file_id = client.post("/upload", params={"filename": "a.pdf"}, headers=headers).json()["fileId"]
+    app.metrics_sink.documents.clear()
+
+    response = client.get("/download", params={"fileId": file_id}, headers=headers)
+    services = service_documents(app.metrics_sink, "GET /download")
+    assert services["dynamodb"]["Calls"] == 1
+    assert services["dynamodb"]["Errors"] == 0
+    assert "aws;dur=" in response.headers["Server-Timing"]
+
+
+def test_unmatched_route_is_labelled(client):
+    client.get("/no-such-route")
+    [doc] = request_documents(app.metrics_sink)
+    assert doc["Route"] == "GET unmatched"
+    assert doc["StatusCode"] == 404
+
+
+def test_throttled_call_is_counted(aws):
+    client = app.instrument_client(app.boto3.client("sqs", region_name="ap-south-1"))
+    metrics = app.RequestMetrics()
+    token = app.current_metrics.set(metrics)
+    try:
+        with Stubber(client) as stub:
+            stub.add_client_error("get_queue_url", service_error_code="ThrottlingException",
+                                  http_status_code=400)
+            try:
+                client.get_queue_url(QueueName="q")
+            except app.ClientError:
+                pass
+    finally:
+        app.current_metrics.reset(token)
+
+    stats = metrics.aws["sqs"]
+    assert stats["calls"] == 1
+    assert stats["errors"] == 1
+    assert stats["throttles"] == 1
+
+
+def test_lambda_events_are_tracked(aws):
+    app.lambda_handler({"Records": [{"eventSource": "aws:sqs", "messageId": "m", "body": "{}"}]}, None)
+    [doc] = request_documents(app.metrics_sink)
+    assert doc["Route"] == "event:sqs"
+
+
+def test_connection_errors_are_counted(aws):
+    client = app.instrument_client(app.boto3.client(
+        "sqs", region_name="ap-south-1", config=app.Config(retries={"mode": "standard", "total_max_attempts": 2})))
+
+    def timed_out(request, **kwargs):
+        raise ReadTimeoutError(endpoint_url=request.url)
+
+    client.meta.events.register_first("before-send.sqs", timed_out)
+    metrics = app.RequestMetrics()
+    token = app.current_metrics.set(metrics)
+    try:
+        with pytest.raises(ReadTimeoutError):
+            client.get_queue_url(QueueName="q")
+    finally:
+        app.current_metrics.reset(token)
+
+    stats = metrics.aws["sqs"]
+    assert (stats["calls"], stats["errors"], stats["retries"]) == (1, 1, 1)
+    assert stats["ms"] > 0
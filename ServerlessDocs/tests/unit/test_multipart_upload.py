@@ -0,0 +1,69 @@
+from hello_world import app
+from tests import tokens
+
+MIB = 1024 * 1024
+
+
+def initiate(client, headers, size=6 * MIB, filename="scan.pdf"):
+    resp = client.post("/upload/multipart", headers=headers,
+                       json={"filename": filename, "size": size, "tags": ["scans"]})
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def upload_part(file_id, upload_id, number, body):
+    return app.s3.upload_part(Bucket=app.BUCKET, Key=app.object_key("user-1", file_id),
+                              UploadId=upload_id, PartNumber=number, Body=body)["ETag"]
+
+
+def test_part_size_scales_with_file_size():
+    assert app.multipart_part_size(10 * MIB) == app.MULTIPART_MIN_PART_SIZE
+    huge = 500 * 1024 ** 3
+    part_size = app.multipart_part_size(huge)
+    assert part_size % MIB == 0
+    assert -(-huge // part_size) <= app.MULTIPART_MAX_PARTS
+
+
+def test_resume_and_complete(client, headers):
+    upload = initiate(client, headers)
+    assert upload["partCount"] == 1
+    file_id = upload["fileId"]
+
+    urls = client.post(f"/upload/multipart/{file_id}/parts", headers=headers,
+                       json={"partNumbers": [1, 2]}).json()["parts"]
+    assert [u["partNumber"] for u in urls] == [1, 2]
+    assert "uploadId=" in urls[0]["uploadUrl"] and "partNumber=1" in urls[0]["uploadUrl"]
+
+    upload_part(file_id, upload["uploadId"], 1, b"a" * (5 * MIB))
+    listed = client.get(f"/upload/multipart/{file_id}/parts", headers=headers).json()["parts"]
+    assert [p["partNumber"] for p in listed] == [1]
+
+    # The client "resumes" with the part it is missing, then completes
+    upload_part(file_id, upload["uploadId"], 2, b"b" * 10)
+    resp = client.post(f"/upload/multipart/{file_id}/complete", headers=headers, json={})
+    assert resp.status_code == 200
+
+    obj = app.s3.head_object(Bucket=app.BUCKET, Key=app.object_key("user-1", file_id))
+    assert obj["ContentLength"] == 5 * MIB + 10
+    files = client.get("/files", headers=headers).json()["files"]
+    assert [f["fileId"] for f in files] == [file_id]
+    item = app.table.get_item(Key={"userId": "user-1", "fileId": file_id})["Item"]
+    assert "uploadId" not in item
+
+    again = client.post(f"/upload/multipart/{file_id}/complete", headers=headers, json={})
+    assert again.status_code == 409
+
+
+def test_abort_removes_pending_row(client, headers):
+    upload = initiate(client, headers)
+    resp = client.delete(f"/upload/multipart/{upload['fileId']}", headers=headers)
+    assert resp.status_code == 200
+    assert "Item" not in app.table.get_item(Key={"userId": "user-1", "fileId": upload["fileId"]})
+    assert app.s3.list_multipart_uploads(Bucket=app.BUCKET).get("Uploads", []) == []
+
+
+def test_other_users_cannot_touch_the_upload(client, headers):
+    upload = initiate(client, headers)
+    other = {"Authorization": f"Bearer {tokens.mint_token(sub='user-2')}"}
+    resp = client.get(f"/upload/multipart/{upload['fileId']}/parts", headers=other)
+    assert resp.status_code == 404
@@ -0,0 +1,149 @@
+import pytest
+
+from hello_world import app
+
+
+@pytest.fixture(autouse=True)
+def empty_search_cache():
+    app.search_indexes.clear()
+    yield
+    app.search_indexes.clear()
+
+
+@pytest.fixture()
+def partition_reads(monkeypatch):
+    """Counts full reads of a user's files (projected queries of the base partition)."""
+    reads = []
+    query = app.table.query
+
+    def counting_query(**params):
+        if ("IndexName" not in params
+                and params.get("ProjectionExpression") == app.FILE_LIST_PROJECTION["ProjectionExpression"]):
+            reads.append(params)
+        return query(**params)
+
+    monkeypatch.setattr(app.table, "query", counting_query)
+    return reads
+
+
+def search(client, headers, q):
+    resp = client.get("/search", params={"q": q}, headers=headers)
+    assert resp.status_code == 200
+    return [r["filename"] for r in resp.json()["results"]]
+
+
+def test_tokenize_splits_case_digits_and_punctuation():
+    assert app.tokenize("ProjectProposal_Ayush2025.docx") == ["project", "proposal", "ayush", "2025", "docx"]
+
+
+def test_search_prefix_fuzzy_and_tags(client, headers, upload):
+    upload("Invoice_2025_Jan.pdf", ["finance"])
+    upload("Team_Photo_Vinhack.jpg", ["event"])
+    upload("Budget_Spreadsheet_Q4.xlsx", ["finance"])
+
+    assert search(client, headers, "invo")[0] == "Invoice_2025_Jan.pdf"
+    assert search(client, headers, "budgte")[0] == "Budget_Spreadsheet_Q4.xlsx"
+    assert search(client, headers, "photp vinhack") == ["Team_Photo_Vinhack.jpg"]
+    assert sorted(search(client, headers, "finance")) == ["Budget_Spreadsheet_Q4.xlsx", "Invoice_2025_Jan.pdf"]
+
+
+def test_exact_match_ranks_above_prefix(client, headers, upload):
+    upload("notes_archive.txt")
+    upload("note.txt")
+    assert search(client, headers, "note")[0] == "note.txt"
+
+
+def test_search_index_follows_writes(client, headers, aws, upload):
+    file_id = upload("draft.docx")
+    assert search(client, headers, "draft") == ["draft.docx"]
+
+    aws.s3.put_object(Bucket=app.BUCKET, Key=app.object_key("user-1", file_id), Body=b"x")
+    client.put(f"/files/{file_id}/rename", json={"new_filename": "contract.docx"}, headers=headers)
+    assert search(client, headers, "draft") == []
+    assert search(client, headers, "contract") == ["contract.docx"]
+
+    client.put(f"/files/{file_id}/tags", json={"tags": ["legal"]}, headers=headers)
+    assert search(client, headers, "legal") == ["contract.docx"]
+
+    client.delete("/delete", params={"fileId": file_id}, headers=headers)
+    assert search(client, headers, "contract") == []
+
+
+def test_write_from_another_container_triggers_rebuild(client, headers, upload):
+    upload("alpha.txt")
+    assert search(client, headers, "alpha") == ["alpha.txt"]
+
+    # Simulate a write handled elsewhere: the record and version change, but
+    # this container's cached index is never told.
+    app.table.put_item(Item={"userId": "user-1", "fileId": "other", "filename": "beta.txt",
+                             "createdAt": "0000000001", "tags": []})
+    app.table.update_item(Key={"userId": "user-1#meta", "fileId": "search"},
+                          UpdateExpression="ADD version :one", ExpressionAttributeValues={":one": 1})
+    assert search(client, headers, "beta") == ["beta.txt"]
+
+
+def test_cold_container_loads_snapshot_and_replays_log(client, headers, upload, partition_reads):
+    upload("alpha.txt", ["work"])
+    assert search(client, headers, "alpha") == ["alpha.txt"]
+    assert len(partition_reads) == 1  # first search builds and saves the snapshot
+
+    file_id = upload("beta.txt")
+    client.put(f"/files/{file_id}/tags", json={"tags": ["work"]}, headers=headers)
+    app.search_indexes.clear()  # a new container
+
+    assert sorted(search(client, headers, "work")) == ["alpha.txt", "beta.txt"]
+    assert len(partition_reads) == 1
+
+
+def test_long_log_replay_saves_a_new_snapshot(client, headers, upload, monkeypatch):
+    monkeypatch.setattr(app, "SEARCH_SNAPSHOT_MAX_REPLAY", 1)
+    upload("alpha.txt")
+    search(client, headers, "alpha")
+    upload("beta.txt")
+    upload("gamma.txt")
+    app.search_indexes.clear()
+
+    search(client, headers, "gamma")
+    assert app.read_search_snapshot("user-1").version == 3
+
+
+def test_torn_snapshot_falls_back_to_rebuild(client, headers, upload, partition_reads, monkeypatch):
+    monkeypatch.setattr(app, "SEARCH_SNAPSHOT_CHUNK_BYTES", 64)
+    for i in range(5):
+        upload(f"report-{i}.pdf")
+    search(client, headers, "report")
+    app.table.update_item(Key={"userId": "user-1#search", "fileId": "snapshot#00001"},
+                          UpdateExpression="SET snapshotId = :other", ExpressionAttributeValues={":other": "x"})
+    app.search_indexes.clear()
+
+    assert len(search(client, headers, "report")) == 5
+    assert len(partition_reads) == 2
+
+
+def test_snapshot_round_trip():
+    index = app.SearchIndex(7)
+    index.add({"fileId": "1", "filename": "Quarterly_Report.pdf", "createdAt": "1", "tags": ["finance"]})
+    index.add({"fileId": "2", "filename": "photo.jpg", "createdAt": "2", "tags": []})
+    loaded = app.SearchIndex.from_snapshot(index.to_snapshot(), index.version)
+    assert loaded.version == 7
+    assert loaded.vocabulary == index.vocabulary
+    assert loaded.search("reprot") == index.search("reprot")
+
+
+def test_search_index_remove_keeps_vocabulary_consistent():
+    index = app.SearchIndex()
+    index.add({"fileId": "1", "filename": "alpha beta.txt", "createdAt": "1", "tags": []})
+    index.add({"fileId": "2", "filename": "beta.txt", "createdAt": "2", "tags": []})
+    index.remove("1")
+    assert "alpha" not in index.vocabulary
+    assert index.vocabulary == sorted(index.postings)
+    assert [r["fileId"] for r in index.search("alpah")] == []
+
+
+def test_rebuild_reads_the_base_table_without_pending_rows(client, headers, upload, partition_reads):
+    upload("Invoice_2025_Jan.pdf")
+    client.post("/upload/batch", headers=headers, json={"files": [{"filename": "Invoice_pending.pdf"}]})
+
+    index = app.build_search_index("user-1", 0)
+    assert [doc["filename"] for doc in index.docs.values()] == ["Invoice_2025_Jan.pdf"]
+    assert partition_reads[0]["ConsistentRead"] is True
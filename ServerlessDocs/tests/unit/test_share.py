@@ -0,0 +1,146 @@
+import json
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from hello_world import app
+from tests.fakes import FakeSES
+
+
+@pytest.fixture()
+def ses(monkeypatch):
+    fake = FakeSES()
+    monkeypatch.setattr(app, "ses", fake)
+    monkeypatch.setattr(app, "_share_template_ready", False)
+    monkeypatch.setattr(app, "share_queue", app.InProcessShareQueue())
+    monkeypatch.setattr(app, "ses_rate", app.RateLimiter(1000.0))
+    monkeypatch.setattr(app, "SHARE_RETRY_BASE_DELAY", 0)
+    return fake
+
+
+def test_share_batch_is_queued_and_sent_in_bulk(client, headers, ses, monkeypatch, upload):
+    monkeypatch.setattr(app, "SES_BULK_DESTINATIONS", 2)
+    files = [upload("a.pdf"), upload("b.pdf")]
+    recipients = ["x@example.com", "y@example.com", "z@example.com"]
+
+    job = client.post("/share/batch", json={"fileIds": files, "recipients": recipients},
+                      headers=headers).json()
+    assert job["recipients"] == 3
+
+    # The in-process queue is drained after the response
+    assert [call["recipients"] for call in ses.calls] == [recipients[:2], recipients[2:]]
+    assert [f["filename"] for f in ses.calls[0]["data"]["files"]] == ["a.pdf", "b.pdf"]
+    assert list(ses.templates) == [app.SHARE_EMAIL_TEMPLATE]
+
+    status = client.get(f"/share/jobs/{job['jobId']}", headers=headers).json()
+    assert status["status"] == "completed"
+    assert (status["sent"], status["failed"]) == (3, 0)
+
+
+def test_single_share_keeps_its_query_parameters(client, headers, ses, upload):
+    file_id = upload("a.pdf")
+    resp = client.post("/share", params={"fileId": file_id, "recipient": "x@example.com"}, headers=headers)
+    assert resp.status_code == 200
+    assert ses.calls[0]["recipients"] == ["x@example.com"]
+
+
+def test_throttled_recipients_are_retried(client, headers, ses, upload):
+    attempts = []
+
+    def statuses(recipients):
+        attempts.append(list(recipients))
+        if len(attempts) == 1:
+            return ["Success", "AccountThrottled", "MessageRejected"]
+        return ["Success"] * len(recipients)
+
+    ses.statuses = statuses
+    file_id = upload("a.pdf")
+    job = client.post("/share/batch", headers=headers, json={
+        "fileIds": [file_id], "recipients": ["a@example.com", "b@example.com", "c@example.com"],
+    }).json()
+
+    assert attempts == [["a@example.com", "b@example.com", "c@example.com"], ["b@example.com"]]
+    status = client.get(f"/share/jobs/{job['jobId']}", headers=headers).json()
+    assert status["status"] == "completed_with_errors"
+    assert status["failedRecipients"] == ["c@example.com"]
+
+
+def test_share_links_are_signed_for_their_full_lifetime(client, headers, ses, upload):
+    file_id = upload("a.pdf")
+    client.get("/download", params={"fileId": file_id}, headers=headers)
+    client.post("/share", params={"fileId": file_id, "recipient": "x@example.com"}, headers=headers)
+    url = ses.calls[0]["data"]["files"][0]["url"]
+    assert parse_qs(urlparse(url).query)["X-Amz-Expires"] == [str(app.SHARE_URL_EXPIRY)]
+    assert app.presigned_urls.get(f"user-1|{file_id}|{app.SHARE_URL_EXPIRY}") is None
+
+
+def test_share_of_unknown_file_is_rejected(client, headers, ses):
+    resp = client.post("/share/batch", headers=headers,
+                       json={"fileIds": ["nope"], "recipients": ["a@example.com"]})
+    assert resp.status_code == 404
+    assert ses.calls == []
+
+
+def test_sqs_records_are_processed_with_partial_failures(client, headers, ses, monkeypatch, upload):
+    queue = app.InProcessShareQueue()
+    monkeypatch.setattr(app, "share_queue", queue)
+    monkeypatch.setattr(app, "_schedule_drain", lambda background_tasks: None)
+    file_id = upload("a.pdf")
+    job = client.post("/share/batch", headers=headers,
+                      json={"fileIds": [file_id], "recipients": ["a@example.com"]}).json()
+    assert ses.calls == []
+
+    records = [{"messageId": "1", "body": json.dumps(m), "eventSource": "aws:sqs"} for m in queue.take()]
+    records.append({"messageId": "2", "body": "not json", "eventSource": "aws:sqs"})
+    assert app.lambda_handler({"Records": records}, None) == {"batchItemFailures": [{"itemIdentifier": "2"}]}
+    assert client.get(f"/share/jobs/{job['jobId']}", headers=headers).json()["sent"] == 1
+
+
+def test_links_are_signed_when_the_message_is_sent(client, headers, ses, monkeypatch, upload):
+    queue = app.InProcessShareQueue()
+    monkeypatch.setattr(app, "share_queue", queue)
+    monkeypatch.setattr(app, "_schedule_drain", lambda background_tasks: None)
+    kept, deleted = upload("a.pdf"), upload("b.pdf")
+    client.post("/share/batch", headers=headers,
+                json={"fileIds": [kept, deleted], "recipients": ["a@example.com"]})
+    [message] = queue.take()
+    assert message["fileIds"] == [kept, deleted] and "files" not in message
+
+    client.put(f"/files/{kept}/rename", json={"new_filename": "renamed.pdf"}, headers=headers)
+    client.delete("/delete", params={"fileId": deleted}, headers=headers)
+    assert app.send_share_message(message)["sent"] == ["a@example.com"]
+    [shared] = ses.calls[0]["data"]["files"]
+    assert shared["filename"] == "renamed.pdf"
+    assert parse_qs(urlparse(shared["url"]).query)["X-Amz-Expires"] == [str(app.SHARE_URL_EXPIRY)]
+
+
+def test_redelivered_message_skips_recipients_already_handled(client, headers, ses, monkeypatch, upload):
+    queue = app.InProcessShareQueue()
+    monkeypatch.setattr(app, "share_queue", queue)
+    monkeypatch.setattr(app, "_schedule_drain", lambda background_tasks: None)
+    job = client.post("/share/batch", headers=headers, json={
+        "fileIds": [upload("a.pdf")], "recipients": ["a@example.com", "b@example.com"],
+    }).json()
+    [message] = queue.take()
+
+    # The first delivery timed out after a@example.com was sent
+    app.record_share_outcome(message, ["a@example.com"], [])
+    assert app.send_share_message(message) == {"sent": ["b@example.com"], "failed": []}
+    assert app.send_share_message(message) == {"sent": [], "failed": []}
+    assert [call["recipients"] for call in ses.calls] == [["b@example.com"]]
+    status = client.get(f"/share/jobs/{job['jobId']}", headers=headers).json()
+    assert (status["status"], status["sent"], status["failed"]) == ("completed", 2, 0)
+
+
+def test_rate_limiter_spaces_out_sends():
+    now = [0.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    limiter = app.RateLimiter(10.0, clock=lambda: now[0], sleep=sleep)
+    limiter.acquire(10)
+    limiter.acquire(5)
+    assert slept == [0.5]
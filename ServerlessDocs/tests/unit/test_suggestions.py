@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+
+import pytest
+
+from hello_world import app
+
+
+@pytest.fixture()
+def bedrock(bedrock):
+    bedrock.responder = lambda prompt: "img_1234.jpg" if "file naming" in prompt else "photo, media"
+    return bedrock
+
+
+def test_repeated_tag_suggestion_skips_model(client, headers, bedrock):
+    first = client.get("/suggest-tags", params={"filename": "IMG_1234.jpg"}, headers=headers).json()
+    second = client.get("/suggest-tags", params={"filename": " img_1234.JPG "}, headers=headers).json()
+    assert first == second == {"tags": ["photo", "media"]}
+    assert len(bedrock.calls) == 1
+    assert app.suggestion_cache_stats["memory_hit"] == 1
+
+
+def test_table_tier_survives_a_cold_process_cache(client, headers, bedrock):
+    client.get("/suggest-name", params={"filename": "IMG_1234.jpg"}, headers=headers)
+    app.suggestion_cache.clear()
+    body = client.get("/suggest-name", params={"filename": "IMG_1234.jpg"}, headers=headers).json()
+    assert body == {"suggested_name": "img_1234.jpg"}
+    assert len(bedrock.calls) == 1
+    assert app.suggestion_cache_stats["table_hit"] == 1
+
+
+def test_cache_lookups_are_published_per_tier(client, headers, bedrock):
+    for _ in range(2):
+        client.get("/suggest-tags", params={"filename": "IMG_1234.jpg"}, headers=headers)
+    lookups = [(d["Tier"], d["SuggestionCacheHit"], d["SuggestionCacheMiss"])
+               for d in app.metrics_sink.documents if "SuggestionCacheHit" in d]
+    assert lookups == [("memory", 0, 1), ("table", 0, 1), ("memory", 1, 0)]
+
+
+def test_failed_suggestion_is_not_cached(client, headers, bedrock):
+    def broken(prompt):
+        raise RuntimeError("throttled")
+
+    bedrock.responder = broken
+    for _ in range(2):
+        body = client.get("/suggest-name", params={"filename": "Report.pdf"}, headers=headers).json()
+        assert body == {"suggested_name": "report.pdf"}
+    assert len(bedrock.calls) == 2
+
+
+def test_cache_key_changes_with_prompt_version(monkeypatch):
+    before = app.suggestion_cache_key("tags", "a.pdf")
+    monkeypatch.setitem(app.SUGGESTION_PROMPT_VERSIONS, "tags", "2")
+    assert app.suggestion_cache_key("tags", "a.pdf") != before
+
+
+def batch_responder(broken_index=None):
+    def respond(prompt):
+        if "For every file below" not in prompt:
+            # Single-file fallback prompts
+            return "fallback.pdf" if "file naming" in prompt else "fallback"
+        lines = prompt.split("Files (index: filename):\n", 1)[1].split("\n\n", 1)[0].splitlines()
+        entries = []
+        for line in lines:
+            index, name = line.split(": ", 1)
+            index = int(index)
+            if index == broken_index:
+                entries.append({"i": index, "name": 42})
+            else:
+                entries.append({"i": index, "name": json.loads(name).lower(), "tags": ["batch"]})
+        return "Here you go:\n" + json.dumps(entries)
+    return respond
+
+
+def test_batch_suggestions_use_one_model_call(client, headers, bedrock):
+    bedrock.responder = batch_responder()
+    names = [f"Scan_{i}.PDF" for i in range(20)]
+    body = client.post("/suggest/batch", json={"filenames": names}, headers=headers).json()
+    assert [r["suggested_name"] for r in body["results"]] == [n.lower() for n in names]
+    assert len(bedrock.calls) == 1
+
+    # Second time round everything comes from the cache
+    client.post("/suggest/batch", json={"filenames": names}, headers=headers)
+    assert len(bedrock.calls) == 1
+
+
+def test_batch_malformed_entry_is_retried_in_a_smaller_prompt(client, headers, bedrock):
+    bedrock.responder = batch_responder(broken_index=1)
+    body = client.post("/suggest/batch", json={"filenames": ["a.pdf", "b.pdf", "c.pdf"]},
+                       headers=headers).json()
+    results = {r["filename"]: r for r in body["results"]}
+    assert results["a.pdf"]["tags"] == ["batch"]
+    # b.pdf is index 0 of the retry prompt, which answers it
+    assert results["b.pdf"] == {"filename": "b.pdf", "suggested_name": "b.pdf", "tags": ["batch"]}
+    assert len(bedrock.calls) == 2
+
+
+def test_unanswered_files_fall_back_a_few_at_a_time_without_hedging(client, headers, monkeypatch, bedrock):
+    monkeypatch.setattr(app, "SUGGESTION_HEDGE_AFTER", 0)
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def respond(prompt):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+        if "For every file below" in prompt:
+            return "Sorry, I can't help with that."
+        return "fallback.pdf" if "file naming" in prompt else "fallback"
+
+    bedrock.responder = respond
+    names = [f"Scan_{i}.PDF" for i in range(20)]
+    body = client.post("/suggest/batch", json={"filenames": names}, headers=headers).json()
+    assert all(r["tags"] == ["fallback"] for r in body["results"])
+    # one batch prompt, two retry prompts of 10, then name and tags per file
+    assert len(bedrock.calls) == 1 + 2 + 2 * len(names)
+    assert state["peak"] <= 2 * app.SUGGEST_BATCH_FALLBACK_CONCURRENCY
+    assert app.bedrock_breaker.state == "closed"
+
+
+def test_chunks_respect_token_budget(monkeypatch):
+    monkeypatch.setattr(app, "SUGGEST_BATCH_INPUT_TOKENS",
+                        app.estimate_tokens(app.SUGGEST_BATCH_PROMPT) + 100)
+    chunks = app.chunk_for_prompt([f"{'x' * 100}_{i}.pdf" for i in range(10)])
+    assert len(chunks) > 1
+    assert sum(len(c) for c in chunks) == 10
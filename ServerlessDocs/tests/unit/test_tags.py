@@ -0,0 +1,63 @@
+from hello_world import app
+
+
+def filenames(resp):
+    return sorted(f["filename"] for f in resp.json()["files"])
+
+
+def test_tag_filter_and_or(client, headers, upload):
+    upload("a.pdf", ["Finance", "invoice"])
+    upload("b.pdf", ["finance"])
+    upload("c.jpg", ["photo"])
+
+    both = client.get("/files", params=[("tag", "finance"), ("tag", "invoice")], headers=headers)
+    assert filenames(both) == ["a.pdf"]
+
+    either = client.get("/files", params=[("tag", "invoice"), ("tag", "photo"), ("match", "any")],
+                        headers=headers)
+    assert filenames(either) == ["a.pdf", "c.jpg"]
+
+    none = client.get("/files", params={"tag": "missing"}, headers=headers)
+    assert none.json()["files"] == []
+
+
+def test_tag_counts_follow_updates_and_deletes(client, headers, upload):
+    first = upload("a.pdf", ["finance", "invoice"])
+    upload("b.pdf", ["finance"])
+    assert client.get("/tags", headers=headers).json()["tags"] == [
+        {"tag": "finance", "count": 2},
+        {"tag": "invoice", "count": 1},
+    ]
+
+    client.put(f"/files/{first}/tags", json={"tags": ["receipt"]}, headers=headers)
+    client.delete("/delete", params={"fileId": first}, headers=headers)
+    assert client.get("/tags", headers=headers).json()["tags"] == [{"tag": "finance", "count": 1}]
+
+
+def test_tag_view_reflects_rename(client, headers, aws, upload):
+    file_id = upload("a.pdf", ["finance"])
+    aws.s3.put_object(Bucket=app.BUCKET, Key=app.object_key("user-1", file_id), Body=b"x")
+    client.put(f"/files/{file_id}/rename", json={"new_filename": "b.pdf"}, headers=headers)
+    assert filenames(client.get("/files", params={"tag": "finance"}, headers=headers)) == ["b.pdf"]
+
+
+def test_any_tag_pages_do_not_repeat(client, headers, upload):
+    for i in range(7):
+        upload(f"f{i}.pdf", ["x" if i % 2 else "y"])
+    seen = []
+    cursor = None
+    while True:
+        params = [("tag", "x"), ("tag", "y"), ("match", "any"), ("limit", "3")]
+        if cursor:
+            params.append(("cursor", cursor))
+        body = client.get("/files", params=params, headers=headers).json()
+        seen.extend(f["fileId"] for f in body["files"])
+        cursor = body["nextCursor"]
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 7
+
+
+def test_tag_index_does_not_leak_into_plain_listing(client, headers, upload):
+    upload("a.pdf", ["finance"])
+    assert len(client.get("/files", headers=headers).json()["files"]) == 1
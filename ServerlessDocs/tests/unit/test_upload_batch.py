@@ -0,0 +1,87 @@
+from hello_world import app
+
+
+def object_created(key):
+    return {
+        "source": "aws.s3",
+        "detail-type": "Object Created",
+        "detail": {"bucket": {"name": app.BUCKET}, "object": {"key": key, "size": 1}},
+    }
+
+
+def s3_notification(key):
+    return {"Records": [{
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "s3": {"bucket": {"name": app.BUCKET}, "object": {"key": key}},
+    }]}
+
+
+def test_batch_upload_rows_are_pending_until_confirmed(client, headers):
+    body = client.post("/upload/batch", headers=headers, json={"files": [
+        {"filename": " report.pdf ", "tags": ["Work"]},
+        {"filename": "photo one.jpg"},
+    ]}).json()
+    uploads = body["uploads"]
+    assert [u["filename"] for u in uploads] == ["report.pdf", "photo one.jpg"]
+    assert all(u["uploadUrl"].startswith("https://") for u in uploads)
+
+    item = app.table.get_item(Key={"userId": "user-1", "fileId": uploads[0]["fileId"]})["Item"]
+    assert item["uploadStatus"] == "pending" and "expiresAt" in item
+    assert client.get("/files", headers=headers).json()["files"] == []
+
+    assert app.lambda_handler(object_created(f"user-1/{uploads[0]['fileId']}/report.pdf"), None)["confirmed"] == 1
+    notification_key = f"user-1/{uploads[1]['fileId']}/photo+one.jpg"
+    assert app.lambda_handler(s3_notification(notification_key), None)["confirmed"] == 1
+
+    files = client.get("/files", headers=headers).json()["files"]
+    assert sorted(f["filename"] for f in files) == ["photo one.jpg", "report.pdf"]
+    assert client.get("/tags", headers=headers).json()["tags"] == [{"tag": "work", "count": 1}]
+    item = app.table.get_item(Key={"userId": "user-1", "fileId": uploads[0]["fileId"]})["Item"]
+    assert "uploadStatus" not in item and "expiresAt" not in item
+
+
+def test_repeated_or_unknown_object_events_are_ignored(client, headers):
+    file_id = client.post("/upload/batch", headers=headers,
+                          json={"files": [{"filename": "a.txt"}]}).json()["uploads"][0]["fileId"]
+    key = f"user-1/{file_id}/a.txt"
+    assert app.handle_s3_event(object_created(key))["confirmed"] == 1
+    assert app.handle_s3_event(object_created(key))["confirmed"] == 0
+    assert app.handle_s3_event(object_created("user-1/unknown/b.txt"))["confirmed"] == 0
+    assert app.handle_s3_event(object_created("not-a-file-key"))["confirmed"] == 0
+    assert len(client.get("/tags", headers=headers).json()["tags"]) == 0
+
+
+def test_batch_upload_rejects_empty_filenames(client, headers):
+    resp = client.post("/upload/batch", headers=headers, json={"files": [{"filename": "  "}]})
+    assert resp.status_code == 400
+
+
+def tag_counts(client, headers):
+    return {t["tag"]: t["count"] for t in client.get("/tags", headers=headers).json()["tags"]}
+
+
+def test_edits_to_pending_rows_stay_out_of_the_indexes(client, headers):
+    file_id = client.post("/upload/batch", headers=headers,
+                          json={"files": [{"filename": "a.txt", "tags": ["a"]}]}).json()["uploads"][0]["fileId"]
+    assert client.put(f"/files/{file_id}/tags", json={"tags": ["a", "b"]}, headers=headers).status_code == 200
+    assert client.patch(f"/files/{file_id}", json={"filename": "c.txt", "tags": ["a", "b", "c"]},
+                        headers=headers).status_code == 200
+    assert client.get("/files", params={"tag": "b"}, headers=headers).json()["files"] == []
+    assert client.get("/search", params={"q": "c"}, headers=headers).json()["results"] == []
+    assert tag_counts(client, headers) == {}
+
+    app.handle_s3_event(object_created(app.object_key("user-1", file_id)))
+    assert tag_counts(client, headers) == {"a": 1, "b": 1, "c": 1}
+    assert [f["filename"] for f in client.get("/files", params={"tag": "b"}, headers=headers).json()["files"]] \
+        == ["c.txt"]
+
+
+def test_deleting_a_pending_row_leaves_counts_alone(client, headers, upload):
+    upload("kept.txt", ["a"])
+    pending = client.post("/upload/batch", headers=headers,
+                          json={"files": [{"filename": f"p{i}.txt", "tags": ["a"]} for i in range(2)]}).json()
+    ids = [u["fileId"] for u in pending["uploads"]]
+    client.delete("/delete", params={"fileId": ids[0]}, headers=headers)
+    client.post("/files/delete-batch", json={"fileIds": ids[1:]}, headers=headers)
+    assert tag_counts(client, headers) == {"a": 1}